@@ -2,10 +2,32 @@
 # Author: Emmanuel Odeke <odeke@ualberta.ca>
 
 import io
+import gc
+import bz2
 import json
+import lzma
+import mmap
+import time
+import zlib
+import struct
 import pickle
+import marshal
+import itertools
+import functools
+import collections
 
-from entrails.utils import isCallable, isCallableAttr
+# Optional fast backends, registered only when importable
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from entrails.utils import isCallable, isCallableAttr, readFully
 
 class Serializer:
     def __init__(self, serialzr=None, deserialzr=None, preSerializr=None):
@@ -37,6 +59,15 @@ class Serializer:
     def ioStream(self, data):
         return data
 
+    def dump(self, data, fileObj):
+        # Writes the serialized form, exactly the bytes that get hashed
+        # and uploaded, into the binary writable fileObj.
+        fileObj.write(self.preHasher(self.serialize(data)))
+
+    def load(self, stream, contentLength=None):
+        # Deserializes straight from a binary stream eg a download
+        return self.deserialize(readFully(stream, contentLength))
+
     def preHasher(self, data):
         return data
 
@@ -50,12 +81,209 @@ class BinarySerializer(Serializer):
     def ioStream(self, data):
         return io.BytesIO(super().byteFy(super().serialize(data)))
 
+    def dump(self, data, fileObj):
+        # pickle writes its frames out directly, no intermediate bytes object
+        pickle.dump(data, fileObj)
+
+    def load(self, stream, contentLength=None):
+        if isinstance(stream, io.RawIOBase):
+            stream = io.BufferedReader(stream, io.DEFAULT_BUFFER_SIZE * 16)
+
+        return pickle.load(stream)
+
     def preHasher(self, data):
         return super().byteFy(data)
 
     def preDeserialization(self, data):
         return super().byteFy(data)
 
+# Out-of-band buffers need pickle protocol 5 ie Python 3.8+
+HAS_PICKLE5 = pickle.HIGHEST_PROTOCOL >= 5
+
+# bytes/bytearrays at least this large are framed out-of-band
+OUT_OF_BAND_THRESHOLD = 64 * 1024
+
+# Objects looked at when checking a payload for large bytes/bytearrays
+OUT_OF_BAND_SCAN_LIMIT = 100000
+
+BYTES_LIKE = frozenset((bytes, bytearray))
+SCANNED_CONTAINERS = frozenset((list, tuple, dict, set, frozenset))
+
+def hasLargeBytes(data, threshold, limit=OUT_OF_BAND_SCAN_LIMIT):
+    '''
+    Whether data, or the lists, tuples, dicts and sets nested in it, hold a
+    bytes or bytearray of at least threshold bytes. Walked a level at a time
+    by gc.get_referents, it gives up and returns False after limit objects.
+    '''
+    if type(data) in BYTES_LIKE:
+        return len(data) >= threshold
+
+    level, scanned = [data], 0
+    while level and scanned < limit:
+        children = gc.get_referents(*level)
+        scanned += len(children)
+        if not BYTES_LIKE.isdisjoint(map(type, children)) and any(
+                len(obj) >= threshold for obj in children if type(obj) in BYTES_LIKE):
+            return True
+
+        level = list(itertools.compress(children,
+                        map(SCANNED_CONTAINERS.__contains__, map(type, children))))
+
+    return False
+
+PICKLE5_MAGIC = b'RPK5'
+# magic, buffer count, pickle length; then a kind and length per buffer
+pickle5Header = struct.Struct('<4sIQ')
+pickle5Buffer = struct.Struct('<BQ')
+
+# Buffer kinds: handed to pickle as protocol 5 buffers, or restored as bytes/bytearray
+PICKLE_BUFFER, BYTES_BUFFER, BYTEARRAY_BUFFER = 0, 1, 2
+
+def readExactly(stream, view):
+    # Fills the memoryview view from stream, returns the byte count read
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+
+    return filled
+
+class Pickle5Serializer(BinarySerializer):
+    '''
+    Pickle protocol 5 with large buffers kept out-of-band. The blob is framed as
+        header | buffer kinds and lengths | pickle stream | buffer 0 | buffer 1 ...
+    so buffers are written straight from their memory, never copied into the
+    pickle stream, and read back into memory allocated just for them or
+    mapped from the file when loading off a local file eg the blob cache.
+    numpy arrays and pickle.PickleBuffer go out-of-band on their own,
+    bytes/bytearrays do from threshold bytes up when hasLargeBytes finds them.
+    '''
+    def __init__(self, threshold=OUT_OF_BAND_THRESHOLD):
+        if not HAS_PICKLE5:
+            raise ValueError('Pickle protocol 5 requires Python 3.8 or newer')
+
+        super(Pickle5Serializer, self).__init__()
+        self.threshold = threshold
+
+    def __pickle(self, data):
+        buffers = [] # (kind, memoryview) in the order they are framed
+        def bufferCallback(pickleBuffer):
+            try:
+                buffers.append((PICKLE_BUFFER, pickleBuffer.raw()))
+            except BufferError:
+                return True # Non-contiguous, serialized in-band instead
+
+        pickled = io.BytesIO()
+        threshold = self.threshold
+        if not hasLargeBytes(data, threshold):
+            # A persistent_id hook would call into Python for every object
+            pickle.Pickler(pickled, protocol=5, buffer_callback=bufferCallback).dump(data)
+            return pickled.getbuffer(), buffers
+
+        # The C pickler never consults reducer_override for bytes/bytearray,
+        # persistent ids are the hook that sees them.
+        class OutOfBandPickler(pickle.Pickler):
+            def persistent_id(self, obj):
+                kind = type(obj)
+                if (kind is bytes or kind is bytearray) and len(obj) >= threshold:
+                    buffers.append((BYTES_BUFFER if kind is bytes else BYTEARRAY_BUFFER,
+                                                                    memoryview(obj)))
+                    return len(buffers) - 1
+
+                return None
+
+        OutOfBandPickler(pickled, protocol=5, buffer_callback=bufferCallback).dump(data)
+        return pickled.getbuffer(), buffers
+
+    def dump(self, data, fileObj):
+        pickled, buffers = self.__pickle(data)
+        fileObj.write(pickle5Header.pack(PICKLE5_MAGIC, len(buffers), len(pickled)))
+        for kind, buf in buffers:
+            fileObj.write(pickle5Buffer.pack(kind, buf.nbytes))
+
+        fileObj.write(pickled)
+        for kind, buf in buffers:
+            fileObj.write(buf)
+
+    def serialize(self, data):
+        sink = io.BytesIO()
+        self.dump(data, sink)
+        return sink.getvalue()
+
+    def deserialize(self, data):
+        return self.load(io.BytesIO(data))
+
+    def __mapBuffers(self, stream, lengths):
+        # Returns memoryviews of the buffers mapped from stream's file, or None
+        try:
+            fileno = stream.fileno()
+            offset = stream.tell()
+            mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except Exception:
+            return None
+
+        if offset + sum(lengths) > len(mapped):
+            mapped.close()
+            return None
+
+        view = memoryview(mapped)
+        buffers = []
+        for n in lengths:
+            buffers.append(view[offset:offset + n])
+            offset += n
+
+        return buffers
+
+    def __readBuffers(self, stream, lengths):
+        buffers = None
+        if isinstance(stream, (io.BufferedReader, io.FileIO)):
+            buffers = self.__mapBuffers(stream, lengths)
+        if buffers is not None:
+            return buffers
+
+        buffers = []
+        for n in lengths:
+            buf = bytearray(n)
+            if readExactly(stream, memoryview(buf)) != n:
+                raise pickle.UnpicklingError('Truncated pickle5 buffer')
+            buffers.append(buf)
+
+        return buffers
+
+    def load(self, stream, contentLength=None):
+        header = bytearray(pickle5Header.size)
+        if readExactly(stream, memoryview(header)) != len(header):
+            raise pickle.UnpicklingError('Truncated pickle5 header')
+
+        magic, count, pickleLength = pickle5Header.unpack(header)
+        if magic != PICKLE5_MAGIC:
+            raise pickle.UnpicklingError('Not a pickle5 framed blob')
+
+        table = bytearray(pickle5Buffer.size * count)
+        pickled = bytearray(pickleLength)
+        if readExactly(stream, memoryview(table)) != len(table) or \
+                readExactly(stream, memoryview(pickled)) != len(pickled):
+            raise pickle.UnpicklingError('Truncated pickle5 blob')
+
+        table = list(pickle5Buffer.iter_unpack(table))
+        kinds = [kind for kind, n in table]
+        buffers = self.__readBuffers(stream, [n for kind, n in table])
+
+        def persistentLoad(pid):
+            kind, buf = kinds[pid], buffers[pid]
+            if kind == BYTES_BUFFER:
+                return bytes(buf)
+            # A bytearray read off the stream is handed back as is, no copy
+            return buf if isinstance(buf, bytearray) else bytearray(buf)
+
+        unpickler = pickle.Unpickler(io.BytesIO(pickled), buffers=[
+            buf for kind, buf in zip(kinds, buffers) if kind == PICKLE_BUFFER
+        ])
+        unpickler.persistent_load = persistentLoad
+        return unpickler.load()
+
 class JSONSerializer(Serializer):
     def __init__(self):
         super(JSONSerializer, self).__init__(serialzr=json.dumps, deserialzr=json.loads)
@@ -63,8 +291,377 @@ class JSONSerializer(Serializer):
     def ioStream(self, data):
         return io.StringIO(super().stringify(super().serialize(data)))
 
+    def load(self, stream, contentLength=None):
+        # The stdlib has no incremental decoder, json.loads takes the raw bytes
+        return json.loads(readFully(stream, contentLength))
+
     def preHasher(self, data):
         return super().byteFy(data)
 
     def preDeserialization(self, data):
         return super().stringify(data)
+
+# Stdlib codecs usable by CompressedSerializer, name -> (compressor, decompressor)
+CODECS = {
+    'zlib': (lambda level: zlib.compressobj(6 if level is None else level),
+             lambda: zlib.decompressobj()),
+    # Raw zlib streams in a gzip container, the header's mtime is always 0
+    # so equal payloads yield equal bytes and thus equal checkSums.
+    'gzip': (lambda level: zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31),
+             lambda: zlib.decompressobj(31)),
+    'bz2': (lambda level: bz2.BZ2Compressor(9 if level is None else level),
+            lambda: bz2.BZ2Decompressor()),
+    'lzma': (lambda level: lzma.LZMACompressor(preset=level),
+             lambda: lzma.LZMADecompressor()),
+}
+
+# Payloads smaller than this are sent as is
+DEFAULT_COMPRESSION_THRESHOLD = 4096
+# How much of the payload is sampled to decide whether compression pays off
+COMPRESSION_PROBE_SIZE = 256 * 1024
+# Compression is skipped unless the sample shrinks to at most this fraction
+DEFAULT_MAX_RATIO = 0.9
+
+def splitTag(metaData):
+    # 'pickle+zlib' -> ('pickle', 'zlib'), 'pickle' -> ('pickle', None)
+    base, sep, codec = (metaData or '').partition('+')
+    return base, codec or None
+
+class CompressingWriter(io.RawIOBase):
+    '''
+    Writable stream that compresses what is written to it into sink.
+    The first bytes are held back to decide whether compression is worth
+    it at all, if not everything is passed through to sink untouched.
+    '''
+    def __init__(self, codec, sink, level=None,
+            threshold=DEFAULT_COMPRESSION_THRESHOLD, maxRatio=DEFAULT_MAX_RATIO):
+        self.__newCompressor = CODECS[codec][0]
+        self.__level = level
+        self.__sink = sink
+        self.__threshold = threshold
+        self.__maxRatio = maxRatio
+        self.__probe = bytearray()
+        self.__compressor = None
+        self.__decided = False
+        self.compressed = False
+
+    def writable(self):
+        return True
+
+    def __decide(self):
+        probe = self.__probe
+        self.__decided = True
+        self.__probe = None
+
+        # A cheap fast-level zlib pass over the sample estimates compressibility
+        if len(probe) >= self.__threshold and \
+                len(zlib.compress(probe, 1)) <= len(probe) * self.__maxRatio:
+            self.compressed = True
+            self.__compressor = self.__newCompressor(self.__level)
+            probe = self.__compressor.compress(probe)
+
+        if probe:
+            self.__sink.write(probe)
+
+    def write(self, data):
+        n = len(data) if isinstance(data, bytes) else memoryview(data).nbytes
+        if not self.__decided:
+            self.__probe += data
+            if len(self.__probe) >= max(self.__threshold, COMPRESSION_PROBE_SIZE):
+                self.__decide()
+        elif self.__compressor is not None:
+            out = self.__compressor.compress(data)
+            if out:
+                self.__sink.write(out)
+        else:
+            self.__sink.write(data)
+
+        return n
+
+    def close(self):
+        if not self.closed:
+            if not self.__decided:
+                self.__decide()
+            if self.__compressor is not None:
+                self.__sink.write(self.__compressor.flush())
+                self.__compressor = None
+
+        super().close()
+
+class DecompressingReader(io.RawIOBase):
+    # Readable stream decompressing source on the fly
+    def __init__(self, codec, source, chunkSize=io.DEFAULT_BUFFER_SIZE * 8):
+        self.__decompressor = CODECS[codec][1]()
+        self.__source = source
+        self.__chunkSize = chunkSize
+        self.__pending = b''
+        self.__offset = 0
+        self.__eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.__offset >= len(self.__pending):
+            if self.__eof:
+                return 0
+
+            chunk = self.__source.read(self.__chunkSize)
+            if not chunk:
+                self.__eof = True
+                flush = getattr(self.__decompressor, 'flush', None)
+                self.__pending, self.__offset = (flush() if flush else b''), 0
+            else:
+                self.__pending, self.__offset = self.__decompressor.decompress(chunk), 0
+
+        n = min(len(b), len(self.__pending) - self.__offset)
+        b[:n] = self.__pending[self.__offset:self.__offset + n]
+        self.__offset += n
+        return n
+
+class CompressedSerializer(Serializer):
+    '''
+    Wraps another serializer, compressing its output with a stdlib codec.
+
+    Params:
+        inner: the serializer producing the payload eg BinarySerializer()
+        innerTag: inner's metaData tag eg 'pickle'
+        codec: one of CODECS ie 'zlib', 'gzip', 'bz2', 'lzma'
+        level: the codec's compression level or preset, None for its default
+        threshold: payloads smaller than this are left uncompressed
+    '''
+    def __init__(self, inner, innerTag, codec='zlib', level=None,
+            threshold=DEFAULT_COMPRESSION_THRESHOLD, maxRatio=DEFAULT_MAX_RATIO):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec %s, expected one of %s'%(codec, sorted(CODECS)))
+
+        super(CompressedSerializer, self).__init__()
+        self.inner = inner
+        self.innerTag = innerTag
+        self.codec = codec
+        self.level = level
+        self.threshold = threshold
+        self.maxRatio = maxRatio
+
+    @property
+    def tag(self):
+        return '%s+%s'%(self.innerTag, self.codec)
+
+    def dump(self, data, fileObj):
+        # Returns the metaData tag describing what was actually written ie
+        # innerTag alone if compression was skipped.
+        writer = CompressingWriter(self.codec, fileObj, self.level, self.threshold, self.maxRatio)
+        self.inner.dump(data, writer)
+        writer.close()
+
+        return self.tag if writer.compressed else self.innerTag
+
+    def load(self, stream, contentLength=None):
+        return self.inner.load(DecompressingReader(self.codec, stream))
+
+class CompactJSONSerializer(JSONSerializer):
+    # JSON without the whitespace json.dumps puts after separators
+    def __init__(self):
+        Serializer.__init__(self,
+            serialzr=functools.partial(json.dumps, separators=(',', ':')),
+            deserialzr=json.loads
+        )
+
+class MarshalSerializer(Serializer):
+    '''
+    Fast path for plain builtin values ie None, bools, numbers, strings,
+    bytes and lists/tuples/sets/dicts of them. The format is only stable
+    within the same Python version, share such blobs accordingly.
+    '''
+    def __init__(self):
+        super(MarshalSerializer, self).__init__(serialzr=marshal.dumps, deserialzr=marshal.loads)
+
+    def load(self, stream, contentLength=None):
+        return marshal.loads(readFully(stream, contentLength))
+
+    def preHasher(self, data):
+        return super().byteFy(data)
+
+    def preDeserialization(self, data):
+        return super().byteFy(data)
+
+class OrjsonSerializer(Serializer):
+    def __init__(self):
+        super(OrjsonSerializer, self).__init__(serialzr=orjson.dumps, deserialzr=orjson.loads)
+
+    def load(self, stream, contentLength=None):
+        return orjson.loads(readFully(stream, contentLength))
+
+    def preHasher(self, data):
+        return super().byteFy(data)
+
+class MsgpackSerializer(Serializer):
+    def __init__(self):
+        super(MsgpackSerializer, self).__init__(
+            serialzr=functools.partial(msgpack.packb, use_bin_type=True),
+            deserialzr=functools.partial(msgpack.unpackb, raw=False)
+        )
+
+    def load(self, stream, contentLength=None):
+        return msgpack.unpackb(readFully(stream, contentLength), raw=False)
+
+    def preHasher(self, data):
+        return super().byteFy(data)
+
+    def preDeserialization(self, data):
+        return super().byteFy(data)
+
+# metaData tag -> serializer, see registerSerializer
+SERIALIZERS = collections.OrderedDict()
+
+def registerSerializer(tag, serializer):
+    '''
+    Makes serializer available under tag to CloudPassageHandler.push and pull.
+    Tags are stored as the blob's metaData so they must not contain '+',
+    that separates a compression codec eg 'json+zlib'.
+    '''
+    if not tag or '+' in tag:
+        raise ValueError("Serializer tags must be non-empty and free of '+': %s"%(tag))
+
+    SERIALIZERS[tag] = serializer
+
+def getSerializer(tag, compressionLevel=None):
+    # Returns the serializer for a metaData tag eg 'pickle' or 'json+lzma', else None
+    base, codec = splitTag(tag)
+    serializer = SERIALIZERS.get(base, None)
+    if serializer is None or codec is None:
+        return serializer
+    if codec not in CODECS:
+        return None
+
+    return CompressedSerializer(serializer, base, codec, compressionLevel)
+
+def availableSerializers():
+    return list(SERIALIZERS)
+
+registerSerializer('json', JSONSerializer())
+registerSerializer('json-compact', CompactJSONSerializer())
+registerSerializer('pickle', BinarySerializer())
+registerSerializer('marshal', MarshalSerializer())
+if HAS_PICKLE5:
+    registerSerializer('pickle5', Pickle5Serializer())
+if orjson is not None:
+    registerSerializer('orjson', OrjsonSerializer())
+if msgpack is not None:
+    registerSerializer('msgpack', MsgpackSerializer())
+
+def pickFastestSerializer(data, tags=None, repeat=3):
+    '''
+    Micro-benchmark: times encoding then decoding data with each serializer
+    in tags, all registered ones by default, skipping those that can't
+    reproduce data faithfully eg json turning tuples into lists.
+    Returns (fastestTag, {tag: best seconds}), fastestTag is None if no
+    serializer round trips data.
+    '''
+    timings = dict()
+    for tag in (tags or availableSerializers()):
+        serializer = getSerializer(tag)
+        if serializer is None:
+            continue
+
+        best = None
+        try:
+            for i in range(max(1, repeat)):
+                start = time.perf_counter()
+                sink = io.BytesIO()
+                serializer.dump(data, sink)
+                sink.seek(0)
+                loaded = serializer.load(sink)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            if loaded != data:
+                continue
+        except Exception:
+            continue
+
+        timings[tag] = best
+
+    if not timings:
+        return None, timings
+
+    return min(timings, key=timings.get), timings
+
+# marshal's format changes between Python versions so blobs picked for it
+# couldn't be shared across machines, 'auto' never picks it.
+AUTO_EXCLUDED = frozenset(('marshal',))
+
+# 'auto' benchmarks at most this many items of a container
+AUTO_SAMPLE_SIZE = 64
+
+# Objects shapeOf looks at
+AUTO_SHAPE_LIMIT = 4096
+
+# Reproduce any picklable object exactly, the others eg json turn tuples
+# into lists so their picks are checked on the whole object before use.
+LOSSLESS_SERIALIZERS = frozenset(('pickle', 'pickle5'))
+
+# shapeOf(data) -> tag picked by autoSerializer
+AUTO_CHOICES = dict()
+
+def sampleOf(data, size=AUTO_SAMPLE_SIZE):
+    # The first size items of a list, tuple, dict, str or bytes, else data itself
+    if isinstance(data, (list, tuple)):
+        return data[:size]
+    if isinstance(data, dict):
+        return dict(itertools.islice(data.items(), size))
+    if isinstance(data, (str, bytes, bytearray)):
+        return data[:size * 64]
+
+    return data
+
+def shapeOf(data, size=AUTO_SAMPLE_SIZE, limit=AUTO_SHAPE_LIMIT):
+    '''
+    The key 'auto' choices are cached by: the exact types found at every
+    depth of data, dict keys apart, looking at the first size items of each
+    container and at most limit objects overall.
+    '''
+    shape, pending, seen = set(), [(0, data)], 0
+    while pending and seen < limit:
+        depth, obj = pending.pop()
+        seen += 1
+        kind = type(obj)
+        shape.add((depth, kind))
+        if kind is dict or isinstance(obj, dict):
+            for key, value in itertools.islice(obj.items(), size):
+                shape.add((depth, 'key', type(key)))
+                pending.append((depth + 1, value))
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend((depth + 1, item) for item in itertools.islice(obj, size))
+
+    return frozenset(shape)
+
+def roundTrips(serializer, data):
+    # Whether serializer reproduces data exactly
+    try:
+        sink = io.BytesIO()
+        serializer.dump(data, sink)
+        sink.seek(0)
+        return serializer.load(sink) == data
+    except Exception:
+        return False
+
+def autoSerializer(data):
+    '''
+    Returns the tag of the fastest serializer for data, benchmarked once per
+    shapeOf(data) on a sample of it. A pick that isn't lossless is only
+    returned if it round trips the whole of data, else 'pickle' is.
+    Serializers in AUTO_EXCLUDED are never picked.
+    '''
+    shape = shapeOf(data)
+    if shape not in AUTO_CHOICES:
+        tags = [tag for tag in availableSerializers() if tag not in AUTO_EXCLUDED]
+        AUTO_CHOICES[shape] = pickFastestSerializer(sampleOf(data), tags=tags, repeat=1)[0]
+
+    tag = AUTO_CHOICES[shape]
+    if tag in LOSSLESS_SERIALIZERS:
+        return tag
+    if tag is not None and roundTrips(getSerializer(tag), data):
+        return tag
+
+    return 'pickle'
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# asyncio flavour of RestDriver: every generated liason method is awaitable
+# and all liasons plus the file handler share one aiohttp connection pool.
+
+try:
+    from entrails.asyncDbLiason import AsyncHandlerLiason, AsyncSessionStore
+except:
+    from .entrails.asyncDbLiason import AsyncHandlerLiason, AsyncSessionStore
+
+try:
+    from entrails.asyncFileOnCloudHandler import AsyncFileOnCloudHandler
+except:
+    from .entrails.asyncFileOnCloudHandler import AsyncFileOnCloudHandler
+
+try:
+    from entrails.utils import(
+        docStartRegCompile, getDefaultAuthor, prepareLiasonName
+    )
+
+except:
+    from .entrails.utils import(
+        docStartRegCompile, getDefaultAuthor, prepareLiasonName
+    )
+
+class AsyncRestDriver:
+    __restConnectorMethods = {
+        'put': ('update', 's',), 'post': ('new', '',),
+        'delete': ('delete', 's'), 'get': ('get', 's',),
+        'refreshTokenStore': ('refresh', '')
+    }
+    __restBulkMethods = {
+        'postBulk': ('new', 'sBulk',), 'putBulk': ('update', 'sBulk',),
+        'deleteBulk': ('delete', 'sBulk',)
+    }
+    getDefaultAuthor = getDefaultAuthor
+
+    def __init__(self, ip, port='8000', checkSumAlgoName='sha1',
+            poolSize=100, poolSizePerHost=0, keepAliveTimeout=15):
+
+        self.__checkSumAlgoName = checkSumAlgoName or 'sha1'
+
+        ipStr = 'http://127.0.0.1'
+        if ip and isinstance(ip, str):
+            ipStr = ip
+
+        portStr = '8000'
+        if port and (isinstance(port, str) or hasattr(port, '__divmod__')):
+            portStr = str(int(port))
+
+        self.__baseUrl = '{i}:{p}'.format(
+                                      i=ipStr.strip('/'), p=portStr.strip('/'))
+
+        self.__externNameToLiasonMap = dict()
+
+        self.__sessionStore = AsyncSessionStore(
+            poolSize=poolSize, poolSizePerHost=poolSizePerHost,
+            keepAliveTimeout=keepAliveTimeout
+        )
+
+        self.__fCloudHandler = AsyncFileOnCloudHandler(
+            self.__baseUrl, self.__checkSumAlgoName,
+            sessionStore=self.__sessionStore
+        )
+
+    def getCheckSumAlgoName(self):
+        return self.__fCloudHandler.getCheckSumAlgoName()
+
+    def registerLiason(self, shortName, url, tokenRetrievalURL=None, bulkUrl=None):
+        '''
+        Params: shortName eg 'Job', url '/jobTable/jobHandler'
+                bulkUrl: optional batched endpoint eg '/jobTable/jobHandler/bulk'
+         Explanation:
+            + Same naming as RestDriver.registerLiason ie self.newJob,
+              self.getJobs, self.updateJobs, self.deleteJobs, self.newJobsBulk
+              etc except that each of them is a coroutine function:
+                ie  await self.getJobs(status='finished')
+        '''
+
+        if not (isinstance(shortName, str) and shortName):
+            return None
+
+        if not (isinstance(url, str) and url):
+            return None
+
+        shortName = prepareLiasonName(shortName)
+        liasonName = '__%sLiason'%(shortName.lower())
+
+        setattr(self, liasonName, AsyncHandlerLiason(
+            self.__baseUrl + url, tokenRetrievalURL=tokenRetrievalURL,
+            sessionStore=self.__sessionStore,
+            bulkUrl=self.__baseUrl + bulkUrl if bulkUrl else None
+        ))
+        self.__externNameToLiasonMap[shortName] = getattr(self, liasonName)
+
+        restMethods = dict(self.__restConnectorMethods, **self.__restBulkMethods)
+        for restMethod, symNameTuple in restMethods.items():
+            symName, nameSuffix = symNameTuple
+            setattr(
+                self, '%s%s%s'%(symName, shortName.capitalize(), nameSuffix),
+                self.__createLiasableFunc(shortName, '%sConn'%(restMethod))
+            )
+
+        return getattr(self, liasonName)
+
+    def __createLiasableFunc(self, key, methodKey):
+        liason = self.__externNameToLiasonMap.get(key, None)
+        method = getattr(liason, methodKey, None)
+
+        if method is None:
+            async def method(**aux):
+                return aux
+
+        return method
+
+    async def uploadBlob(self, srcPath, **attrs):
+        return await self.__fCloudHandler.uploadBlobByPath(srcPath, **attrs)
+
+    async def uploadStream(self, f, **attrs):
+        attrs['isPut'] = False
+        return await self.__fCloudHandler.uploadBlobByStream(f, **attrs)
+
+    def ___keyToDocCloudName(self, key):
+        return key if docStartRegCompile.search(key) else 'documents/'+key
+
+    async def downloadBlob(self, key, **attrs):
+        return await self.__fCloudHandler.downloadBlobToDisk(
+                        self.___keyToDocCloudName(key), **attrs)
+
+    def downloadBlobToStream(self, key, **kwargs):
+        # Returns an async generator ie: async for chunk in ...
+        return self.__fCloudHandler.downloadBlobToStream(
+                            self.___keyToDocCloudName(key), **kwargs)
+
+    async def deleteBlob(self, **attrs):
+        return await self.__fCloudHandler.deleteBlobOnCloud(**attrs)
+
+    async def updateFile(self, key, **attrs):
+        return await self.__fCloudHandler.updateFileByPath(key, **attrs)
+
+    async def updateStream(self, stream, **attrs):
+        return await self.__fCloudHandler.updateFileByStream(stream, **attrs)
+
+    async def getCloudFilesManifest(self, **queryParams):
+        return await self.__fCloudHandler.getParsedManifest(**queryParams)
+
+    def getBaseUrl(self):
+        return self.__baseUrl
+
+    async def close(self):
+        await self.__sessionStore.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *excInfo):
+        await self.close()
+
+    def __str__(self):
+        return 'AsyncRestDriver::%s'%(self.__baseUrl)
+
+    def __repr__(self):
+        return 'AsyncRestDriver::%s'%(self.__baseUrl)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Blob download throughput against the in-process stand-in server, comparing
+# the former 4KiB-chunk-and-flush loop with the current write path.
+# Run from the project root:
+#   python3 benchmarks/benchDownload.py [sizeInMiB ...]
+
+import os
+import sys
+import mmap
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import restDriver
+from entrails.standInServer import StandInServer
+
+def legacyDownload(rd, key, localName):
+    # The download loop as it was: page sized chunks and a flush per chunk
+    writtenBytes = 0
+    with open(localName, 'wb') as f:
+        for chunk in rd.downloadBlobToStream(key, readChunkSize=mmap.PAGESIZE):
+            if chunk:
+                writtenBytes += f.write(chunk)
+                f.flush()
+
+    return writtenBytes
+
+def currentDownload(rd, key, localName):
+    return rd.downloadBlob(key, altName=localName)
+
+def timeIt(func, *args, repeat=3):
+    best = None
+    for i in range(repeat):
+        startTime = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+def main():
+    sizesMiB = [int(arg) for arg in sys.argv[1:]] or [4, 32, 128]
+    tmpDir = tempfile.mkdtemp()
+    with StandInServer() as server:
+        rd = restDriver.RestDriver('http://127.0.0.1', server.port)
+        print('%8s %14s %14s %8s'%('MiB', 'before MB/s', 'after MB/s', 'speedup'))
+        for sizeMiB in sizesMiB:
+            blob = os.urandom(sizeMiB * 1024 * 1024)
+            record = server.store.create(dict(title='bench'), blob)
+            localName = os.path.join(tmpDir, 'blob.bin')
+
+            before = timeIt(legacyDownload, rd, record['content'], localName)
+            after = timeIt(currentDownload, rd, record['content'], localName)
+            mb = len(blob) / 1e6
+            print('%8d %14.1f %14.1f %7.2fx'%(sizeMiB, mb / before, mb / after, before / after))
+            server.store.delete(dict(id=str(record['id'])))
+
+    for name in os.listdir(tmpDir):
+        os.remove(os.path.join(tmpDir, name))
+    os.rmdir(tmpDir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Encode+decode time of every registered serializer on a few typical payloads.
+# Run from the project root:
+#   python3 benchmarks/benchSerializers.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Serializer
+
+PAYLOADS = {
+    'table': [dict(id=i, name='row%d'%(i), score=i * 0.5, tags=['a', 'b']) for i in range(20000)],
+    'numbers': list(range(200000)),
+    'strings': dict(('key%d'%(i), 'value%d'%(i) * 4) for i in range(50000)),
+    'bytes': [os.urandom(1024) for i in range(2000)],
+}
+
+def main():
+    print('Serializers: %s'%(', '.join(Serializer.availableSerializers())))
+    for name, payload in PAYLOADS.items():
+        fastest, timings = Serializer.pickFastestSerializer(payload, repeat=3)
+        print('\n%s, fastest: %s'%(name, fastest))
+        for tag, elapsed in sorted(timings.items(), key=lambda item: item[1]):
+            print('  %-14s %8.2fms'%(tag, elapsed * 1000))
+
+if __name__ == '__main__':
+    main()
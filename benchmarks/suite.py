@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Offline benchmark suite against the in-process stand-in restAssured server:
+# liason CRUD throughput, manifest lookup latency, blob upload/download
+# throughput, CloudPassageHandler round trips and checkSum throughput.
+# Run from the project root:
+#   python3 benchmarks/suite.py --output results.json
+#   python3 benchmarks/suite.py --baseline results.json --threshold 0.1
+# Results are JSON so that runs of different versions can be compared.
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import restDriver
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+MiB = 1024 * 1024
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+class Results:
+    def __init__(self):
+        self.entries = []
+
+    def add(self, name, value, unit, higherIsBetter):
+        self.entries.append(dict(
+            name=name, value=value, unit=unit, higherIsBetter=higherIsBetter
+        ))
+        print('%-40s %14.3f %s'%(name, value, unit))
+
+    def rate(self, name, count, elapsed, unit='ops/s'):
+        self.add(name, count / elapsed if elapsed else 0.0, unit, True)
+
+    def latency(self, name, samples):
+        self.add('%s.p50'%(name), percentile(samples, 0.5) * 1000, 'ms', False)
+        self.add('%s.p95'%(name), percentile(samples, 0.95) * 1000, 'ms', False)
+
+def timed(func, *args, **kwargs):
+    startTime = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - startTime
+
+def benchLiasonCrud(rd, results, count):
+    rd.registerLiason('Bench', '/benchTable/benchHandler',
+                        bulkUrl='/benchTable/benchHandler/bulk')
+
+    results.rate('liason.post', count,
+        timed(lambda: [rd.newBench(name='n%d'%(i), i=i) for i in range(count)]))
+    results.rate('liason.get', count,
+        timed(lambda: [rd.getBenchs(name='n%d'%(i)) for i in range(count)]))
+    results.rate('liason.put', count, timed(lambda: [rd.updateBenchs(
+        queryParams=dict(name='n%d'%(i)), updateParams=dict(done=True)) for i in range(count)]))
+    results.rate('liason.delete', count,
+        timed(lambda: [rd.deleteBenchs(name='n%d'%(i)) for i in range(count)]))
+
+    # Batched through the bulkUrl endpoint
+    records = [dict(name='b%d'%(i)) for i in range(count)]
+    results.rate('liason.postBulk.batched', count,
+        timed(rd.newBenchsBulk, records, concurrency=8))
+    results.rate('liason.deleteBulk.batched', count,
+        timed(rd.deleteBenchsBulk, [dict(name=r['name']) for r in records], concurrency=8))
+
+    # One request per item, concurrently, without a bulkUrl
+    rd.registerLiason('Row', '/benchTable/rowHandler')
+    records = [dict(name='c%d'%(i)) for i in range(count)]
+    results.rate('liason.postBulk.concurrent', count,
+        timed(rd.newRowsBulk, records, concurrency=8))
+    results.rate('liason.deleteBulk.concurrent', count,
+        timed(rd.deleteRowsBulk, [dict(name=r['name']) for r in records], concurrency=8))
+
+def benchManifest(rd, server, results, count):
+    for i in range(200):
+        server.store.create(dict(title='m%d'%(i), checkSum='%040x'%(i)), b'x')
+
+    samples = [timed(rd.getCloudFilesManifest, title='m%d'%(i % 200)) for i in range(count)]
+    results.latency('manifest.lookup', samples)
+
+    samples = [timed(rd.getCloudFilesManifest) for i in range(max(1, count // 10))]
+    results.latency('manifest.listAll', samples)
+
+    elapsed = timed(lambda: sum(1 for e in rd.iterCloudFilesManifest(pageSize=50)))
+    results.rate('manifest.iterate', 200, elapsed, 'entries/s')
+
+def benchBlobs(rd, tmpDir, results, sizes):
+    for size in sizes:
+        label = '%dKiB'%(size // 1024) if size < MiB else '%dMiB'%(size // MiB)
+        srcPath = os.path.join(tmpDir, 'src-%s'%(label))
+        with open(srcPath, 'wb') as f:
+            f.write(os.urandom(size))
+
+        elapsed = timed(rd.uploadBlob, srcPath, title=label)
+        results.rate('blob.upload.%s'%(label), size / 1e6, elapsed, 'MB/s')
+
+        content = rd.getCloudFilesManifest(title=label)['data'][0]['content']
+        dstPath = os.path.join(tmpDir, 'dst-%s'%(label))
+        elapsed = timed(rd.downloadBlob, content, altName=dstPath)
+        results.rate('blob.download.%s'%(label), size / 1e6, elapsed, 'MB/s')
+
+        elapsed = timed(rd.downloadBlob, content, altName=dstPath, workers=4, rangeSize=max(size // 4, 1))
+        results.rate('blob.download.ranged.%s'%(label), size / 1e6, elapsed, 'MB/s')
+
+        elapsed = timed(rd.getFileCheckSum, srcPath)
+        results.rate('checkSum.%s'%(label), size / 1e6, elapsed, 'MB/s')
+
+        # Aged past the index's racy window, the second lookup is a stat and a query
+        past = time.time() - 60
+        os.utime(srcPath, (past, past))
+        rd.enableCheckSumIndex(os.path.join(tmpDir, 'checkSums.sqlite3'))
+        rd.getFileCheckSum(srcPath)
+        elapsed = timed(rd.getFileCheckSum, srcPath)
+        results.rate('checkSum.indexed.%s'%(label), size / 1e6, elapsed, 'MB/s')
+        rd.disableCheckSumIndex()
+
+def benchPassage(cc, results, count):
+    table = [dict(id=i, name='row%d'%(i), score=i * 0.5) for i in range(2000)]
+    for sType, kwargs in (('json', dict()), ('pickle', dict(asPickle=True)),
+                            ('json+zlib', dict(compression='zlib'))):
+        samples = []
+        for i in range(count):
+            startTime = time.perf_counter()
+            cc.push(table, title='passage-%s'%(sType), **kwargs)
+            cc.pull(title='passage-%s'%(sType))
+            samples.append(time.perf_counter() - startTime)
+
+        results.latency('passage.roundTrip.%s'%(sType), samples)
+
+def gitVersion():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception:
+        return None
+
+def compare(current, baseline, threshold):
+    # Returns the names of the entries that regressed by more than threshold
+    before = dict((e['name'], e) for e in baseline.get('results', []))
+    regressions = []
+    print('\n%-40s %14s %14s %9s'%('name', 'baseline', 'current', 'change'))
+    for entry in current['results']:
+        old = before.get(entry['name'], None)
+        if old is None or not old['value']:
+            continue
+
+        change = (entry['value'] - old['value']) / old['value']
+        if not entry['higherIsBetter']:
+            change = -change
+
+        flag = ''
+        if change < -threshold:
+            flag = ' REGRESSED'
+            regressions.append(entry['name'])
+
+        print('%-40s %14.3f %14.3f %+8.1f%%%s'%(
+            entry['name'], old['value'], entry['value'], change * 100, flag))
+
+    return regressions
+
+def cliParser():
+    parser = OptionParser()
+    parser.add_option('-o', '--output', default=None,
+                        help='Write the results as JSON to this path', dest='output')
+    parser.add_option('-b', '--baseline', default=None,
+                        help='Compare against a previous JSON output', dest='baseline')
+    parser.add_option('-t', '--threshold', default=0.1, type='float',
+                        help='Tolerated relative slowdown before flagging', dest='threshold')
+    parser.add_option('-q', '--quick', default=False, action='store_true',
+                        help='Fewer iterations and smaller blobs', dest='quick')
+    return parser.parse_args()
+
+def main():
+    options, args = cliParser()
+    count = 50 if options.quick else 500
+    sizes = [64 * 1024, MiB] if options.quick else [64 * 1024, MiB, 16 * MiB, 64 * MiB]
+
+    results = Results()
+    tmpDir = tempfile.mkdtemp()
+    try:
+        with StandInServer() as server:
+            rd = restDriver.RestDriver('http://127.0.0.1', server.port)
+            benchLiasonCrud(rd, results, count)
+            benchManifest(rd, server, results, count)
+            benchBlobs(rd, tmpDir, results, sizes)
+            benchPassage(CloudPassageHandler('http://127.0.0.1', server.port),
+                                            results, max(5, count // 20))
+    finally:
+        shutil.rmtree(tmpDir)
+
+    current = dict(
+        meta=dict(
+            version=gitVersion(), python=platform.python_version(),
+            platform=platform.platform(), timestamp=time.time(), quick=options.quick
+        ),
+        results=results.entries
+    )
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(current, json.load(f), options.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
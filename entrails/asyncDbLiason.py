@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# asyncio counterparts of DbConn and HandlerLiason, backed by aiohttp
+
+import json
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    from dbLiason import (
+        DEFAULT_BULK_CONCURRENCY, DEFAULT_BULK_BATCH_SIZE, splitBatches, expandBatchResult
+    )
+except:
+    from .dbLiason import (
+        DEFAULT_BULK_CONCURRENCY, DEFAULT_BULK_BATCH_SIZE, splitBatches, expandBatchResult
+    )
+
+def assertAioHTTP():
+    if aiohttp is None:
+        raise ImportError("Please install 'aiohttp' first by: `pip3 install aiohttp`")
+
+def toParamItems(data):
+    # requests str()-ifies query values and expands lists/tuples into
+    # repeated keys; aiohttp is stricter so normalize the same way here.
+    items = []
+    for key, value in data.items():
+        if isinstance(value, (list, tuple)):
+            items.extend((key, str(v)) for v in value)
+        elif value is not None:
+            items.append((key, str(value)))
+
+    return items
+
+async def parseResponse(result):
+    dataOut = {}
+    statusCode = result.status
+
+    text = None
+    try:
+        text = await result.text()
+        jsonParsed = json.loads(text)
+    except ValueError as e: # Could not parse JSON from text
+        dataOut['reason'] = text
+    except Exception as e: # Other exception
+        dataOut['reason'] = e
+    else:
+        dataOut['value'] = jsonParsed
+    finally:
+        dataOut['status_code'] = statusCode
+
+    return dataOut
+
+class AsyncSessionStore:
+    # Lazily creates a single aiohttp.ClientSession so that every liason
+    # sharing this store multiplexes over the same keep-alive connection pool.
+    def __init__(self, poolSize=100, poolSizePerHost=0, keepAliveTimeout=15):
+        assertAioHTTP()
+        self.__session = None
+        self.__poolSize = poolSize
+        self.__poolSizePerHost = poolSizePerHost
+        self.__keepAliveTimeout = keepAliveTimeout
+
+    async def getSession(self):
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.__poolSize, limit_per_host=self.__poolSizePerHost,
+                keepalive_timeout=self.__keepAliveTimeout
+            )
+            self.__session = aiohttp.ClientSession(connector=connector)
+
+        return self.__session
+
+    async def close(self):
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+
+        self.__session = None
+
+class AsyncDbConn:
+    def __init__(self, baseUrl, tokenRetrievalURL=None, sessionStore=None, bulkUrl=None):
+        self.baseUrl = baseUrl
+        self.bulkUrl = bulkUrl
+        self.__headers = dict()
+        self.__sessionStore = sessionStore or AsyncSessionStore()
+        self.__lastTokenRetrievalURL = tokenRetrievalURL
+
+        # The token can only be fetched once an event loop is running,
+        # so it is deferred until the first request is made.
+        self.__tokenPending = bool(tokenRetrievalURL)
+        self.__tokenLock = None # Created on first use, in the running loop
+
+    def _updateHeaders(self, headerDict):
+        self.__headers.update(headerDict)
+
+    async def refreshTokenStore(self, tokenRetrievalUrl=None):
+        try:
+            session = await self.__sessionStore.getSession()
+            async with session.get(tokenRetrievalUrl or self.__lastTokenRetrievalURL,
+                                                    headers=self.__headers) as rget:
+                if rget.status == 200:
+                    self.__lastTokenRetrievalURL = tokenRetrievalUrl or self.__lastTokenRetrievalURL
+                    self.__headers.update(rget.headers)
+                    return True
+        finally:
+            self.__tokenPending = False
+
+    async def __awaitToken(self):
+        # Concurrent first requests all wait for the one token fetch
+        if self.__tokenLock is None:
+            self.__tokenLock = asyncio.Lock()
+
+        async with self.__tokenLock:
+            if self.__tokenPending:
+                await self.refreshTokenStore(self.__lastTokenRetrievalURL)
+
+    async def __request(self, method, url, **kwargs):
+        if self.__tokenPending:
+            await self.__awaitToken()
+
+        session = await self.__sessionStore.getSession()
+        async with session.request(method, url or self.baseUrl,
+                                    headers=self.__headers, **kwargs) as result:
+            return await parseResponse(result)
+
+    async def post(self, url=None, **data):
+        return await self.__request('POST', url, data=json.dumps(data))
+
+    async def put(self, url=None, **data):
+        outDict = dict(
+            queryParams=json.dumps(data.get('queryParams', {})),
+            updateParams=json.dumps(data.get('updateParams', {}))
+        )
+
+        return await self.__request('PUT', url, params=toParamItems(outDict))
+
+    async def delete(self, url=None, **data):
+        return await self.__request('DELETE', url, params=toParamItems(data))
+
+    async def get(self, url=None, **data):
+        return await self.__request('GET', url, params=toParamItems(data))
+
+    async def bulk(self, method, items, concurrency=DEFAULT_BULK_CONCURRENCY,
+                                        batchSize=DEFAULT_BULK_BATCH_SIZE):
+        # Same contract as DbConn.bulk, at most concurrency requests in flight
+        if method not in ('post', 'put', 'delete'):
+            raise ValueError('Unsupported bulk method %s'%(method))
+
+        items = list(items)
+        semaphore = asyncio.Semaphore(max(1, concurrency or 1))
+
+        async def bounded(coroutineFunc, *args):
+            async with semaphore:
+                return await coroutineFunc(*args)
+
+        if self.bulkUrl:
+            batches = splitBatches(items, max(1, batchSize))
+            perBatch = await asyncio.gather(
+                *(bounded(self.__postBatch, method, batch) for batch in batches))
+            return [result for batchResults in perBatch for result in batchResults]
+
+        func = getattr(self, method)
+        return list(await asyncio.gather(
+            *(bounded(self.__callItem, func, item) for item in items)))
+
+    async def __callItem(self, func, item):
+        try:
+            return await func(**item)
+        except Exception as e:
+            return dict(reason='%s'%(e), status_code=None)
+
+    async def __postBatch(self, method, batch):
+        try:
+            parsed = await self.__request('POST', self.bulkUrl,
+                                    data=json.dumps(dict(method=method, items=batch)))
+        except Exception as e:
+            parsed = dict(reason='%s'%(e), status_code=None)
+
+        return expandBatchResult(parsed, len(batch))
+
+    async def close(self):
+        await self.__sessionStore.close()
+
+    def setBaseURL(self, baseURL):
+        self.baseUrl = baseURL
+
+    def getBaseURL(self):
+        return self.baseUrl
+
+class AsyncHandlerLiason(object):
+    def __init__(self, baseUrl, *args, **kwargs):
+        self.baseUrl = baseUrl
+        self.handler = AsyncDbConn(baseUrl, *args, **kwargs)
+
+    async def postConn(self, **data):
+        return await self.handler.post(**data)
+
+    async def deleteConn(self, **data):
+        return await self.handler.delete(**data)
+
+    async def putConn(self, **data):
+        return await self.handler.put(**data)
+
+    async def getConn(self, **data):
+        return await self.handler.get(**data)
+
+    async def refreshTokenStoreConn(self, tokenRefreshURL=None):
+        return await self.handler.refreshTokenStore(tokenRefreshURL)
+
+    async def postBulkConn(self, items, **kwargs):
+        return await self.handler.bulk('post', items, **kwargs)
+
+    async def putBulkConn(self, items, **kwargs):
+        return await self.handler.bulk('put', items, **kwargs)
+
+    async def deleteBulkConn(self, items, **kwargs):
+        return await self.handler.bulk('delete', items, **kwargs)
+
+def main():
+    async def run():
+        hl = AsyncHandlerLiason('http://127.0.0.1:8000/thebear')
+        print(await asyncio.gather(*(hl.getConn() for i in range(4))))
+        await hl.handler.close()
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
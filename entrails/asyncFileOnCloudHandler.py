@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# asyncio counterpart of FileOnCloudHandler, backed by aiohttp
+
+import os
+import sys
+import asyncio
+import hashlib
+
+try:
+    from utils import isCallableAttr, hashStream, CHECKSUM_CHUNK_SIZE
+    from fileOnCloudHandler import adaptiveChunkSize
+    from asyncDbLiason import (
+        aiohttp, AsyncSessionStore, parseResponse, toParamItems
+    )
+except:
+    from .utils import isCallableAttr, hashStream, CHECKSUM_CHUNK_SIZE
+    from .fileOnCloudHandler import adaptiveChunkSize
+    from .asyncDbLiason import (
+        aiohttp, AsyncSessionStore, parseResponse, toParamItems
+    )
+
+sys.path.append('./entrails')
+import httpStatusCodes as httpStatus
+
+class AsyncFileOnCloudHandler:
+    def __init__(self, url, checkSumAlgoName='sha256', sessionStore=None):
+        self.setBaseURL(url)
+        self.__checkSumAlgoName = checkSumAlgoName
+        self.__sessionStore = sessionStore or AsyncSessionStore()
+
+        # Just an alias/reference
+        self.downloadBlobToBuffer = self.downloadBlobToStream
+
+    def setBaseURL(self, url):
+        self.__baseUrl = url.strip('/')
+        self.__upUrl = self.__baseUrl + '/uploader'
+        self.__mediaUrl = self.__baseUrl + '/media/'
+
+    def getBaseURL(self):
+        return self.__baseUrl
+
+    def initCheckSumAlgoName(self, algoName):
+        self.__checkSumAlgoName = algoName
+
+    def getCheckSumAlgoName(self):
+        return self.__checkSumAlgoName
+
+    def getCheckSum(self, byteStream, algoName=None):
+        algoName = algoName or self.__checkSumAlgoName
+        if not isCallableAttr(hashlib, algoName):
+            return 400, 'No such algo exists'
+        try:
+            checkSumObj = getattr(hashlib, algoName)(byteStream)
+        except Exception as e:
+            return httpStatus.INTERNAL_SERVER_ERROR, e
+        else:
+            return httpStatus.OK, checkSumObj
+
+    def getCheckSumByStream(self, stream, algoName=None, chunkSize=CHECKSUM_CHUNK_SIZE):
+        status, checkSumObj = self.getCheckSum(b'', algoName)
+        if status != httpStatus.OK:
+            return status, checkSumObj
+        try:
+            hashStream(checkSumObj, stream, chunkSize)
+        except Exception as e:
+            return httpStatus.INTERNAL_SERVER_ERROR, e
+        else:
+            return httpStatus.OK, checkSumObj
+
+    async def __opHandler(self, method, url, **kwargs):
+        session = await self.__sessionStore.getSession()
+        try:
+            async with session.request(method, url, **kwargs) as result:
+                return await parseResponse(result)
+        except Exception as e:
+            return {
+                'status_code': httpStatus.INTERNAL_SERVER_ERROR, 'reason': e
+            }
+
+    def __prepareForm(self, fields, stream):
+        form = aiohttp.FormData()
+        for key, value in toParamItems(fields):
+            form.add_field(key, value)
+
+        fileName = os.path.basename(str(getattr(stream, 'name', 'blob')))
+        form.add_field('blob', stream, filename=fileName or 'blob')
+        return form
+
+    async def __pushUpFileByStream(self, isPut, stream, **attrs):
+        if attrs.get('checkSum', None) is None:
+            try:
+                origPos = stream.tell()
+                # Hashed off the event loop, other coroutines keep running
+                status, result = await asyncio.get_running_loop().run_in_executor(
+                                                None, self.getCheckSumByStream, stream)
+                if status != httpStatus.OK:
+                    return result
+
+                stream.seek(origPos) # Get back to original position
+            except Exception as e:
+                print('pushUpFilesByStream', e)
+                return e
+            else:
+                attrs['checkSum'] = result.hexdigest()
+
+        attrs.setdefault('checkSumAlgoName', self.__checkSumAlgoName)
+
+        if not isPut:
+            return await self.__opHandler(
+                'POST', self.__upUrl, data=self.__prepareForm(attrs, stream)
+            )
+
+        q = attrs.get('query', {})
+        if not q:
+            # An empty query matches every blob, refuse to overwrite them all
+            return {'status_code': httpStatus.BAD_REQUEST}
+
+        d = dict(attrs.get('data', {}))
+        d.setdefault('checkSum', attrs['checkSum'])
+        d.setdefault('checkSumAlgoName', attrs['checkSumAlgoName'])
+        return await self.__opHandler(
+            'PUT', self.__upUrl, params=toParamItems(q),
+            data=self.__prepareForm(d, stream)
+        )
+
+    async def __pushUpFileByPath(self, methodToggle, fPath, **attrs):
+        if not (fPath and os.access(fPath, os.R_OK)):
+            return {'status_code': httpStatus.FORBIDDEN}
+
+        if not os.path.isfile(fPath):
+            return {'status_code': httpStatus.NOT_FOUND}
+
+        with open(fPath, 'rb') as f:
+            attrs['stream'] = f
+            attrs['isPut'] = methodToggle
+            return await self.__pushUpFileByStream(**attrs)
+
+    async def uploadBlobByStream(self, f, **attrs):
+        return await self.__pushUpFileByStream(stream=f, **attrs)
+
+    async def uploadBlobByPath(self, fPath, **attrs):
+        return await self.__pushUpFileByPath(False, fPath, **attrs)
+
+    async def updateFileByStream(self, f, **attrs):
+        return await self.uploadBlobByStream(isPut=True, f=f, **attrs)
+
+    async def updateFileByPath(self, fPath, **attrs):
+        return await self.__pushUpFileByPath(True, fPath, **attrs)
+
+    def __pathForMediaDownload(self, fPath):
+        return self.__mediaUrl + fPath
+
+    async def downloadBlobToStream(self, fPath, readChunkSize=None):
+        # An async generator of the blob's chunks, empty if it could not be fetched
+        session = await self.__sessionStore.getSession()
+        async with session.get(self.__pathForMediaDownload(fPath)) as dataIn:
+            if dataIn.status != httpStatus.OK:
+                return
+
+            if not readChunkSize:
+                readChunkSize = adaptiveChunkSize(dataIn.content_length)
+
+            async for chunk in dataIn.content.iter_chunked(readChunkSize):
+                yield chunk
+
+    async def downloadBlobToDisk(self, pathOnCloudName, altName=None, chunkSize=None):
+        # The file is opened, written and closed off the event loop
+        loop = asyncio.get_running_loop()
+        writtenBytes = 0
+        f = None
+        try:
+            async for chunk in self.downloadBlobToStream(pathOnCloudName, chunkSize):
+                if f is None:
+                    f = await loop.run_in_executor(None,
+                            open, altName or os.path.basename(pathOnCloudName), 'wb')
+                writtenBytes += await loop.run_in_executor(None, f.write, chunk)
+        except Exception as e:
+            print('downloadBlobToDisk', e)
+        finally:
+            if f is not None:
+                await loop.run_in_executor(None, f.close)
+
+        return writtenBytes
+
+    async def deleteBlobOnCloud(self, **attrsDict):
+        return await self.__opHandler(
+                'DELETE', self.__upUrl, params=toParamItems(attrsDict))
+
+    async def getParsedManifest(self, **query):
+        parsed = await self.__opHandler(
+                'GET', self.__upUrl, params=toParamItems(query))
+
+        value = parsed.pop('value', None)
+        if isinstance(value, dict):
+            parsed['data'] = value.get('data', [])
+
+        return parsed
+
+    async def close(self):
+        await self.__sessionStore.close()
+
+def main():
+    argc = len(sys.argv)
+    if argc < 2:
+        sys.stderr.write('%s \033[42m<paths>\033[00m\n'%(__file__))
+        return
+
+    async def run():
+        fH = AsyncFileOnCloudHandler('http://127.0.0.1:8000', 'sha1')
+        paths = [p for p in sys.argv[1:] if os.path.isfile(p)]
+        print(await asyncio.gather(*(fH.uploadBlobByPath(p, title=p) for p in paths)))
+        print(await fH.getParsedManifest(select='id'))
+        await fH.close()
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# On-disk, content addressed cache of downloaded blobs. Entries are keyed by
+# (checkSumAlgoName, checkSum), capped in total size and evicted least
+# recently used first. A file's mtime doubles as its last use so that the
+# LRU order survives restarts and is shared between processes.
+
+import os
+import re
+import hashlib
+import threading
+import collections
+
+try:
+    from utils import getCacheDir, isCallableAttr
+except:
+    from .utils import getCacheDir, isCallableAttr
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+hexDigestReg = re.compile('^[0-9a-fA-F]+$')
+
+class BlobCache:
+    def __init__(self, cacheDir=None, maxBytes=DEFAULT_MAX_BYTES):
+        self.cacheDir = cacheDir or getCacheDir('blobs')
+        self.maxBytes = maxBytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__lock = threading.Lock()
+        self.__totalBytes = 0
+        self.__entries = collections.OrderedDict() # path -> size, LRU first
+        self.__scan()
+
+    def __scan(self):
+        found = []
+        for dirPath, dirNames, fileNames in os.walk(self.cacheDir):
+            for name in fileNames:
+                path = os.path.join(dirPath, name)
+                if name.endswith('.tmp'):
+                    continue # Left behind by an interrupted write
+                try:
+                    st = os.stat(path)
+                except EnvironmentError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+
+        for mtime, path, size in sorted(found):
+            self.__entries[path] = size
+            self.__totalBytes += size
+
+    def pathFor(self, algoName, checkSum):
+        if not (checkSum and hexDigestReg.match(checkSum) and isCallableAttr(hashlib, algoName)):
+            return None
+
+        checkSum = checkSum.lower()
+        return os.path.join(self.cacheDir, algoName, checkSum[:2], checkSum)
+
+    def get(self, algoName, checkSum):
+        # Returns the local path of the cached blob or None on a miss
+        path = self.pathFor(algoName, checkSum)
+        with self.__lock:
+            if path is None or path not in self.__entries or not os.path.isfile(path):
+                if path in self.__entries:
+                    self.__totalBytes -= self.__entries.pop(path)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__entries.move_to_end(path)
+
+        try:
+            os.utime(path, None)
+        except EnvironmentError:
+            pass
+
+        return path
+
+    def put(self, algoName, checkSum, chunks):
+        '''
+        Stores the blob made up of chunks, an iterable of bytes, under its
+        checkSum. Bytes are hashed as they are written and the entry is only
+        published, with an atomic rename, if they match checkSum.
+        Returns the entry's path or None.
+        '''
+        path = self.pathFor(algoName, checkSum)
+        if path is None:
+            return None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = '%s.%d.%d.tmp'%(path, os.getpid(), threading.get_ident())
+        hasher = getattr(hashlib, algoName)()
+        size = 0
+        try:
+            with open(tmpPath, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        hasher.update(chunk)
+                        size += f.write(chunk)
+
+            if hasher.hexdigest() != checkSum.lower():
+                os.remove(tmpPath)
+                return None
+
+            os.replace(tmpPath, path)
+        except EnvironmentError:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            return None
+
+        with self.__lock:
+            self.__totalBytes += size - self.__entries.pop(path, 0)
+            self.__entries[path] = size
+            self.__evict(keep=path)
+
+        return path
+
+    def __evict(self, keep=None):
+        # Must be invoked with the lock held
+        while self.__totalBytes > self.maxBytes and self.__entries:
+            path, size = next(iter(self.__entries.items()))
+            if path == keep:
+                if len(self.__entries) == 1:
+                    break # A lone blob larger than the cap is still served
+                self.__entries.move_to_end(path)
+                continue
+
+            self.__entries.pop(path)
+            self.__totalBytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                pass
+
+    def clear(self):
+        with self.__lock:
+            for path in self.__entries:
+                try:
+                    os.remove(path)
+                except EnvironmentError:
+                    pass
+
+            self.__entries.clear()
+            self.__totalBytes = 0
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                hits=self.hits, misses=self.misses, evictions=self.evictions,
+                entries=len(self.__entries), bytes=self.__totalBytes,
+                maxBytes=self.maxBytes
+            )
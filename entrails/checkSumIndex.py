@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Persistent index of file checkSums keyed by the file's stat, so that files
+# that haven't changed since they were last hashed are never read again.
+# Backed by sqlite in WAL mode so that several processes can share it.
+
+import os
+import time
+import sqlite3
+import threading
+
+try:
+    from utils import getCacheDir
+except:
+    from .utils import getCacheDir
+
+# Files modified this recently aren't indexed: a write landing within the
+# same mtime tick as the hash would otherwise go unnoticed.
+RACY_WINDOW_NS = 2 * 10**9
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS checkSums (
+    path TEXT NOT NULL,
+    algo TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtimeNs INTEGER NOT NULL,
+    checkSum TEXT NOT NULL,
+    PRIMARY KEY (path, algo)
+)
+'''
+
+def statKey(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class CheckSumIndex:
+    '''
+    Usage:
+        index = CheckSumIndex()
+        checkSum = index.checkSum(path, 'sha1', lambda: hashFile(path, 'sha1'))
+
+    A stored checkSum is only returned while the file's (device, inode,
+    size, mtime_ns) are those it was hashed with, any change rehashes it.
+    '''
+    def __init__(self, path=None, busyTimeout=30):
+        self.path = path or os.path.join(getCacheDir('checksums'), 'index.sqlite3')
+        self.busyTimeout = busyTimeout
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__local = threading.local() # sqlite connections are per thread
+        self.__connection() # Fail early on an unusable path
+
+    def __connection(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            # Autocommit, every write is a single statement
+            conn = sqlite3.connect(self.path, timeout=self.busyTimeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(SCHEMA)
+            self.__local.conn = conn
+
+        return conn
+
+    def __count(self, attrName):
+        with self.__lock:
+            setattr(self, attrName, getattr(self, attrName) + 1)
+
+    def lookup(self, path, algoName, st=None):
+        # Returns the indexed checkSum if the file is unchanged since, else None
+        path = os.path.abspath(path)
+        st = st or os.stat(path)
+        row = self.__connection().execute(
+            'SELECT dev, ino, size, mtimeNs, checkSum FROM checkSums WHERE path=? AND algo=?',
+            (path, algoName)).fetchone()
+
+        if row is None or tuple(row[:4]) != statKey(st):
+            return None
+
+        return row[4]
+
+    def store(self, path, algoName, st, checkSum):
+        # st: the file's stat from before it was hashed
+        if time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS:
+            return False
+
+        self.__connection().execute(
+            'INSERT OR REPLACE INTO checkSums VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (os.path.abspath(path), algoName) + statKey(st) + (checkSum,))
+        return True
+
+    def checkSum(self, path, algoName, computeCheckSum):
+        '''
+        Returns the file's checkSum, from the index when the file's stat
+        still matches, else from computeCheckSum() which then gets indexed
+        unless the file changed while it was being hashed.
+        '''
+        st = os.stat(path)
+        checkSum = self.lookup(path, algoName, st)
+        if checkSum is not None:
+            self.__count('hits')
+            return checkSum
+
+        self.__count('misses')
+        checkSum = computeCheckSum()
+        if checkSum is not None and statKey(os.stat(path)) == statKey(st):
+            self.store(path, algoName, st, checkSum)
+
+        return checkSum
+
+    def forget(self, path):
+        self.__connection().execute(
+                'DELETE FROM checkSums WHERE path=?', (os.path.abspath(path),))
+
+    def prune(self):
+        # Drops the entries of files that no longer exist, returns how many
+        conn = self.__connection()
+        gone = [(path,) for path, in conn.execute('SELECT DISTINCT path FROM checkSums')
+                                                            if not os.path.exists(path)]
+        conn.executemany('DELETE FROM checkSums WHERE path=?', gone)
+        return len(gone)
+
+    def __len__(self):
+        return self.__connection().execute('SELECT COUNT(*) FROM checkSums').fetchone()[0]
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, entries=len(self))
+
+    def close(self):
+        # Closes the calling thread's connection
+        conn = getattr(self.__local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
@@ -6,19 +6,26 @@ import sys
 import time
 import pickle
 import hashlib
+import tempfile
 
 import restDriver
 import Serializer
 import httpStatusCodes as httpStatus
 
+try:
+    from utils import HashingWriter
+except:
+    from entrails.utils import HashingWriter
+
+# Serialized payloads up to this size stay in memory, larger ones spill to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 class CloudPassageHandler:
     def __init__(self, addr='http://127.0.0.1', port='8000'):
         self.___mapAddrToDriver = {}
         self.__restDriver = self.addDriver(addr, port)
 
         self.__checkSumFunc = self.__restDriver.getCheckSum
-        self.__jsonSerializer = Serializer.JSONSerializer()
-        self.__pickleSerializer = Serializer.BinarySerializer()
 
     def addDriver(self, host, port):
         hostMap = self.___mapAddrToDriver.setdefault(host, {})
@@ -31,36 +38,94 @@ class CloudPassageHandler:
 
         return retr
 
-    def computeCheckSum(self, selector, data):
-        return self.__checkSumFunc(
-                      selector.preHasher(selector.serialize(data))).hexdigest()
-
-    def __selectSerializer(self, asPickle):
-        if asPickle:
-            return self.__pickleSerializer, 'pickle'
-
-        return self.__jsonSerializer, 'json'
-
-    def push(self, rawObject, asPickle=False, **kwargs):
-        selector, sType = self.__selectSerializer(asPickle)
+    def enableBlobCache(self, *args, **kwargs):
+        # See RestDriver.enableBlobCache, pulls of unchanged blobs become local reads
+        return self.__restDriver.enableBlobCache(*args, **kwargs)
 
-        # We maintain uniqueness
-        checkSum = self.computeCheckSum(selector, rawObject)
+    def enableManifestCache(self, *args, **kwargs):
+        # See RestDriver.enableManifestCache
+        return self.__restDriver.enableManifestCache(*args, **kwargs)
 
-        status, retr = self.__manifestPull(checkSum=checkSum, metaData=sType, **kwargs)
-        stream = selector.ioStream(rawObject)
-        kwargs.setdefault('uri', 'Computation@%s'%(time.time()))
-        func = self.__restDriver.uploadStream
-        if status == httpStatus.OK and retr:
-            func = self.__restDriver.updateStream
+    def enableLocalManifest(self, *args, **kwargs):
+        # See RestDriver.enableLocalManifest, manifest pulls become local lookups
+        return self.__restDriver.enableLocalManifest(*args, **kwargs)
 
-        return func(stream, checkSum=checkSum, metaData=sType, **kwargs)
+    def __serializeOnce(self, selector, data, sink=None):
+        # Serializes data exactly once, hashing the bytes as they are written
+        # through to sink. Returns the hex checkSum and the metaData tag
+        # selector reports for what it wrote, if any.
+        hashObj = self.__checkSumFunc(b'')
+        tag = selector.dump(data, HashingWriter(hashObj, sink))
+        return hashObj.hexdigest(), tag
 
-    def removeTrace(self, rawObj, asPickle=False, **kwargs):
-        selector, sType = self.__selectSerializer(asPickle)
-        checkSum = self.computeCheckSum(selector, rawObj)
-
-        return self.__restDriver.deleteBlob(checkSum=checkSum, metaData=sType)
+    def computeCheckSum(self, selector, data):
+        return self.__serializeOnce(selector, data)[0]
+
+    def __selectSerializer(self, rawObject, asPickle, compression=None,
+                        compressionLevel=None, outOfBand=False, serializer=None):
+        # serializer is a tag in Serializer.SERIALIZERS, 'auto' picks the
+        # fastest one for rawObject's shape, otherwise the legacy flags decide.
+        sType = serializer
+        if not sType:
+            sType = 'pickle5' if outOfBand else ('pickle' if asPickle else 'json')
+        elif sType == 'auto':
+            sType = Serializer.autoSerializer(rawObject) or 'pickle'
+
+        selector = Serializer.getSerializer(sType)
+        if selector is None:
+            raise ValueError('Unknown serializer %s, expected one of %s'%(
+                                        sType, Serializer.availableSerializers()))
+
+        if compression:
+            selector = Serializer.CompressedSerializer(
+                                selector, sType, compression, compressionLevel)
+
+        return selector, sType
+
+    def push(self, rawObject, asPickle=False, compression=None,
+            compressionLevel=None, outOfBand=False, serializer=None, **kwargs):
+        '''
+        Serializes and uploads rawObject, json unless asPickle is set.
+        serializer names any registered serializer eg 'json-compact',
+        'marshal' or 'orjson', see Serializer.registerSerializer, or is
+        'auto' to use the fastest on a sample of rawObject, see
+        Serializer.autoSerializer.
+        outOfBand pickles with protocol 5, framing large buffers eg arrays
+        after the pickle stream so that they are never copied into it.
+        compression names one of Serializer.CODECS ie zlib, gzip, bz2 or
+        lzma to compress the payload with at compressionLevel. Small or
+        poorly compressible payloads are still sent as is, metaData records which.
+        '''
+        selector, sType = self.__selectSerializer(rawObject,
+                    asPickle, compression, compressionLevel, outOfBand, serializer)
+
+        # The payload is produced once, the bytes hashed are the bytes uploaded
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            # We maintain uniqueness
+            checkSum, tag = self.__serializeOnce(selector, rawObject, spool)
+            sType = tag or sType
+
+            status, retr = self.__manifestPull(checkSum=checkSum, metaData=sType, **kwargs)
+            kwargs.setdefault('uri', 'Computation@%s'%(time.time()))
+            func = self.__restDriver.uploadStream
+            if status == httpStatus.OK and retr:
+                # Scoped to the blob found, an unscoped update hits every blob
+                func = self.__restDriver.updateStream
+                if retr.get('id', None) is not None:
+                    kwargs['query'] = dict(id=retr['id'])
+                else:
+                    kwargs['query'] = dict(checkSum=checkSum, metaData=sType)
+
+            spool.seek(0)
+            return func(spool, checkSum=checkSum, metaData=sType, **kwargs)
+
+    def removeTrace(self, rawObj, asPickle=False, compression=None,
+            compressionLevel=None, outOfBand=False, serializer=None, **kwargs):
+        selector, sType = self.__selectSerializer(rawObj,
+                    asPickle, compression, compressionLevel, outOfBand, serializer)
+        checkSum, tag = self.__serializeOnce(selector, rawObj)
+
+        return self.__restDriver.deleteBlob(checkSum=checkSum, metaData=tag or sType)
 
     def removeByParams(self, **q):
         return self.__restDriver.deleteBlob(**q)
@@ -74,33 +139,36 @@ class CloudPassageHandler:
         keyName = data.get('content', None)
         if not keyName:
             return
-        stream = self.__restDriver.downloadBlobToStream(keyName)
-        if not (stream and Serializer.isCallableAttr(stream, '__next__')):
+
+        selector = Serializer.getSerializer(data.get('metaData', None))
+        if selector is None:
             return
-        
-        metaType = data.get('metaData', None)
 
-        selector = None
-        if metaType == 'json': 
-            selector = self.__jsonSerializer
-        elif metaType == 'pickle':
-            selector = self.__pickleSerializer
+        reader = self.__restDriver.openBlobStream(keyName,
+            checkSum=data.get('checkSum', None),
+            checkSumAlgoName=data.get('checkSumAlgoName', None)
+        )
+        if reader is None:
+            return
 
-        # Guess we've got to load it all into memory
+        # Deserialize straight off the connection rather than joining chunks
         try:
-            buf = stream.__next__() # Since we don't know the type
-            for chunk in stream:
-                buf += chunk
-        except StopIteration as e:
-            buf = None
+            return selector.load(reader, getattr(reader, 'contentLength', None))
         except Exception as e:
             sys.stderr.write('%s'%(e))
         finally:
-            if selector and buf is not None:
-                return selector.deserialize(buf)
+            reader.close()
 
     def __manifestPull(self, **identifiers):
         # Returns <errCode>, <data>
+        localManifest = self.__restDriver.getLocalManifest()
+        if localManifest is not None:
+            entry = localManifest.first(**identifiers)
+            if entry is None:
+                return httpStatus.NOT_FOUND, dict(status_code=httpStatus.NOT_FOUND, data=[])
+
+            return httpStatus.OK, entry.asDict()
+
         manifest = self.__restDriver.getCloudFilesManifest(**identifiers)
         status = manifest.get('status_code', httpStatus.BAD_REQUEST)
 
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# A requests.Session shared by a RestDriver's liasons and its file handler
+# so that keep-alive connections to the same host are pooled only once.
+
+import functools
+import threading
+
+import requests
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_POOL_SIZE = requests.adapters.DEFAULT_POOLSIZE
+DEFAULT_MAX_HOSTS = 10
+
+class ConnectionCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connects = 0
+
+    def add(self, requests=0, connects=0):
+        with self.lock:
+            self.requests += requests
+            self.connects += connects
+
+def countingPoolClasses(counter):
+    # urllib3 pool classes whose connections report every (re)connect
+    def countingConnection(baseCls):
+        class CountingConnection(baseCls):
+            def connect(self):
+                counter.add(connects=1)
+                return super(CountingConnection, self).connect()
+
+        return CountingConnection
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = countingConnection(HTTPConnectionPool.ConnectionCls)
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = countingConnection(HTTPSConnectionPool.ConnectionCls)
+
+    return {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+class CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, counter, **kwargs):
+        self.counter = counter # Needed by init_poolmanager, run by the base class
+        super(CountingHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = countingPoolClasses(self.counter)
+
+    def send(self, request, **kwargs):
+        self.counter.add(requests=1)
+        return super(CountingHTTPAdapter, self).send(request, **kwargs)
+
+class ConnectionPool(requests.Session):
+    '''
+    Params:
+        poolSize: connections kept alive per host. Left unset it starts at
+            requests' default and grows to fit concurrent operations eg
+            uploadTree, set it caps their concurrency instead.
+        maxHosts: hosts that each get their own pool of connections
+        blockWhenFull: wait for a free connection instead of opening one
+            past poolSize that is then discarded once used, also caps
+            concurrent operations at poolSize
+        keepAlive: set to False to close connections after every request
+        connectTimeout, readTimeout: seconds, applied to requests made
+            without their own timeout. None waits forever.
+        maxRetries: connection level retries, see requests' HTTPAdapter
+        requestPolicy: optional RequestPolicy that every request goes through
+    '''
+    def __init__(self, poolSize=None, maxHosts=DEFAULT_MAX_HOSTS,
+            blockWhenFull=False, keepAlive=True, connectTimeout=None,
+            readTimeout=None, maxRetries=0, requestPolicy=None):
+        super(ConnectionPool, self).__init__()
+
+        self.requestPolicy = requestPolicy
+        self.poolSize = 0
+        self.maxHosts = maxHosts
+        self.blockWhenFull = blockWhenFull
+        self.maxRetries = maxRetries
+        self.timeout = None
+        # Sized by the caller, operations then fit themselves to it
+        self.fixedSize = poolSize is not None or blockWhenFull
+        self.__lock = threading.Lock()
+        self.__counter = ConnectionCounter()
+        self.__adapter = None
+        self.__retiredHostKeys = set() # Hosts pooled by replaced adapters
+
+        self.setTimeouts(connectTimeout, readTimeout)
+        self.__resize(DEFAULT_POOL_SIZE if poolSize is None else poolSize)
+        if not keepAlive:
+            self.headers['Connection'] = 'close'
+
+    def setTimeouts(self, connectTimeout=None, readTimeout=None):
+        self.timeout = None
+        if connectTimeout is not None or readTimeout is not None:
+            self.timeout = (connectTimeout, readTimeout)
+
+    def __resize(self, maxSize):
+        # Only ever grows. The replaced adapter is closed, in flight requests
+        # finish and their connections are then dropped.
+        with self.__lock:
+            if maxSize <= self.poolSize:
+                return
+
+            retired = self.__adapter
+            self.poolSize = maxSize
+            self.__adapter = CountingHTTPAdapter(self.__counter,
+                pool_connections=self.maxHosts, pool_maxsize=maxSize,
+                max_retries=self.maxRetries, pool_block=self.blockWhenFull
+            )
+            self.mount('http://', self.__adapter)
+            self.mount('https://', self.__adapter)
+
+        if retired is not None:
+            self.__retiredHostKeys.update(retired.poolmanager.pools.keys())
+            retired.close()
+
+    def setPoolSize(self, maxSize):
+        # Explicitly grows the pool to maxSize, operations then fit themselves to it
+        self.fixedSize = True
+        self.__resize(maxSize)
+
+    def concurrencyFor(self, workers):
+        '''
+        Returns how many of workers should run at once over this pool. A
+        pool left to its default size grows to fit them, one sized by the
+        caller caps them at its poolSize.
+        '''
+        workers = max(1, workers)
+        if self.fixedSize:
+            return min(workers, self.poolSize)
+
+        self.__resize(workers)
+        return workers
+
+    def setRequestPolicy(self, requestPolicy):
+        self.requestPolicy = requestPolicy
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout', None) is None:
+            kwargs['timeout'] = self.timeout
+
+        send = functools.partial(super(ConnectionPool, self).request, method, url)
+        if self.requestPolicy is None:
+            return send(**kwargs)
+
+        return self.requestPolicy.execute(method, url, send, **kwargs)
+
+    def stats(self):
+        '''
+        Returns request counts where newConnections are the TCP (and TLS)
+        connections opened and reusedConnections the requests that went
+        over an already open, kept-alive one.
+        '''
+        counter = self.__counter
+        with counter.lock:
+            requestCount, newConnections = counter.requests, counter.connects
+
+        return dict(
+            hostPools=len(self.__retiredHostKeys.union(self.__adapter.poolmanager.pools.keys())),
+            requests=requestCount, newConnections=newConnections,
+            reusedConnections=max(0, requestCount - newConnections),
+            poolSize=self.poolSize, maxHosts=self.maxHosts
+        )
@@ -2,38 +2,95 @@
 # Author: Emmanuel Odeke <odeke@ualberta.ca>
 
 import os
+import copy
 import json
 import requests
 import collections
+import concurrent.futures
+
+try:
+    from metrics import track
+    from connectionPool import ConnectionPool
+    from manifestCache import normalizeQuery
+except:
+    from .metrics import track
+    from .connectionPool import ConnectionPool
+    from .manifestCache import normalizeQuery
+
+DEFAULT_BULK_CONCURRENCY = 8
+DEFAULT_BULK_BATCH_SIZE = 500
+
+def splitBatches(items, batchSize):
+    return [items[i:i + batchSize] for i in range(0, len(items), batchSize)]
+
+def expandBatchResult(parsed, batchLength):
+    # Maps a bulk endpoint's reply onto one result per item of the batch.
+    # The endpoint answers {'data': [{'status_code': ..., 'value': ...}, ...]}
+    # in item order, anything else is that batch's failure for every item.
+    value = parsed.get('value', None)
+    results = value.get('data', None) if isinstance(value, dict) else None
+    if parsed.get('status_code', None) == 200 and isinstance(results, list) \
+                                            and len(results) == batchLength:
+        return [dict(r) if isinstance(r, dict) else dict(value=r, status_code=200)
+                                                                for r in results]
+
+    reason = parsed.get('reason', value)
+    return [dict(reason=reason, status_code=parsed.get('status_code', None))
+                                                    for i in range(batchLength)]
 
 class DbConn:
-    def __init__(self, baseUrl, tokenRetrievalURL=None):
+    def __init__(self, baseUrl, tokenRetrievalURL=None, bulkUrl=None, session=None,
+                                metrics=None, metricsScope=None, singleFlight=None):
+        # session: a ConnectionPool shared with other DbConns, else one of our own
+        # metrics: a MetricsRegistry to record requests under metricsScope
+        # singleFlight: a SingleFlight that concurrent identical gets share
         self.baseUrl = baseUrl
-        self.__initSessionStore()
+        self.bulkUrl = bulkUrl
+        self.metrics = metrics
+        self.metricsScope = metricsScope or baseUrl
+        self.singleFlight = singleFlight
+        self.__headers = dict() # Ours alone even when the session is shared
+        self.__initSessionStore(session)
         self.__lastTokenRetrievalURL = tokenRetrievalURL
 
         if tokenRetrievalURL:
             self.refreshTokenStore(self.__lastTokenRetrievalURL)
     
-    def __initSessionStore(self):
-        self.__sessionStore = requests.Session()
+    def __initSessionStore(self, session=None):
+        self.__sessionStore = session if session is not None else ConnectionPool()
+
+    def getSessionStore(self):
+        return self.__sessionStore
+
+    def setPoolSize(self, maxSize):
+        # Explicitly sizes the shared pool, bulk requests then fit themselves to it
+        self.__sessionStore.setPoolSize(maxSize)
 
     def _updateHeaders(self, headerDict):
-        self.__sessionStore.headers.update(headerDict)
+        self.__headers.update(headerDict)
 
     def refreshTokenStore(self, tokenRetrievalUrl):
         rget = self.__sessionStore.get(
-                        tokenRetrievalUrl or self.__lastTokenRetrievalURL)
+                        tokenRetrievalUrl or self.__lastTokenRetrievalURL,
+                        headers=self.__headers)
 
         if rget.status_code == 200:
             self.__lastTokenRetrievalURL = tokenRetrievalUrl
-            self.__sessionStore.headers.update(rget.headers)
+            self.__headers.update(rget.headers)
             return True
 
+    def __send(self, method, url, metricName=None, **kwargs):
+        with track(self.metrics, self.metricsScope, metricName or method) as sample:
+            response = getattr(self.__sessionStore, method)(
+                                url or self.baseUrl, headers=self.__headers, **kwargs)
+            sample.status = response.status_code
+            sample.bytesSent = len(response.request.body or '')
+            sample.bytesReceived = len(response.content)
+
+        return self.__parseResponse(response)
+
     def post(self, url=None, **data):
-        return self.__parseResponse(
-            self.__sessionStore.post(url or self.baseUrl, data=json.dumps(data)
-        ))
+        return self.__send('post', url, data=json.dumps(data))
 
     def put(self, url=None, **data):
         outDict = dict(
@@ -41,19 +98,80 @@ class DbConn:
             updateParams=json.dumps(data.get('updateParams', {}))
         )
 
-        return self.__parseResponse(self.__sessionStore.put(
-            url or self.baseUrl, params=outDict
-        ))
+        return self.__send('put', url, params=outDict)
 
     def delete(self, url=None, **data):
-        return self.__parseResponse(
-            self.__sessionStore.delete(url or self.baseUrl, params=data)
-        )
+        return self.__send('delete', url, params=data)
 
     def get(self, url=None, **data):
-        return self.__parseResponse(
-            self.__sessionStore.get(url or self.baseUrl, params=data)
-        )
+        flight = self.singleFlight
+        if flight is None:
+            return self.__send('get', url, params=data)
+
+        # Every caller gets its own copy of the one parsed result. The headers
+        # are part of the key, connections with other tokens don't share it.
+        key = ('get', url or self.baseUrl, normalizeQuery(data), normalizeQuery(self.__headers))
+        return flight.do(key, lambda: self.__send('get', url, params=data), copy.deepcopy)
+
+    def bulk(self, method, items, concurrency=DEFAULT_BULK_CONCURRENCY,
+                                        batchSize=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Params:
+            method: one of 'post', 'put', 'delete'
+            items: list of dicts, each the keyword arguments of one such call
+                ie records for post, {'queryParams':..., 'updateParams':...}
+                for put and queries for delete.
+            concurrency: the most requests in flight at once
+            batchSize: items per request, only when a bulkUrl is set
+        Explanation:
+            + Returns one result per item, in the order of items, each shaped
+              like a single call's result ie {'value'|'reason', 'status_code'}.
+
+            + With a bulkUrl, items are sent batchSize at a time as
+              POST bulkUrl {"method": method, "items": [...]}
+              otherwise each item is its own request over the pooled session.
+        '''
+        if method not in ('post', 'put', 'delete'):
+            raise ValueError('Unsupported bulk method %s'%(method))
+
+        items = list(items)
+        if not items:
+            return []
+
+        # Fitted to the pooled connections, see ConnectionPool.concurrencyFor
+        concurrency = self.__sessionStore.concurrencyFor(concurrency or 1)
+
+        if self.bulkUrl:
+            batches = splitBatches(items, max(1, batchSize))
+            perBatch = self.__runBounded(
+                lambda batch: self.__postBatch(method, batch), batches, concurrency)
+            return [result for batchResults in perBatch for result in batchResults]
+
+        func = getattr(self, method)
+        return self.__runBounded(lambda item: self.__callItem(func, item), items, concurrency)
+
+    def __runBounded(self, func, items, concurrency):
+        if concurrency == 1 or len(items) == 1:
+            return [func(item) for item in items]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(func, items))
+
+    def __callItem(self, func, item):
+        # A failed item, eg a connection error, mustn't sink the rest of the bulk
+        try:
+            return func(**item)
+        except Exception as e:
+            return dict(reason='%s'%(e), status_code=None)
+
+    def __postBatch(self, method, batch):
+        try:
+            parsed = self.__send('post', self.bulkUrl, metricName='%sBulk'%(method),
+                                data=json.dumps(dict(method=method, items=batch)))
+        except Exception as e:
+            parsed = dict(reason='%s'%(e), status_code=None)
+
+        return expandBatchResult(parsed, len(batch))
 
     def __parseResponse(self, result):
         dataOut = {}
@@ -95,9 +213,21 @@ class HandlerLiason(object):
     def getConn(self, **data):
         return self.handler.get(**data)
 
+    def setSingleFlight(self, singleFlight):
+        self.handler.singleFlight = singleFlight
+
     def refreshTokenStoreConn(self, tokenRefreshURL=None):
         return self.handler.refreshTokenStore(tokenRefreshURL)
 
+    def postBulkConn(self, items, **kwargs):
+        return self.handler.bulk('post', items, **kwargs)
+
+    def putBulkConn(self, items, **kwargs):
+        return self.handler.bulk('put', items, **kwargs)
+
+    def deleteBulkConn(self, items, **kwargs):
+        return self.handler.bulk('delete', items, **kwargs)
+
 
 def main():
     dc = DbConn('http://127.0.0.1:8000')
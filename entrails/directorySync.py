@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Keeps a local directory and the blobs on restAssured in step. Files are
+# matched to manifest entries by title ie their '/' separated path relative
+# to the directory, and compared by size then checkSum so that only files
+# that differ are transferred.
+
+import os
+import sys
+import time
+import concurrent.futures
+
+PUSH, PULL = 'push', 'pull'
+
+UPLOAD, UPDATE, DOWNLOAD = 'upload', 'update', 'download'
+DELETE_REMOTE, DELETE_LOCAL, SKIP = 'deleteRemote', 'deleteLocal', 'skip'
+
+# Actions whose size counts as bytes transferred
+TRANSFERS = frozenset((UPLOAD, UPDATE, DOWNLOAD))
+
+def titleFor(root, path, prefix=''):
+    return prefix + os.path.relpath(path, root).replace(os.sep, '/')
+
+def localPathFor(root, title, prefix=''):
+    # Returns None for titles that would land outside of root eg '../x'
+    parts = [p for p in title[len(prefix):].split('/') if p not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+
+    return os.path.join(root, *parts)
+
+def isOK(response):
+    return getattr(response, 'status_code', None) in (200, 201)
+
+class SyncAction:
+    __slots__ = ('action', 'title', 'path', 'size', 'checkSum', 'entry', 'reason',)
+
+    def __init__(self, action, title, path=None, size=0, checkSum=None, entry=None, reason=None):
+        self.action = action
+        self.title = title
+        self.path = path
+        self.size = size or 0
+        self.checkSum = checkSum
+        self.entry = entry
+        self.reason = reason
+
+class DirectorySync:
+    '''
+    Params:
+        driver: the RestDriver to sync through
+        root: the local directory
+        prefix: prepended to every title, scopes the remote side to the
+            entries whose title starts with it
+        workers: transfers and hashing in flight at once
+        query: further scopes the remote side eg metaData='artifacts', it is
+            also sent along with every upload so new blobs land in scope
+    '''
+    def __init__(self, driver, root, prefix='', workers=8, pageSize=None, **query):
+        self.driver = driver
+        self.root = root
+        self.prefix = prefix or ''
+        self.workers = max(1, workers)
+        self.pageSize = pageSize
+        self.query = query
+
+    def localFiles(self):
+        # {title: path} of every regular file under root
+        files = dict()
+        for dirPath, dirNames, fileNames in os.walk(self.root):
+            for name in fileNames:
+                path = os.path.join(dirPath, name)
+                if os.path.isfile(path):
+                    files[titleFor(self.root, path, self.prefix)] = path
+
+        return files
+
+    def remoteEntries(self):
+        # {title: entry} of the manifest entries in scope, the oldest entry
+        # wins when several share a title. A local manifest saves the fetch.
+        localManifest = self.driver.getLocalManifest()
+        if localManifest is not None:
+            found = (entry.asDict() for entry in localManifest.find(**self.query))
+        else:
+            kwargs = dict(self.query)
+            if self.pageSize:
+                kwargs['pageSize'] = self.pageSize
+            found = self.driver.iterCloudFilesManifest(**kwargs)
+
+        entries = dict()
+        for entry in found:
+            title = entry.get('title', None)
+            if isinstance(title, str) and title.startswith(self.prefix):
+                entries.setdefault(title, entry)
+
+        return entries
+
+    def __changed(self, pairs):
+        # pairs: [(path, entry)] of files that exist on both sides. Returns
+        # {path: localCheckSum or None} for the pairs that differ; files whose
+        # size already differs are never hashed.
+        changed, byAlgo = dict(), dict()
+        defaultAlgo = self.driver.getCheckSumAlgoName()
+        for path, entry in pairs:
+            remoteSize = entry.get('size', None)
+            if remoteSize is not None and str(remoteSize) != str(os.path.getsize(path)):
+                changed[path] = None
+            else:
+                algoName = entry.get('checkSumAlgoName', None) or defaultAlgo
+                byAlgo.setdefault(algoName, []).append((path, entry))
+
+        for algoName, group in byAlgo.items():
+            checkSums = self.driver.getFileCheckSums(
+                            [path for path, entry in group], algoName, self.workers)
+            for path, entry in group:
+                if checkSums[path] is None or checkSums[path] != entry.get('checkSum', None):
+                    changed[path] = checkSums[path] if algoName == defaultAlgo else None
+
+        return changed
+
+    def plan(self, direction=PUSH, deleteOrphans=False):
+        # Returns the SyncActions that would bring the destination in line
+        if direction not in (PUSH, PULL):
+            raise ValueError('direction should be %s or %s, got %s'%(PUSH, PULL, direction))
+        if deleteOrphans and direction == PUSH and not (self.prefix or self.query):
+            raise ValueError('Deleting remote orphans needs a prefix or query to scope them')
+
+        local, remote = self.localFiles(), self.remoteEntries()
+        actions = []
+
+        if direction == PUSH:
+            shared = [(path, remote[title]) for title, path in local.items() if title in remote]
+            changed = self.__changed(shared)
+            for title, path in sorted(local.items()):
+                size = os.path.getsize(path)
+                entry = remote.get(title, None)
+                if entry is None:
+                    actions.append(SyncAction(UPLOAD, title, path, size))
+                elif path in changed:
+                    actions.append(SyncAction(UPDATE, title, path, size, changed[path], entry))
+                else:
+                    actions.append(SyncAction(SKIP, title, path, size, entry=entry))
+
+            if deleteOrphans:
+                for title in sorted(set(remote) - set(local)):
+                    entry = remote[title]
+                    actions.append(SyncAction(DELETE_REMOTE, title,
+                                    size=int(entry.get('size', 0) or 0), entry=entry))
+
+            return actions
+
+        paths = dict((title, localPathFor(self.root, title, self.prefix)) for title in remote)
+        shared = [(paths[title], remote[title]) for title in remote
+                            if paths[title] is not None and os.path.isfile(paths[title])]
+        changed = self.__changed(shared)
+        for title, entry in sorted(remote.items()):
+            path, size = paths[title], int(entry.get('size', 0) or 0)
+            if path is None:
+                actions.append(SyncAction(SKIP, title, size=size, entry=entry,
+                                                    reason='Outside of the directory'))
+            elif not os.path.isfile(path) or path in changed:
+                actions.append(SyncAction(DOWNLOAD, title, path, size, entry=entry))
+            else:
+                actions.append(SyncAction(SKIP, title, path, size, entry=entry))
+
+        if deleteOrphans:
+            for title in sorted(set(local) - set(remote)):
+                actions.append(SyncAction(DELETE_LOCAL, title, local[title],
+                                                os.path.getsize(local[title])))
+
+        return actions
+
+    def __remoteQuery(self, entry, title):
+        if entry.get('id', None) is not None:
+            return dict(id=entry['id'])
+
+        return dict(self.query, title=title)
+
+    def __download(self, action):
+        # Into a sibling temp file first so a failed download leaves no partial file
+        dirPath = os.path.dirname(action.path)
+        if not os.path.isdir(dirPath):
+            os.makedirs(dirPath, exist_ok=True)
+
+        tmpPath = '%s.%d.sync.tmp'%(action.path, os.getpid())
+        written = self.driver.downloadBlob(action.entry['content'], altName=tmpPath,
+            checkSum=action.entry.get('checkSum', None),
+            checkSumAlgoName=action.entry.get('checkSumAlgoName', None))
+
+        # A failed download writes nothing yet reports 0 bytes, or None
+        expectedSize = action.entry.get('size', None)
+        if written is None or not os.path.isfile(tmpPath) or (
+                expectedSize is not None and str(written) != str(expectedSize)):
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise IOError('Download of %s failed, got %s of %s bytes'%(
+                                    action.entry['content'], written, expectedSize))
+
+        os.replace(tmpPath, action.path)
+        return True
+
+    def apply(self, action):
+        # Carries out one SyncAction, returns its result dict
+        result = dict(action=action.action, size=action.size, ok=True)
+        if action.reason:
+            result['reason'] = action.reason
+
+        try:
+            if action.action == UPLOAD:
+                response = self.driver.uploadBlob(action.path, title=action.title, **self.query)
+            elif action.action == UPDATE:
+                attrs = dict(checkSum=action.checkSum) if action.checkSum else dict()
+                response = self.driver.updateFile(action.path,
+                    query=self.__remoteQuery(action.entry, action.title), **attrs)
+            elif action.action == DELETE_REMOTE:
+                response = self.driver.deleteBlob(
+                                **self.__remoteQuery(action.entry, action.title))
+            elif action.action == DOWNLOAD:
+                result['ok'] = self.__download(action)
+                return result
+            elif action.action == DELETE_LOCAL:
+                os.remove(action.path)
+                return result
+            else:
+                return result
+        except Exception as e:
+            sys.stderr.write('syncDirectory: %s %s: %s\n'%(action.action, action.title, e))
+            result.update(ok=False, reason=str(e))
+            return result
+
+        result['status_code'] = getattr(response, 'status_code', None)
+        result['ok'] = isOK(response)
+        if not result['ok']:
+            result['reason'] = str(getattr(response, 'text', response))
+
+        return result
+
+    def run(self, direction=PUSH, deleteOrphans=False, dryRun=False):
+        '''
+        Returns a dict with per-title 'results' ie their action, size and
+        whether it succeeded, counts of every action plus 'failed',
+        'bytesTransferred', 'bytesSkipped' and 'elapsed' seconds.
+        With dryRun nothing is changed and the results are what would be done.
+        '''
+        startTime = time.time()
+        actions = self.plan(direction, deleteOrphans)
+
+        if dryRun:
+            results = [dict(action=a.action, size=a.size, ok=True) for a in actions]
+        else:
+            workers = self.driver.getConnectionPool().concurrencyFor(self.workers)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(self.apply, actions))
+
+        summary = dict(direction=direction, dryRun=dryRun, results=dict(),
+            failed=0, bytesTransferred=0, bytesSkipped=0)
+        for name in (UPLOAD, UPDATE, DOWNLOAD, DELETE_REMOTE, DELETE_LOCAL, SKIP):
+            summary[name] = 0
+
+        for action, result in zip(actions, results):
+            summary['results'][action.title] = result
+            if not result['ok']:
+                summary['failed'] += 1
+                continue
+
+            summary[action.action] += 1
+            if action.action in TRANSFERS:
+                summary['bytesTransferred'] += action.size
+            elif action.action == SKIP:
+                summary['bytesSkipped'] += action.size
+
+        summary['elapsed'] = time.time() - startTime
+        return summary
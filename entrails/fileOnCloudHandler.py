@@ -7,36 +7,274 @@ import io
 import sys
 import mmap
 import json
+import time
+import uuid
+import shutil
 import random
 import hashlib
+import threading
+import concurrent.futures
 
 try:
-    from utils import getDefaultUserName, isCallableAttr, requests
+    from utils import (
+        getDefaultUserName, isCallableAttr, requests,
+        hashStream, CHECKSUM_CHUNK_SIZE, ManifestPageException
+    )
+    from multipartStream import MultipartStream, remainingLength
+    from manifest import Manifest
+    from singleFlight import SingleFlight
+    from uploadJournal import UploadJournal
+    from manifestCache import ManifestCache, normalizeQuery, copyParsed
+    from connectionPool import ConnectionPool
+    from metrics import track
 except:
-    from .utils import getDefaultUserName, isCallableAttr, requests
+    from .utils import (
+        getDefaultUserName, isCallableAttr, requests,
+        hashStream, CHECKSUM_CHUNK_SIZE, ManifestPageException
+    )
+    from .multipartStream import MultipartStream, remainingLength
+    from .manifest import Manifest
+    from .singleFlight import SingleFlight
+    from .uploadJournal import UploadJournal
+    from .manifestCache import ManifestCache, normalizeQuery, copyParsed
+    from .connectionPool import ConnectionPool
+    from .metrics import track
 
 sys.path.append('./entrails')
 import httpStatusCodes as httpStatus
 
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+# Entries per manifest request when iterating, see iterManifest
+DEFAULT_MANIFEST_PAGE_SIZE = 1000
+
+# Download reads are sized off the blob's length within these bounds, small
+# reads leave the transfer CPU bound on per-chunk overhead.
+MIN_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+def adaptiveChunkSize(contentLength=None):
+    try:
+        length = int(contentLength)
+    except (TypeError, ValueError):
+        return MAX_DOWNLOAD_CHUNK_SIZE
+
+    size = min(MAX_DOWNLOAD_CHUNK_SIZE, max(MIN_DOWNLOAD_CHUNK_SIZE, length // 16))
+    return size - (size % mmap.PAGESIZE)
+
+def isOK(response):
+    return getattr(response, 'status_code', None) in (httpStatus.OK, httpStatus.CREATED)
+
 def prepareResponse(statusCode, *rest):
     response = requests.Response()
     response.status_code = statusCode or httpStatus.BAD_REQUEST
     return response
 
+def iterFileChunks(f, chunkSize):
+    with f:
+        chunk = f.read(chunkSize)
+        while chunk:
+            yield chunk
+            chunk = f.read(chunkSize)
+
+class TrackedDownload:
+    # Records a streamed download, from its request until its stream is
+    # exhausted or closed, with the bytes read into a metrics Tracking.
+    def __init__(self, tracking):
+        self.__tracking = tracking
+        self.sample = tracking.__enter__()
+        self.__finished = False
+
+    def add(self, n):
+        self.sample.bytesReceived += n
+
+    def finish(self, failed=False):
+        if not self.__finished:
+            self.__finished = True
+            self.sample.failed = self.sample.failed or failed
+            self.__tracking.__exit__(None, None, None)
+
+class TrackedChunks:
+    # Iterator over a download's chunks that finishes its TrackedDownload
+    def __init__(self, chunks, download):
+        self.__chunks = iter(chunks)
+        self.__download = download
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.__chunks)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception:
+            self.__download.finish(failed=True)
+            raise
+
+        self.__download.add(len(chunk))
+        return chunk
+
+    def close(self):
+        close = getattr(self.__chunks, 'close', None)
+        if close is not None:
+            close()
+        self.__download.finish()
+
+    __del__ = close
+
+class ResponseReader(io.RawIOBase):
+    # File-like view of a streamed download so that consumers eg pickle.load
+    # can read the blob straight off the connection.
+    def __init__(self, response, download=None):
+        self.__response = response
+        self.__download = download # A TrackedDownload, if any
+        self.__response.raw.decode_content = True
+
+        self.contentLength = None
+        if not response.headers.get('Content-Encoding', None):
+            try:
+                self.contentLength = int(response.headers.get('Content-Length'))
+            except (TypeError, ValueError):
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.__response.raw.read(len(b))
+        n = len(data)
+        b[:n] = data
+        if self.__download is not None:
+            self.__download.add(n)
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.__response.close()
+            if self.__download is not None:
+                self.__download.finish()
+        super(ResponseReader, self).close()
+
 class FileOnCloudHandler:
-    def __init__(self, url, checkSumAlgoName='sha256'):
+    def __init__(self, url, checkSumAlgoName='sha256', session=None):
+        # session: a ConnectionPool shared eg with a RestDriver's liasons
         self.setBaseURL(url)
         self.__checkSumAlgoName = checkSumAlgoName
 
         # Just an alias/reference
         self.downloadBlobToBuffer = self.downloadBlobToStream
 
-        self.__sessionStore = requests.Session()
+        self.__sessionStore = session if session is not None else ConnectionPool()
+        self.__blobCache = None
+        self.__manifestCache = None
+        self.__localManifest = None
+        self.__singleFlight = None
+        self.__checkSumIndex = None
+        self.__metrics = None
+        self.__metricsScope = 'blobs'
+
+    def setMetrics(self, metrics, scope='blobs'):
+        # Records uploads, downloads and manifest lookups into metrics, a MetricsRegistry
+        self.__metrics = metrics
+        self.__metricsScope = scope
+
+    def getMetrics(self):
+        return self.__metrics
+
+    def __track(self, method):
+        return track(self.__metrics, self.__metricsScope, method)
+
+    def setManifestCache(self, manifestCache):
+        # getParsedManifest is served from manifestCache, a ManifestCache
+        self.__manifestCache = manifestCache
+
+    def getManifestCache(self):
+        return self.__manifestCache
+
+    def __invalidateManifestCache(self):
+        # Our own changes to the blobs must not be masked by cached manifests
+        if self.__manifestCache is not None:
+            self.__manifestCache.invalidate()
+
+    def setLocalManifest(self, manifest):
+        # Our own uploads, updates and deletes are applied to manifest, a Manifest
+        self.__localManifest = manifest
+
+    def getLocalManifest(self):
+        return self.__localManifest
+
+    def loadManifest(self, pageSize=DEFAULT_MANIFEST_PAGE_SIZE, **query):
+        # Returns a Manifest of the entries matching query, built page by page
+        return Manifest.fromEntries(self.iterManifest(pageSize=pageSize, **query))
+
+    def __applyToLocalManifest(self, response, isPut, query, fields):
+        # Mirrors one of our own successful uploads or updates into the local manifest
+        manifest = self.__localManifest
+        if manifest is None or not isOK(response):
+            return
+
+        if isPut:
+            manifest.update(query or {}, fields)
+            return
+
+        record = None
+        try:
+            record = response.json().get('data', None)
+        except Exception:
+            pass
+
+        manifest.add(record if isinstance(record, dict) else dict(fields))
+
+    def setCheckSumIndex(self, checkSumIndex):
+        # Files' checkSums are looked up in checkSumIndex, a CheckSumIndex,
+        # and only rehashed when their stat changed
+        self.__checkSumIndex = checkSumIndex
+
+    def getCheckSumIndex(self):
+        return self.__checkSumIndex
+
+    def __hashFile(self, path, algoName):
+        with open(path, 'rb') as f:
+            status, checkSumObj = self.getCheckSumByStream(f, algoName)
+
+        if status == httpStatus.OK:
+            return checkSumObj.hexdigest()
+
+    def getFileCheckSum(self, path, algoName=None):
+        # Returns the file's hexdigest, None for an unknown algo. Raises
+        # EnvironmentError for files that can't be read.
+        algoName = algoName or self.__checkSumAlgoName
+        if self.__checkSumIndex is None:
+            return self.__hashFile(path, algoName)
+
+        return self.__checkSumIndex.checkSum(
+                    path, algoName, lambda: self.__hashFile(path, algoName))
+
+    def setSingleFlight(self, singleFlight):
+        # Concurrent identical getParsedManifest calls share one request
+        self.__singleFlight = singleFlight
+
+    def getSingleFlight(self):
+        return self.__singleFlight
+
+    def setBlobCache(self, blobCache):
+        # Downloads are served from blobCache, a BlobCache, when they can be
+        self.__blobCache = blobCache
+
+    def getBlobCache(self):
+        return self.__blobCache
+
+    def setPoolSize(self, maxSize):
+        # Explicitly sizes the shared pool, see ConnectionPool.concurrencyFor
+        self.__sessionStore.setPoolSize(maxSize)
 
     def setBaseURL(self, url):
         self.__baseUrl = url.strip('/')
         self.__upUrl = self.__baseUrl + '/uploader'
         self.__mediaUrl = self.__baseUrl + '/media/'
+        self.__chunkedUrl = self.__upUrl + '/chunked'
 
     def getBaseURL(self):
         return self.__baseUrl
@@ -51,41 +289,105 @@ class FileOnCloudHandler:
         if not isCallableAttr(hashlib, algoName or self.__checkSumAlgoName):
             return 400, 'No such algo exists'
         try:
-            checkSumObj = getattr(hashlib, self.__checkSumAlgoName)(byteStream)
+            checkSumObj = getattr(hashlib, algoName or self.__checkSumAlgoName)(byteStream)
+        except Exception as e:
+            return httpStatus.INTERNAL_SERVER_ERROR, e
+        else:
+            return httpStatus.OK, checkSumObj
+
+    def getCheckSumByStream(self, stream, algoName=None, chunkSize=CHECKSUM_CHUNK_SIZE):
+        # Same contract as getCheckSum but hashes the stream chunk by chunk
+        status, checkSumObj = self.getCheckSum(b'', algoName)
+        if status != httpStatus.OK:
+            return status, checkSumObj
+        try:
+            hashStream(checkSumObj, stream, chunkSize)
         except Exception as e:
             return httpStatus.INTERNAL_SERVER_ERROR, e
         else:
             return httpStatus.OK, checkSumObj
 
-    def __pushUpFileByStream(self, isPut, stream, **attrs):
+    def __pushUpFileByStream(self, isPut, stream, hashWhileUploading=False, **attrs):
+        # With hashWhileUploading, the blob is hashed as it is being sent
+        # rather than in a separate pass, it is tagged with a provisional
+        # 'pending-' checkSum and a follow-up update then sets the real one.
+        # The upload's response is returned, its body still shows the
+        # provisional checkSum. A failed follow-up's response is returned
+        # instead, the blob then keeps its provisional checkSum.
+        hasher = None
+        provisionalCheckSum = None
         if attrs.get('checkSum', None) is None:
-            try:
-                origPos = stream.tell()
-                status, result = self.getCheckSum(stream.read())
+            if hashWhileUploading:
+                status, hasher = self.getCheckSum(b'')
                 if status != httpStatus.OK:
-                    return result 
+                    return hasher
 
-                stream.seek(origPos) # Get back to original position
-            except Exception as e:
-                print('pushUpFilesByStream', e)
-                return e
+                provisionalCheckSum = 'pending-%s'%(uuid.uuid4().hex)
+                attrs['checkSum'] = provisionalCheckSum
             else:
-                attrs['checkSum'] = result.hexdigest()
+                try:
+                    origPos = stream.tell()
+                    status, result = self.getCheckSumByStream(stream)
+                    if status != httpStatus.OK:
+                        return result
+
+                    stream.seek(origPos) # Get back to original position
+                except Exception as e:
+                    print('pushUpFilesByStream', e)
+                    return e
+                else:
+                    attrs['checkSum'] = result.hexdigest()
 
         attrs.setdefault('checkSumAlgoName', self.__checkSumAlgoName)
 
-        if not isPut: 
-            return self.___opHandler(self.__sessionStore.post,
-                self.__upUrl, data=attrs, files={'blob': stream}
+        method, q, d = self.__sessionStore.post, None, attrs
+        if isPut:
+            method, q, d = self.__sessionStore.put, attrs.get('query', {}), dict(attrs.get('data', {}))
+            if not q:
+                # An empty query matches every blob, refuse to overwrite them all
+                return prepareResponse(httpStatus.BAD_REQUEST)
+
+            d.setdefault('checkSum', attrs['checkSum'])
+            d.setdefault('checkSumAlgoName', attrs['checkSumAlgoName'])
+
+        blobLength = remainingLength(stream) if isPut else None
+        body = MultipartStream(d, stream, 'blob', hasher=hasher)
+        if body.len is None:
+            # Unknown length eg text streams, let requests encode it in memory
+            if hasher is not None:
+                return prepareResponse(httpStatus.BAD_REQUEST)
+
+            response = self.__trackedOp('update' if isPut else 'upload', method,
+                self.__upUrl, data=d, params=q, files={'blob': stream}
             )
-        
-        q = attrs.get('query', {})
-        d = attrs.get('data', {})
-        return self.___opHandler(self.__sessionStore.put,
-            self.__upUrl, data=d, params=q, files={'blob': stream}
+        else:
+            response = self.__trackedOp('update' if isPut else 'upload', method,
+                self.__upUrl, data=body, params=q,
+                headers={'Content-Type': body.contentType}, bytesSent=body.len
+            )
+
+        self.__invalidateManifestCache()
+        self.__applyToLocalManifest(response, isPut, q,
+                            dict(d, size=blobLength) if blobLength is not None else d)
+        if hasher is None or getattr(response, 'status_code', None) not in (
+                                                httpStatus.OK, httpStatus.CREATED):
+            return response
+
+        followUp = self.___opHandler(self.__sessionStore.put, self.__upUrl,
+            params=dict(checkSum=provisionalCheckSum),
+            data=dict(checkSum=hasher.hexdigest())
         )
+        self.__invalidateManifestCache()
+        self.__applyToLocalManifest(followUp, True,
+                    dict(checkSum=provisionalCheckSum), dict(checkSum=hasher.hexdigest()))
+
+        # Surface a failed follow-up since the blob's checkSum is still provisional
+        if getattr(followUp, 'status_code', None) != httpStatus.OK:
+            return followUp
+
+        return response
 
-    def __pushUpFileByPath(self, methodToggle, fPath, **attrs):
+    def __pushUpFileByPath(self, methodToggle, fPath, chunked=False, **attrs):
         response = None
         if not (fPath and os.access(fPath, os.R_OK)):
             return prepareResponse(httpStatus.FORBIDDEN)
@@ -93,6 +395,21 @@ class FileOnCloudHandler:
         if not os.path.isfile(fPath):
             return prepareResponse(httpStatus.NOT_FOUND)
 
+        if self.__checkSumIndex is not None and not attrs.get('checkSum', None) \
+                                    and not attrs.get('hashWhileUploading', False):
+            # Unchanged files aren't read an extra time just to be hashed
+            attrs['checkSum'] = self.getFileCheckSum(fPath, attrs.get('checkSumAlgoName', None))
+
+        if chunked:
+            attrs.pop('isPut', None)
+            with self.__track('chunkedUpdate' if methodToggle else 'chunkedUpload') as sample:
+                response = self.__pushUpFileChunked(methodToggle, fPath, **attrs)
+                sample.status = getattr(response, 'status_code', None)
+                sample.failed = not isOK(response)
+                sample.bytesSent = os.path.getsize(fPath)
+
+            return response
+
         checkSumInfo = None
         with open(fPath, 'rb') as f:
             attrs['stream'] = f
@@ -101,6 +418,111 @@ class FileOnCloudHandler:
         
         return response
 
+    def __pushUpFileChunked(self, isPut, fPath, partSize=DEFAULT_PART_SIZE,
+                                    partWorkers=4, journalDir=None, **attrs):
+        '''
+        Uploads fPath in partSize parts, each carrying its own checkSum, with
+        up to partWorkers parts in flight. Confirmed parts are recorded in a
+        local journal so re-invoking this after a failure only sends the
+        missing parts. The blob is then finalized against the whole-file
+        checkSum. The protocol, implemented by standInServer, is:
+            POST|PUT  /uploader/chunked                 -> {'data': {'uploadId'}}
+            GET       /uploader/chunked/<uploadId>      -> {'data': {'parts'}}
+            PUT       /uploader/chunked/<uploadId>/<i>?checkSum=<partCheckSum>
+            POST      /uploader/chunked/<uploadId>/finalize
+        '''
+        fStat = os.stat(fPath)
+        partCount = max(1, -(-fStat.st_size // partSize))
+        journal = UploadJournal(fPath, self.__baseUrl, journalDir)
+        state = journal.load(
+            size=fStat.st_size, mtimeNs=fStat.st_mtime_ns, partSize=partSize, isPut=isPut)
+
+        algoName = attrs.setdefault('checkSumAlgoName', self.__checkSumAlgoName)
+        checkSum = attrs.get('checkSum', None) or state.get('checkSum', None)
+        if not checkSum:
+            with open(fPath, 'rb') as f:
+                status, result = self.getCheckSumByStream(f, algoName)
+            if status != httpStatus.OK:
+                return prepareResponse(status)
+            checkSum = result.hexdigest()
+
+        uploadId, confirmed = state.get('uploadId', None), set()
+        if uploadId:
+            # The server has the final say on which parts it holds
+            response = self.___opHandler(
+                self.__sessionStore.get, '%s/%s'%(self.__chunkedUrl, uploadId))
+            if isOK(response):
+                confirmed = set(response.json().get('data', {}).get('parts', []))
+            else:
+                uploadId = None
+
+        if not uploadId:
+            method, params, fields = self.__sessionStore.post, None, dict(attrs)
+            if isPut:
+                method, params = self.__sessionStore.put, attrs.get('query', {})
+                if not params:
+                    return prepareResponse(httpStatus.BAD_REQUEST)
+
+                fields = dict(attrs.get('data', {}), checkSumAlgoName=algoName)
+
+            fields.update(checkSum=checkSum, size=fStat.st_size,
+                                partSize=partSize, partCount=partCount)
+            response = self.___opHandler(
+                method, self.__chunkedUrl, data=fields, params=params)
+            if not isOK(response):
+                return response
+
+            uploadId = response.json().get('data', {}).get('uploadId', None)
+            journal.save(uploadId=uploadId, size=fStat.st_size, isPut=isPut,
+                mtimeNs=fStat.st_mtime_ns, partSize=partSize, checkSum=checkSum,
+                confirmed=[])
+
+        def pushPart(partIndex):
+            try:
+                with open(fPath, 'rb') as f:
+                    f.seek(partIndex * partSize)
+                    data = f.read(partSize)
+            except EnvironmentError as e:
+                return e
+
+            status, partCheckSum = self.getCheckSum(data, algoName)
+            if status != httpStatus.OK:
+                return prepareResponse(status)
+
+            response = self.___opHandler(self.__sessionStore.put,
+                '%s/%s/%d'%(self.__chunkedUrl, uploadId, partIndex),
+                data=data, params=dict(checkSum=partCheckSum.hexdigest())
+            )
+            if isOK(response):
+                journal.markConfirmed(partIndex)
+
+            return response
+
+        partWorkers = self.__sessionStore.concurrencyFor(partWorkers)
+        pending = [i for i in range(partCount) if i not in confirmed]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=partWorkers) as pool:
+            failures = [r for r in pool.map(pushPart, pending) if not isOK(r)]
+
+        if failures: # The journal is kept, a retry resumes from here
+            return failures[0]
+
+        response = self.___opHandler(self.__sessionStore.post,
+                            '%s/%s/finalize'%(self.__chunkedUrl, uploadId))
+        self.__invalidateManifestCache()
+        if isPut:
+            self.__applyToLocalManifest(response, True, attrs.get('query', {}), dict(
+                attrs.get('data', {}), checkSum=checkSum, checkSumAlgoName=algoName,
+                size=fStat.st_size))
+        else:
+            self.__applyToLocalManifest(response, False, None,
+                                    dict(attrs, checkSum=checkSum, size=fStat.st_size))
+
+        if isOK(response) or getattr(response, 'status_code', None) == httpStatus.BAD_REQUEST:
+            # On a whole-file checkSum mismatch, the next attempt starts afresh
+            journal.remove()
+
+        return response
+
     def uploadBlobByStream(self, f, **attrs):
         return self.__pushUpFileByStream(stream=f, **attrs)
 
@@ -113,6 +535,114 @@ class FileOnCloudHandler:
     def updateFileByPath(self, fPath, **attrs):
         return self.__pushUpFileByPath(True, fPath, **attrs)
 
+    def uploadTree(self, root, workers=8, **attrs):
+        '''
+        Uploads every file under root over a bounded pool of workers that
+        share this handler's session. The manifest is fetched once and
+        files whose checkSum is already on the cloud, or that duplicate
+        another file in the tree, are skipped. Each file is titled by its
+        '/' separated path relative to root; extra attrs eg author and
+        metaData are sent along with every file.
+
+        Returns a dict with per-file 'results' keyed by path, the
+        'uploaded', 'skipped' and 'failed' counts, 'bytesUploaded',
+        'bytesSkipped', 'elapsed' seconds and 'throughput' in bytes/second.
+        'dedup' is False, with the reason in 'dedupError', when the manifest
+        couldn't be fetched and only duplicates within the tree are skipped.
+        '''
+        startTime = time.time()
+
+        paths = []
+        for dirPath, dirNames, fileNames in os.walk(root):
+            paths.extend(os.path.join(dirPath, name) for name in fileNames)
+
+        # The local manifest, if any, is current already and gets the
+        # uploads applied to it. Otherwise only the checkSums are fetched.
+        manifest, dedupError = self.__localManifest, None
+        if manifest is None:
+            parsed = self.getParsedManifest(select='checkSum')
+            if parsed.get('status_code', None) != httpStatus.OK or 'data' not in parsed:
+                dedupError = 'Fetching the manifest failed with status %s: %s'%(
+                            parsed.get('status_code', None), parsed.get('reason', ''))
+            manifest = Manifest.fromResponse(parsed)
+
+        # checkSum -> Event set once the upload that claimed it is done, a
+        # duplicate waits on it and uploads itself if that upload failed.
+        claims = dict()
+        knownLock = threading.Lock()
+
+        def uploadOne(path):
+            result = dict(skipped=False, size=0, checkSum=None, status_code=None)
+            try:
+                result['size'] = os.path.getsize(path)
+                checkSum = self.getFileCheckSum(path)
+            except EnvironmentError as e:
+                result['reason'] = str(e)
+                return result
+
+            if checkSum is None:
+                result['reason'] = 'No such algo %s'%(self.__checkSumAlgoName)
+                return result
+
+            result['checkSum'] = checkSum
+            while True:
+                with knownLock:
+                    claim = claims.get(checkSum, None)
+                    if claim is None:
+                        if manifest.hasCheckSum(checkSum):
+                            result['skipped'] = True
+                            return result
+
+                        # Claims the checkSum so duplicates in the tree are skipped
+                        claim = claims[checkSum] = threading.Event()
+                        placeholder = manifest.add(dict(checkSum=checkSum))
+                        break
+
+                claim.wait()
+
+            failed = True
+            try:
+                fileAttrs = dict(attrs)
+                fileAttrs.setdefault(
+                    'title', os.path.relpath(path, root).replace(os.sep, '/'))
+                response = self.uploadBlobByPath(path, checkSum=checkSum, **fileAttrs)
+                result['status_code'] = getattr(response, 'status_code', None)
+                failed = result['status_code'] not in (httpStatus.OK, httpStatus.CREATED)
+                if failed:
+                    result['reason'] = str(getattr(response, 'text', response))
+            finally:
+                with knownLock:
+                    # A local manifest now holds the uploaded entry in place of the claim
+                    if failed or manifest is self.__localManifest:
+                        manifest.discard(placeholder)
+                    del claims[checkSum]
+                claim.set()
+
+            return result
+
+        workers = self.__sessionStore.concurrencyFor(workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(paths, pool.map(uploadOne, paths)))
+
+        summary = dict(results=results, uploaded=0, skipped=0, failed=0,
+                    bytesUploaded=0, bytesSkipped=0, dedup=dedupError is None)
+        if dedupError is not None:
+            summary['dedupError'] = dedupError
+
+        for result in results.values():
+            if result['skipped']:
+                summary['skipped'] += 1
+                summary['bytesSkipped'] += result['size']
+            elif result['status_code'] in (httpStatus.OK, httpStatus.CREATED):
+                summary['uploaded'] += 1
+                summary['bytesUploaded'] += result['size']
+            else:
+                summary['failed'] += 1
+
+        elapsed = summary['elapsed'] = time.time() - startTime
+        summary['throughput'] = summary['bytesUploaded'] / elapsed if elapsed else 0
+        return summary
+
     def __pathForMediaDownload(self, fPath):
         return self.__mediaUrl + fPath
 
@@ -126,27 +656,284 @@ class FileOnCloudHandler:
             if dataIn.status_code == httpStatus.OK:
                 return dataIn
 
-    def downloadBlobToStream(self, fPath, readChunkSize=mmap.PAGESIZE):
+    def __cachedBlobPath(self, fPath, checkSum=None, checkSumAlgoName=None):
+        # Returns the path of fPath's blob in the local cache, downloading it
+        # into the cache on a miss. Without a cache or a known checkSum, or if
+        # the download doesn't match its checkSum, returns None.
+        if self.__blobCache is None:
+            return None
+
+        if not checkSum:
+            entry = self.getManifestEntry(fPath) or {}
+            checkSum = entry.get('checkSum', None)
+            checkSumAlgoName = checkSumAlgoName or entry.get('checkSumAlgoName', None)
+            if not checkSum:
+                return None
+
+        algoName = checkSumAlgoName or self.__checkSumAlgoName
+        path = self.__blobCache.get(algoName, checkSum)
+        if path is None:
+            dataIn = self.__dlAndGetStream(fPath)
+            if dataIn is None:
+                return None
+            try:
+                path = self.__blobCache.put(algoName, checkSum, dataIn.iter_content(
+                    chunk_size=adaptiveChunkSize(dataIn.headers.get('Content-Length'))))
+            finally:
+                dataIn.close()
+
+        return path
+
+    def __openCachedBlob(self, fPath, checkSum=None, checkSumAlgoName=None):
+        path = self.__cachedBlobPath(fPath, checkSum, checkSumAlgoName)
+        if path is not None:
+            try:
+                return open(path, 'rb', buffering=0)
+            except EnvironmentError: # Evicted in the meantime
+                pass
+
+    def downloadBlobToStream(self, fPath, readChunkSize=None,
+                                        checkSum=None, checkSumAlgoName=None):
+        # readChunkSize defaults to one adapted to the blob's length. The
+        # download's metrics are recorded once the chunks are consumed.
+        download = TrackedDownload(self.__track('download'))
+        try:
+            chunks = self.__downloadBlobToStream(
+                        fPath, readChunkSize, checkSum, checkSumAlgoName, download)
+        except BaseException:
+            download.finish(failed=True)
+            raise
+
+        if chunks is None:
+            download.finish(failed=True)
+            return None
+
+        return TrackedChunks(chunks, download)
+
+    def __downloadBlobToStream(self, fPath, readChunkSize, checkSum, checkSumAlgoName, download):
+        cached = self.__openCachedBlob(fPath, checkSum, checkSumAlgoName)
+        if cached is not None:
+            return iterFileChunks(cached, readChunkSize or
+                            adaptiveChunkSize(os.fstat(cached.fileno()).st_size))
+
         dataObj = self.__dlAndGetStream(fPath)
         if isCallableAttr(dataObj, 'iter_content'):
+            download.sample.status = dataObj.status_code
+            if not readChunkSize:
+                readChunkSize = adaptiveChunkSize(dataObj.headers.get('Content-Length'))
             return dataObj.iter_content(chunk_size=readChunkSize)
 
-    def downloadBlobToDisk(self, pathOnCloudName, altName=None, chunkSize=mmap.PAGESIZE):
-        chunkIterator = self.downloadBlobToStream(pathOnCloudName, chunkSize)
+    def openBlobStream(self, fPath, checkSum=None, checkSumAlgoName=None):
+        # Returns a binary file-like object over the blob with its size as the
+        # attribute 'contentLength', None if it could not be fetched. The
+        # download's metrics are recorded once the stream is closed.
+        download = TrackedDownload(self.__track('download'))
+        try:
+            cached = self.__openCachedBlob(fPath, checkSum, checkSumAlgoName)
+            if cached is not None:
+                # Served locally, there's no transfer left to time
+                cached.contentLength = os.fstat(cached.fileno()).st_size
+                download.add(cached.contentLength)
+                download.finish()
+                return cached
+
+            dataIn = self.__dlAndGetStream(fPath)
+        except BaseException:
+            download.finish(failed=True)
+            raise
+
+        if dataIn is None:
+            download.finish(failed=True)
+            return None
+
+        download.sample.status = dataIn.status_code
+        return ResponseReader(dataIn, download)
+
+    def __copyResponseToFd(self, dataIn, fd, offset=None, chunkSize=None):
+        # Writes the body straight to fd with unbuffered, at offset positional,
+        # writes of large reads. urllib3's readinto copies through a temporary
+        # anyway so plain reads measure faster than a reusable buffer here.
+        if not chunkSize:
+            chunkSize = adaptiveChunkSize(dataIn.headers.get('Content-Length'))
+
         writtenBytes = 0
-        if isCallableAttr(chunkIterator, '__next__'):
-            localName = altName or os.path.basename(pathOnCloudName)
-            with open(localName, 'wb') as f:
-                for chunk in chunkIterator:
-                    if chunk:
-                        writtenBytes += f.write(chunk)
-                        f.flush()
+        while True:
+            chunk = dataIn.raw.read(chunkSize, decode_content=True)
+            if not chunk:
+                break
+
+            view = memoryview(chunk)
+            while view:
+                if offset is None:
+                    w = os.write(fd, view)
+                else:
+                    w = os.pwrite(fd, view, offset + writtenBytes)
+                view = view[w:]
+                writtenBytes += w
+
+        return writtenBytes
+
+    def getManifestEntry(self, pathOnCloudName):
+        # Returns the manifest entry of the blob stored at pathOnCloudName, if any
+        manifest = self.getParsedManifest(content=pathOnCloudName)
+        for entry in manifest.get('data', None) or []:
+            if isinstance(entry, dict):
+                return entry
+
+    def __fetchRange(self, url, fd, start, end, chunkSize, writeLock):
+        # Fetches bytes [start, end] and writes them at their offsets in fd
+        dataIn = self.__sessionStore.get(url, stream=True,
+                        headers={'Range': 'bytes=%d-%d'%(start, end)})
+        try:
+            if dataIn.status_code != httpStatus.PARTIAL_CONTENT:
+                raise ValueError('Expected a partial response got %d'%(dataIn.status_code))
+
+            if hasattr(os, 'pwrite'):
+                writtenBytes = self.__copyResponseToFd(dataIn, fd, start, chunkSize)
+            else:
+                writtenBytes = 0
+                for chunk in dataIn.iter_content(chunk_size=chunkSize or adaptiveChunkSize()):
+                    with writeLock:
+                        os.lseek(fd, start + writtenBytes, os.SEEK_SET)
+                        os.write(fd, chunk)
+                    writtenBytes += len(chunk)
+
+            if writtenBytes != end - start + 1:
+                raise ValueError('Short range %d-%d got %d bytes'%(start, end, writtenBytes))
+        finally:
+            dataIn.close()
+
+        return writtenBytes
+
+    def __expectedCheckSum(self, pathOnCloudName, checkSum=None, checkSumAlgoName=None):
+        # Returns the (checkSum, checkSumAlgoName) a download is verified
+        # against, looking the blob up in the manifest if none was passed in.
+        if checkSum:
+            return checkSum, checkSumAlgoName
+
+        entry = self.getManifestEntry(pathOnCloudName) or {}
+        return entry.get('checkSum', None), entry.get('checkSumAlgoName', None)
+
+    def __verifyDownload(self, pathOnCloudName, localName, checkSum, checkSumAlgoName):
+        # True if localName hashes to checkSum, or if there is no checkSum to go by
+        if not checkSum:
+            return True
+
+        with open(localName, 'rb') as f:
+            status, checkSumObj = self.getCheckSumByStream(f, checkSumAlgoName)
+        if status != httpStatus.OK or checkSumObj.hexdigest() != checkSum:
+            print('downloadBlobToDisk: checkSum mismatch for', pathOnCloudName)
+            return False
+
+        return True
+
+    def __rangedDownload(self, pathOnCloudName, localName, chunkSize, workers, rangeSize, expected):
+        # Returns the number of bytes written or None if the caller should
+        # fall back to a plain single-stream download. The written bytes are
+        # verified against expected, a (checkSum, checkSumAlgoName) pair.
+        url = self.__pathForMediaDownload(pathOnCloudName)
+        try:
+            head = self.__sessionStore.head(url)
+            size = int(head.headers.get('Content-Length', -1))
+        except Exception as e:
+            print('downloadBlobToDisk', e)
+            return None
+
+        if head.status_code != httpStatus.OK or head.headers.get('Accept-Ranges', '') != 'bytes':
+            return None
+        if size <= rangeSize:
+            return None # Not worth splitting
+
+        ranges = [(start, min(start + rangeSize, size) - 1) for start in range(0, size, rangeSize)]
+        fd = os.open(localName, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+
+            writeLock = threading.Lock()
+            workers = self.__sessionStore.concurrencyFor(min(workers, len(ranges)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(self.__fetchRange, url, fd, start, end, chunkSize, writeLock)
+                    for start, end in ranges
+                ]
+                writtenBytes = sum(future.result() for future in futures)
+        except Exception as e:
+            print('downloadBlobToDisk', e)
+            return None
+        finally:
+            os.close(fd)
+
+        if not self.__verifyDownload(pathOnCloudName, localName, *expected):
+            return None
+
+        return writtenBytes
+
+    def downloadBlobToDisk(self, pathOnCloudName, *args, **kwargs):
+        # Returns the number of bytes written, 0 if the blob couldn't be fetched
+        with self.__track('download') as sample:
+            writtenBytes = self.__downloadBlobToDisk(pathOnCloudName, *args, **kwargs)
+            sample.bytesReceived = writtenBytes or 0
+            sample.failed = writtenBytes is None
+
+        return writtenBytes or 0
+
+    def __downloadBlobToDisk(self, pathOnCloudName, altName=None, chunkSize=None,
+                    workers=1, rangeSize=DEFAULT_PART_SIZE, fsync=False,
+                    checkSum=None, checkSumAlgoName=None):
+        # With workers > 1 and a server that honours Range requests, the blob
+        # is fetched as rangeSize byte ranges over several connections and
+        # verified against checkSum or else its manifest checkSum, as is the
+        # single-stream download it falls back to. fsync=True makes sure the
+        # bytes are on disk before returning.
+        localName = altName or os.path.basename(pathOnCloudName)
+        writtenBytes = None
+        expected = None
+
+        cached = self.__openCachedBlob(pathOnCloudName, checkSum, checkSumAlgoName)
+        if cached is not None:
+            with cached, open(localName, 'wb') as f:
+                shutil.copyfileobj(cached, f, MAX_DOWNLOAD_CHUNK_SIZE)
+                writtenBytes = f.tell()
+
+        if writtenBytes is None and workers > 1:
+            expected = self.__expectedCheckSum(pathOnCloudName, checkSum, checkSumAlgoName)
+            writtenBytes = self.__rangedDownload(
+                    pathOnCloudName, localName, chunkSize, workers, rangeSize, expected)
+
+        if writtenBytes is None:
+            dataIn = self.__dlAndGetStream(pathOnCloudName)
+            if dataIn is None:
+                return None
+
+            try:
+                with open(localName, 'wb', buffering=0) as f:
+                    writtenBytes = self.__copyResponseToFd(dataIn, f.fileno(), None, chunkSize)
+            finally:
+                dataIn.close()
+
+            if expected is not None and not self.__verifyDownload(pathOnCloudName, localName, *expected):
+                os.remove(localName)
+                return None
+
+        if fsync and writtenBytes:
+            fd = os.open(localName, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
         return writtenBytes
 
     def deleteBlobOnCloud(self, **attrsDict):
-        return self.___opHandler(
+        response = self.__trackedOp('delete',
                 self.__sessionStore.delete, self.__upUrl, params=attrsDict)
+        self.__invalidateManifestCache()
+        if self.__localManifest is not None and isOK(response):
+            self.__localManifest.remove(**attrsDict)
+        return response
 
     def ___opHandler(self, func, *args, **kwargs):
         res = None
@@ -157,12 +944,110 @@ class FileOnCloudHandler:
 
         return res
 
+    def __trackedOp(self, metricName, func, *args, bytesSent=0, **kwargs):
+        # ___opHandler, recording the call under metricName
+        with self.__track(metricName) as sample:
+            res = self.___opHandler(func, *args, **kwargs)
+            sample.bytesSent = bytesSent or 0
+            sample.status = getattr(res, 'status_code', None)
+            sample.failed = isinstance(res, Exception)
+            if not (sample.failed or kwargs.get('stream', False)):
+                sample.bytesReceived = len(res.content)
+
+        return res
+
     def getManifest(self, **query):
-        return self.___opHandler(
+        return self.__trackedOp('manifest',
                         self.__sessionStore.get, self.__upUrl, params=query)
 
     def getParsedManifest(self, **query):
-        return self.jsonParseResponse(self.getManifest(**query))
+        flight = self.__singleFlight
+        if flight is None:
+            return self.__getParsedManifest(query)
+
+        key = ('get', self.__upUrl, normalizeQuery(query))
+        return flight.do(key, lambda: self.__getParsedManifest(query), copyParsed)
+
+    def __getParsedManifest(self, query):
+        cache = self.__manifestCache
+        if cache is None:
+            return self.jsonParseResponse(self.getManifest(**query))
+
+        key = normalizeQuery(query)
+        entry, isFresh = cache.lookup(key)
+        if isFresh:
+            return copyParsed(entry.parsed)
+
+        generation = cache.generation()
+        headers = entry.validators() if entry is not None else None
+        response = self.__trackedOp('manifest', self.__sessionStore.get,
+                                self.__upUrl, params=query, headers=headers)
+
+        if entry is not None and getattr(response, 'status_code', None) == httpStatus.NOT_MODIFIED:
+            cache.revalidated(key, entry)
+            return copyParsed(entry.parsed)
+
+        parsed = self.jsonParseResponse(response)
+        if parsed.get('status_code', None) == httpStatus.OK and 'data' in parsed:
+            cache.store(key, copyParsed(parsed), response.headers.get('ETag', None),
+                response.headers.get('Last-Modified', None), generation=generation)
+
+        return parsed
+
+    def __getManifestPage(self, pageSize, offset, query):
+        parsed = self.jsonParseResponse(
+                    self.getManifest(limit=pageSize, offset=offset, **query))
+        if parsed.get('status_code', None) != httpStatus.OK or 'data' not in parsed:
+            raise ManifestPageException(parsed)
+
+        return parsed['data']
+
+    def iterManifest(self, pageSize=DEFAULT_MANIFEST_PAGE_SIZE, prefetch=True, **query):
+        '''
+        Yields the manifest entries matching query one at a time, requesting
+        them pageSize at a time by limit and offset. While one page is being
+        consumed the next is fetched in the background, so at most two pages
+        are ever held in memory. Bypasses the manifest cache.
+        Raises ManifestPageException for a page that fails.
+        '''
+        if pageSize < 1:
+            raise ValueError('pageSize should be at least 1, got %s'%(pageSize))
+
+        prefetcher = None
+        if prefetch:
+            prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        try:
+            offset, nextPage, lastHead = 0, None, None
+            page = self.__getManifestPage(pageSize, offset, query)
+            while True:
+                # A server that ignores limit and offset answers every page
+                # with the same entries, those were already yielded.
+                if page and lastHead is not None and page[0] == lastHead:
+                    return
+
+                lastHead = page[0] if page else None
+                offset += len(page)
+                # A short page is the last one, as is an oversized one from
+                # a server that ignored limit and offset altogether.
+                hasMore = len(page) == pageSize
+                if hasMore and prefetcher is not None:
+                    nextPage = prefetcher.submit(self.__getManifestPage, pageSize, offset, query)
+
+                for entry in page:
+                    yield entry
+
+                if not hasMore:
+                    return
+
+                page = None
+                if nextPage is None:
+                    page = self.__getManifestPage(pageSize, offset, query)
+                else:
+                    page, nextPage = nextPage.result(), None
+        finally:
+            if prefetcher is not None:
+                prefetcher.shutdown(wait=False)
 
     def jsonParseResponse(self, reqResponse):
         if isinstance(reqResponse, Exception):
@@ -197,6 +1082,10 @@ def main():
             p, author=getDefaultUserName(), title=p, metaData=sessionTag
         )
 
+        treeUploadFunc = lambda p: fH.uploadTree(
+            p, author=getDefaultUserName(), metaData=sessionTag
+        )
+
         updateFunc = lambda p: fH.updateFileByPath(
             p, author=getDefaultUserName(), title=p, metaData=sessionTag
         )
@@ -209,10 +1098,8 @@ def main():
                 print('Non existant path', p)
                 continue
             elif os.path.isdir(p):
-                for root, dirs, paths in os.walk(p):
-                    joinedPaths = map(lambda p: os.path.join(root, p), paths)
-                    dlResponse = map(uploadFunc, joinedPaths)
-                    print(list(dlResponse))
+                summary = treeUploadFunc(p)
+                print(dict((k, v) for k, v in summary.items() if k != 'results'))
             else:
                 print(uploadFunc(p))
        
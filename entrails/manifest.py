@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Local, indexed copy of the blob manifest. Entries are __slots__ records
+# rather than dicts and are indexed by checkSum, title and content key so
+# that dedup checks and lookups don't need a linear scan or a round trip.
+
+import threading
+
+class ManifestEntry:
+    # Fields every manifest record has, anything else is kept in extra
+    FIELDS = ('id', 'title', 'checkSum', 'size', 'metaData', 'content', 'checkSumAlgoName',)
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields.pop(name, None))
+
+        self.extra = fields or None
+
+    @classmethod
+    def fromDict(cls, record):
+        return cls(**record)
+
+    def get(self, name, default=None):
+        if name in self.FIELDS:
+            value = getattr(self, name)
+        else:
+            value = (self.extra or {}).get(name, None)
+
+        return default if value is None else value
+
+    def set(self, name, value):
+        if name in self.FIELDS:
+            setattr(self, name, value)
+        else:
+            if self.extra is None:
+                self.extra = dict()
+            self.extra[name] = value
+
+    def matches(self, query):
+        # Same semantics as the server ie values compared as strings
+        for name, value in query.items():
+            mine = self.get(name)
+            if mine is None or str(mine) != str(value):
+                return False
+
+        return True
+
+    def asDict(self):
+        record = dict(self.extra or {})
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                record[name] = value
+
+        return record
+
+    def __repr__(self):
+        return 'ManifestEntry(%s)'%(self.asDict())
+
+def indexKey(value):
+    # Keys are compared as strings, as the server does with query values
+    return None if value is None else str(value)
+
+def indexAdd(index, key, entry):
+    # A key maps to its only entry, or to a list once it has several
+    if key is None:
+        return
+
+    current = index.get(key, None)
+    if current is None:
+        index[key] = entry
+    elif isinstance(current, list):
+        current.append(entry)
+    else:
+        index[key] = [current, entry]
+
+def indexRemove(index, key, entry):
+    current = index.get(key, None)
+    if current is entry:
+        index.pop(key)
+    elif isinstance(current, list):
+        if entry in current:
+            current.remove(entry)
+        if len(current) == 1:
+            index[key] = current[0]
+
+def indexGet(index, key):
+    current = index.get(key, None)
+    if current is None:
+        return []
+    if isinstance(current, list):
+        return list(current)
+
+    return [current]
+
+class Manifest:
+    '''
+    Usage:
+        manifest = Manifest.fromEntries(rd.iterCloudFilesManifest())
+        manifest.hasCheckSum(checkSum)
+        manifest.first(title='report.pdf', metaData='json')
+
+    Entries are only ever as fresh as the manifest they came from plus the
+    changes applied via add, update and remove, see
+    FileOnCloudHandler.setLocalManifest to have those applied for every
+    upload, update and delete it makes.
+    '''
+    INDEXED = ('checkSum', 'title', 'content',)
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__entries = dict() # Insertion ordered set of entries
+        self.__byId = dict()
+        self.__indexes = dict((name, dict()) for name in self.INDEXED)
+
+    @classmethod
+    def fromEntries(cls, records):
+        # records: manifest dicts, eg from an iterator so they never all coexist
+        manifest = cls()
+        for record in records:
+            manifest.add(record)
+
+        return manifest
+
+    @classmethod
+    def fromResponse(cls, parsed):
+        # parsed: a parsed manifest ie {'status_code': 200, 'data': [...]}
+        return cls.fromEntries(r for r in parsed.get('data', None) or [] if isinstance(r, dict))
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter__(self):
+        with self.__lock:
+            return iter(list(self.__entries))
+
+    def __index(self, entry):
+        self.__entries[entry] = None
+        if entry.id is not None:
+            self.__byId[indexKey(entry.id)] = entry
+        for name, index in self.__indexes.items():
+            indexAdd(index, indexKey(getattr(entry, name)), entry)
+
+    def __unindex(self, entry):
+        self.__entries.pop(entry, None)
+        if entry.id is not None and self.__byId.get(indexKey(entry.id), None) is entry:
+            self.__byId.pop(indexKey(entry.id))
+        for name, index in self.__indexes.items():
+            indexRemove(index, indexKey(getattr(entry, name)), entry)
+
+    def __match(self, query):
+        # Narrows query down via the most selective index it names
+        candidates = None
+        if query.get('id', None) is not None:
+            entry = self.__byId.get(indexKey(query['id']), None)
+            candidates = [entry] if entry is not None else []
+        else:
+            for name in ('content', 'checkSum', 'title',):
+                if query.get(name, None) is not None:
+                    candidates = indexGet(self.__indexes[name], indexKey(query[name]))
+                    break
+
+        if candidates is None:
+            candidates = list(self.__entries)
+
+        return [entry for entry in candidates if entry.matches(query)]
+
+    def add(self, record):
+        # record: dict or ManifestEntry. Replaces an entry with the same id or content
+        entry = record if isinstance(record, ManifestEntry) else ManifestEntry.fromDict(record)
+        with self.__lock:
+            existing = []
+            if indexKey(entry.id) in self.__byId:
+                existing.append(self.__byId[indexKey(entry.id)])
+            if entry.content is not None:
+                existing.extend(indexGet(self.__indexes['content'], indexKey(entry.content)))
+            for stale in existing:
+                self.__unindex(stale)
+
+            self.__index(entry)
+
+        return entry
+
+    def discard(self, entry):
+        with self.__lock:
+            self.__unindex(entry)
+
+    def remove(self, **query):
+        # Returns the number of entries removed
+        with self.__lock:
+            found = self.__match(query)
+            for entry in found:
+                self.__unindex(entry)
+
+        return len(found)
+
+    def update(self, query, fields):
+        # Sets fields on every entry matching query, returns how many matched
+        with self.__lock:
+            found = self.__match(query)
+            for entry in found:
+                self.__unindex(entry)
+                for name, value in fields.items():
+                    entry.set(name, value)
+                self.__index(entry)
+
+        return len(found)
+
+    def find(self, **query):
+        with self.__lock:
+            return self.__match(query)
+
+    def first(self, **query):
+        found = self.find(**query)
+        return found[0] if found else None
+
+    def hasCheckSum(self, checkSum):
+        return indexKey(checkSum) in self.__indexes['checkSum']
+
+    def byCheckSum(self, checkSum):
+        with self.__lock:
+            return indexGet(self.__indexes['checkSum'], indexKey(checkSum))
+
+    def byTitle(self, title):
+        with self.__lock:
+            return indexGet(self.__indexes['title'], indexKey(title))
+
+    def byContent(self, content):
+        with self.__lock:
+            found = indexGet(self.__indexes['content'], indexKey(content))
+
+        return found[0] if found else None
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Client side cache of parsed manifest responses keyed by their query.
+# Entries are served as is for ttl seconds, after which they are revalidated
+# with the ETag/Last-Modified validators the server gave, if any.
+
+import time
+import threading
+import collections
+
+DEFAULT_TTL = 30
+
+def normalizeQuery(query):
+    # Equal queries map to equal keys regardless of ordering or value types
+    items = []
+    for key, value in query.items():
+        if isinstance(value, (list, tuple)):
+            value = tuple(str(v) for v in value)
+        elif value is not None:
+            value = str(value)
+        items.append((str(key), value))
+
+    return tuple(sorted(items))
+
+def copyParsed(parsed):
+    # Callers get their own copies so that they can't mutate cached entries
+    copied = dict(parsed)
+    if isinstance(copied.get('data', None), list):
+        copied['data'] = [dict(e) if isinstance(e, dict) else e for e in copied['data']]
+
+    return copied
+
+class ManifestCacheEntry:
+    __slots__ = ('parsed', 'etag', 'lastModified', 'expiresAt',)
+
+    def __init__(self, parsed, etag, lastModified, expiresAt):
+        self.parsed = parsed
+        self.etag = etag
+        self.lastModified = lastModified
+        self.expiresAt = expiresAt
+
+    def isFresh(self):
+        return time.time() < self.expiresAt
+
+    def validators(self):
+        headers = dict()
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+
+        return headers
+
+class ManifestCache:
+    def __init__(self, ttl=DEFAULT_TTL, maxEntries=1024):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        self.__lock = threading.Lock()
+        self.__generation = 0
+        self.__entries = collections.OrderedDict()
+
+    def generation(self):
+        # Bumped by every invalidation, see store
+        return self.__generation
+
+    def lookup(self, key):
+        # Returns (entry, isFresh), entry is None on a miss
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            self.__entries.move_to_end(key)
+            if entry.isFresh():
+                self.hits += 1
+                return entry, True
+
+            return entry, False
+
+    def store(self, key, parsed, etag=None, lastModified=None, generation=None):
+        # A response fetched before an invalidation (ie an older generation)
+        # may predate our own changes so it is not cached.
+        with self.__lock:
+            if generation is not None and generation != self.__generation:
+                return
+
+            self.__entries[key] = ManifestCacheEntry(
+                        parsed, etag, lastModified, time.time() + self.ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxEntries:
+                self.__entries.popitem(last=False)
+
+    def revalidated(self, key, entry):
+        # The server confirmed entry is still current ie a 304
+        with self.__lock:
+            self.revalidations += 1
+            entry.expiresAt = time.time() + self.ttl
+
+    def invalidate(self):
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+
+    def stats(self):
+        with self.__lock:
+            return dict(
+                hits=self.hits, misses=self.misses, revalidations=self.revalidations,
+                entries=len(self.__entries), ttl=self.ttl
+            )
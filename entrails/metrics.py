@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Latency histograms, byte counts, status counters and in-flight gauges per
+# (scope, method) eg ('Job', 'get') or ('blobs', 'download'). Recording is a
+# couple of additions under a lock so it can stay on all the time.
+
+import sys
+import time
+import bisect
+import threading
+
+# Upper bounds in seconds of the latency histogram's buckets
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+class Sample:
+    # Filled in by the instrumented code while the operation runs
+    __slots__ = ('status', 'bytesSent', 'bytesReceived', 'failed',)
+
+    def __init__(self):
+        self.status = None
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.failed = False # For failures that don't raise eg returned errors
+
+class OperationMetrics:
+    __slots__ = (
+        'count', 'errors', 'inFlight', 'totalSeconds', 'maxSeconds',
+        'bucketCounts', 'bytesSent', 'bytesReceived', 'statuses',
+    )
+
+    def __init__(self, bucketCount):
+        self.count = 0
+        self.errors = 0
+        self.inFlight = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+        self.bucketCounts = [0] * (bucketCount + 1) # The last one is +Inf
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.statuses = dict()
+
+    def percentile(self, fraction, buckets):
+        # Estimated as the upper bound of the bucket holding that rank
+        if not self.count:
+            return None
+
+        rank, seen = fraction * self.count, 0
+        for i, n in enumerate(self.bucketCounts):
+            seen += n
+            if seen >= rank and n:
+                return buckets[i] if i < len(buckets) else self.maxSeconds
+
+        return self.maxSeconds
+
+    def snapshot(self, buckets):
+        return dict(
+            count=self.count, errors=self.errors, inFlight=self.inFlight,
+            totalSeconds=self.totalSeconds, maxSeconds=self.maxSeconds,
+            meanSeconds=self.totalSeconds / self.count if self.count else None,
+            p50=self.percentile(0.5, buckets), p95=self.percentile(0.95, buckets),
+            p99=self.percentile(0.99, buckets),
+            buckets=list(zip(list(buckets) + ['+Inf'], self.bucketCounts)),
+            bytesSent=self.bytesSent, bytesReceived=self.bytesReceived,
+            statuses=dict(self.statuses)
+        )
+
+class Tracking:
+    # Context manager returned by MetricsRegistry.track
+    __slots__ = ('registry', 'op', 'sample', 'startTime',)
+
+    def __init__(self, registry, op):
+        self.registry = registry
+        self.op = op
+        self.sample = Sample()
+        self.startTime = None
+
+    def __enter__(self):
+        self.registry.started(self.op)
+        self.startTime = time.perf_counter()
+        return self.sample
+
+    def __exit__(self, excType, excValue, traceback):
+        self.registry.finished(self.op,
+            time.perf_counter() - self.startTime, self.sample,
+            excType is not None or self.sample.failed)
+        return False
+
+class NullTracking:
+    # Stands in for Tracking when there is no registry to record into
+    def __enter__(self):
+        return Sample()
+
+    def __exit__(self, *excInfo):
+        return False
+
+def track(metrics, scope, method):
+    # Shorthand for instrumented code whose metrics may be None
+    if metrics is None:
+        return NullTracking()
+
+    return metrics.track(scope, method)
+
+class MetricsRegistry:
+    '''
+    Usage:
+        with metrics.track('Job', 'get') as sample:
+            response = session.get(...)
+            sample.status = response.status_code
+            sample.bytesReceived = len(response.content)
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__ops = dict()
+        self.__exporters = []
+
+    def __getOp(self, scope, method):
+        key = (scope, method)
+        op = self.__ops.get(key, None)
+        if op is None:
+            with self.__lock:
+                op = self.__ops.setdefault(key, OperationMetrics(len(self.buckets)))
+
+        return op
+
+    def track(self, scope, method):
+        return Tracking(self, self.__getOp(scope, method))
+
+    def started(self, op):
+        with self.__lock:
+            op.inFlight += 1
+
+    def finished(self, op, seconds, sample, failed=False):
+        bucketIndex = bisect.bisect_left(self.buckets, seconds)
+        with self.__lock:
+            op.inFlight -= 1
+            op.count += 1
+            op.totalSeconds += seconds
+            if seconds > op.maxSeconds:
+                op.maxSeconds = seconds
+            op.bucketCounts[bucketIndex] += 1
+            op.bytesSent += sample.bytesSent or 0
+            op.bytesReceived += sample.bytesReceived or 0
+            if failed:
+                op.errors += 1
+            if sample.status is not None:
+                op.statuses[sample.status] = op.statuses.get(sample.status, 0) + 1
+
+    def snapshot(self):
+        # Returns {scope: {method: {...}}}, see OperationMetrics.snapshot
+        with self.__lock:
+            out = dict()
+            for (scope, method), op in self.__ops.items():
+                out.setdefault(scope, dict())[method] = op.snapshot(self.buckets)
+
+        return out
+
+    def reset(self):
+        with self.__lock:
+            self.__ops.clear()
+
+    def addExporter(self, exporter):
+        # exporter: callable taking a snapshot eg to push it to a monitoring system
+        self.__exporters.append(exporter)
+
+    def removeExporter(self, exporter):
+        if exporter in self.__exporters:
+            self.__exporters.remove(exporter)
+
+    def export(self):
+        # Hands the current snapshot to every exporter, returns the snapshot
+        snapshot = self.snapshot()
+        for exporter in list(self.__exporters):
+            try:
+                exporter(snapshot)
+            except Exception as e:
+                sys.stderr.write('Metrics exporter %s failed: %s\n'%(exporter, e))
+
+        return snapshot
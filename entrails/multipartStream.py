@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Streaming multipart/form-data body: the blob is read off its stream in
+# chunks as the request is sent instead of being loaded whole into memory.
+
+import io
+import os
+import uuid
+import mmap
+
+try:
+    from utils import hashStream
+except:
+    from .utils import hashStream
+
+def guessFileName(stream, default='blob'):
+    name = getattr(stream, 'name', None)
+    if isinstance(name, str) and name and name[0] not in '<>':
+        return os.path.basename(name)
+
+    return default
+
+def remainingLength(stream):
+    # Returns the number of bytes left in a seekable binary stream, else None
+    if isinstance(stream, io.TextIOBase):
+        return None # Character offsets don't map onto encoded byte counts
+
+    try:
+        pos = stream.tell()
+        end = stream.seek(0, os.SEEK_END)
+        stream.seek(pos)
+    except Exception:
+        return None
+
+    return end - pos
+
+def encodeFields(fields):
+    # Mirrors requests' handling of form fields ie lists expand into
+    # repeated keys, None is dropped and everything else is str()-ified.
+    for key, value in fields.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for v in values:
+            if v is None:
+                continue
+            if not isinstance(v, bytes):
+                v = str(v).encode('utf-8')
+
+            yield key, v
+
+class MultipartStream:
+    '''
+    File-like request body for requests, ie:
+        session.post(url, data=body, headers={'Content-Type': body.contentType})
+
+    Params:
+        fields: dict of plain form fields
+        stream: binary stream holding the blob, read from its current position
+        fieldName: name of the blob's form field, 'blob' for restAssured
+        hasher: optional hashlib object updated with every blob byte sent
+    '''
+    def __init__(self, fields, stream, fieldName='blob', hasher=None,
+                                            chunkSize=mmap.PAGESIZE * 16):
+        self.__boundary = uuid.uuid4().hex
+        self.__stream = stream
+        self.__hasher = hasher
+        self.__chunkSize = chunkSize
+
+        head = b''.join(
+            self.__partHeader('name="%s"'%(key)) + value + b'\r\n'
+            for key, value in encodeFields(fields)
+        )
+        head += self.__partHeader(
+            'name="%s"; filename="%s"'%(fieldName, guessFileName(stream, fieldName)),
+            b'Content-Type: application/octet-stream\r\n'
+        )
+
+        self.__head = head
+        self.__tail = ('\r\n--%s--\r\n'%(self.__boundary)).encode('utf-8')
+        self.__pending = [self.__head]
+        self.__streamDone = False
+        self.__tailSent = False
+
+        blobLength = remainingLength(stream)
+        self.__length = None
+        if blobLength is not None:
+            self.__length = len(self.__head) + blobLength + len(self.__tail)
+
+    def __partHeader(self, disposition, extra=b''):
+        return ('--%s\r\nContent-Disposition: form-data; %s\r\n'%(
+                    self.__boundary, disposition)).encode('utf-8') + extra + b'\r\n'
+
+    @property
+    def contentType(self):
+        return 'multipart/form-data; boundary=%s'%(self.__boundary)
+
+    @property
+    def len(self):
+        return self.__length
+
+    def __len__(self):
+        return self.__length or 0
+
+    def feed(self, hashObj):
+        '''
+        Runs the whole body through hashObj ahead of sending it eg to sign
+        it, then rewinds the blob's stream. Only bodies of known length,
+        ie from seekable streams, can be replayed this way.
+        '''
+        if self.__length is None:
+            raise io.UnsupportedOperation('Cannot replay a stream of unknown length')
+
+        pos = self.__stream.tell()
+        hashObj.update(self.__head)
+        hashStream(hashObj, self.__stream)
+        hashObj.update(self.__tail)
+        self.__stream.seek(pos)
+        return hashObj
+
+    def __nextChunk(self, size):
+        if self.__pending:
+            return self.__pending.pop(0)
+
+        if not self.__streamDone:
+            chunk = self.__stream.read(size)
+            if chunk:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if self.__hasher is not None:
+                    self.__hasher.update(chunk)
+                return chunk
+
+            self.__streamDone = True
+
+        if not self.__tailSent:
+            self.__tailSent = True
+            return self.__tail
+
+        return b''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.__nextChunk(self.__chunkSize), b''))
+
+        chunk = self.__nextChunk(size)
+        if len(chunk) > size:
+            self.__pending.insert(0, chunk[size:])
+            chunk = chunk[:size]
+
+        return chunk
+
+    def __iter__(self):
+        return iter(lambda: self.__nextChunk(self.__chunkSize), b'')
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Timeouts, retries with jittered exponential backoff, per host circuit
+# breaking and hedged GETs for the requests a ConnectionPool sends.
+
+import time
+import random
+import threading
+import collections
+import urllib.parse
+import concurrent.futures
+
+import requests
+
+# Only these are retried and hedged, sending them twice changes nothing
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # Raised instead of sending a request to a host whose circuit is open
+    pass
+
+class LatencyTracker:
+    # Latencies of the most recent successful requests, for percentiles
+    def __init__(self, maxSamples=256):
+        self.__lock = threading.Lock()
+        self.__samples = collections.deque(maxlen=maxSamples)
+
+    def record(self, seconds):
+        with self.__lock:
+            self.__samples.append(seconds)
+
+    def __len__(self):
+        return len(self.__samples)
+
+    def percentile(self, fraction):
+        with self.__lock:
+            samples = sorted(self.__samples)
+
+        if not samples:
+            return None
+
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+class CircuitBreaker:
+    '''
+    Opens after failureThreshold consecutive failures, rejecting requests
+    for resetTimeout seconds. Then a single trial request is let through,
+    its success closes the circuit again, its failure re-opens it.
+    '''
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failureThreshold=5, resetTimeout=30):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__openedAt = None
+        self.__trialInFlight = False
+
+    @property
+    def state(self):
+        with self.__lock:
+            return self.__state()
+
+    def __state(self):
+        if self.__openedAt is None:
+            return self.CLOSED
+        if time.monotonic() - self.__openedAt < self.resetTimeout:
+            return self.OPEN
+
+        return self.HALF_OPEN
+
+    def acquire(self):
+        # Returns the state a request is let through in ie CLOSED, or
+        # HALF_OPEN for the single trial, else None
+        with self.__lock:
+            state = self.__state()
+            if state == self.CLOSED:
+                return state
+            if state == self.HALF_OPEN and not self.__trialInFlight:
+                self.__trialInFlight = True
+                return state
+
+            return None
+
+    def allow(self):
+        return self.acquire() is not None
+
+    def release(self):
+        # Ends a trial that neither succeeded nor failed, letting another through
+        with self.__lock:
+            self.__trialInFlight = False
+
+    def success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__openedAt = None
+            self.__trialInFlight = False
+
+    def failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trialInFlight or self.__failures >= self.failureThreshold:
+                self.__openedAt = time.monotonic()
+            self.__trialInFlight = False
+
+class RequestPolicy:
+    '''
+    Params:
+        connectTimeout, readTimeout: seconds, for requests without a timeout
+        maxRetries: extra attempts for safe methods after a connection
+            error, a timeout or a status in retryStatuses
+        backoffBase, backoffMax: attempt n sleeps a random time, up to
+            min(backoffMax, backoffBase * 2**(n-1)) seconds ie full jitter
+        failureThreshold, resetTimeout: see CircuitBreaker, one per host
+        hedge: for GETs still unanswered after hedgeAfter seconds, or when
+            None the p95 latency seen so far, a second identical request is
+            sent and whichever answers first is used
+        hedgeMinSamples: latencies needed before the p95 is trusted
+        hedgeWorkers: threads shared by hedged GETs' first attempts, and as
+            many again for their hedges
+    '''
+    def __init__(self, connectTimeout=5, readTimeout=30, maxRetries=2,
+            backoffBase=0.1, backoffMax=2.0, retryStatuses=RETRY_STATUSES,
+            failureThreshold=5, resetTimeout=30, hedge=False, hedgeAfter=None,
+            hedgeMinSamples=20, hedgeWorkers=16):
+        self.timeout = (connectTimeout, readTimeout)
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.retryStatuses = frozenset(retryStatuses)
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.hedge = hedge
+        self.hedgeAfter = hedgeAfter
+        self.hedgeMinSamples = hedgeMinSamples
+        self.latencies = LatencyTracker()
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedgeWins = 0
+        self.rejections = 0
+
+        self.__lock = threading.Lock()
+        self.__breakers = dict()
+        self.__hedgeWorkers = hedgeWorkers
+        self.__firstPool = None
+        self.__hedgePool = None
+
+    def breakerFor(self, host):
+        with self.__lock:
+            breaker = self.__breakers.get(host, None)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failureThreshold, self.resetTimeout)
+                self.__breakers[host] = breaker
+
+            return breaker
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoffMax, self.backoffBase * (2 ** (attempt - 1))))
+
+    def hedgeDelay(self):
+        if self.hedgeAfter is not None:
+            return self.hedgeAfter
+        if len(self.latencies) < self.hedgeMinSamples:
+            return None
+
+        return self.latencies.percentile(0.95)
+
+    def __count(self, attrName):
+        with self.__lock:
+            setattr(self, attrName, getattr(self, attrName) + 1)
+
+    def execute(self, method, url, send, **kwargs):
+        '''
+        Sends the request via send(**kwargs), eg requests.Session.request
+        bound to method and url, applying this policy.
+        Returns the response or raises the last error.
+        '''
+        if kwargs.get('timeout', None) is None:
+            kwargs['timeout'] = self.timeout
+
+        breaker = self.breakerFor(urllib.parse.urlsplit(url).netloc)
+        isSafe = method.upper() in SAFE_METHODS
+        attempts = 1 + (self.maxRetries if isSafe else 0)
+        hedged = isSafe and self.hedge and not kwargs.get('stream', False)
+
+        lastError = None
+        for attempt in range(attempts):
+            if attempt:
+                self.__count('retries')
+                time.sleep(self.backoff(attempt))
+
+            admittedIn = breaker.acquire()
+            if admittedIn is None:
+                self.__count('rejections')
+                raise CircuitOpenError('Circuit open for %s'%(url)) from lastError
+
+            startTime = time.perf_counter()
+            try:
+                response = self.__hedgedSend(send, kwargs) if hedged else send(**kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.failure()
+                lastError = e
+                continue
+            except BaseException:
+                # Any other error still ends the trial, else the circuit never closes
+                if admittedIn == CircuitBreaker.HALF_OPEN:
+                    breaker.release()
+                raise
+
+            if response.status_code in self.retryStatuses:
+                breaker.failure()
+                if attempt + 1 < attempts:
+                    response.close()
+                    continue
+                return response
+
+            breaker.success()
+            self.latencies.record(time.perf_counter() - startTime)
+            return response
+
+        raise lastError
+
+    def __getPools(self):
+        with self.__lock:
+            if self.__hedgePool is None:
+                self.__firstPool = concurrent.futures.ThreadPoolExecutor(
+                                        max_workers=self.__hedgeWorkers)
+                self.__hedgePool = concurrent.futures.ThreadPoolExecutor(
+                                        max_workers=self.__hedgeWorkers)
+
+            return self.__firstPool, self.__hedgePool
+
+    def __hedgedSend(self, send, kwargs):
+        delay = self.hedgeDelay()
+        if delay is None:
+            return send(**kwargs)
+
+        # First attempts and hedges have pools of their own so that hedges
+        # never hold up first attempts. The delay runs from when the first
+        # attempt is actually sent, not from when it was queued.
+        firstPool, hedgePool = self.__getPools()
+        sent = threading.Event()
+        def sendFirst():
+            sent.set()
+            return send(**kwargs)
+
+        first = firstPool.submit(sendFirst)
+        sent.wait()
+        try:
+            return first.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        self.__count('hedges')
+        second = hedgePool.submit(send, **kwargs)
+        pending = set((first, second))
+        winner, lastError = None, None
+        while pending and winner is None:
+            done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and winner is None:
+                    winner = future
+                elif future.exception() is not None:
+                    lastError = future.exception()
+
+        # The slower attempt is released as soon as it is done
+        for future in (first, second):
+            if future is not winner:
+                future.add_done_callback(closeResponse)
+
+        if winner is None:
+            raise lastError
+        if winner is second:
+            self.__count('hedgeWins')
+
+        return winner.result()
+
+    def stats(self):
+        with self.__lock:
+            breakers = dict((host, b.state) for host, b in self.__breakers.items())
+
+        return dict(
+            retries=self.retries, hedges=self.hedges, hedgeWins=self.hedgeWins,
+            rejections=self.rejections, p95=self.latencies.percentile(0.95),
+            circuits=breakers
+        )
+
+def closeResponse(future):
+    if future.exception() is None:
+        future.result().close()
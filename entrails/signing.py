@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# HMAC signing of items and of outgoing requests. The keyed state is computed
+# once and copied per signature, so signatures never depend on each other and
+# any number of threads can sign at the same time.
+
+import hmac
+import time
+import threading
+import concurrent.futures
+
+import requests
+
+try:
+    from utils import toBytes, hashStream
+except:
+    from .utils import toBytes, hashStream
+
+DEFAULT_DIGESTMOD = 'sha256'
+
+SIGNATURE_HEADER = 'X-Resty-Signature'
+TIMESTAMP_HEADER = 'X-Resty-Timestamp'
+PUBLIC_KEY_HEADER = 'X-Resty-Public-Key'
+
+# hashlib only releases the GIL for updates of at least 2KiB, batches of
+# smaller items are signed inline since threads would only add overhead
+PARALLEL_MIN_ITEM_SIZE = 2048
+
+class Signer:
+    '''
+    Params:
+        key: the secret, bytes or str. Only the keyed HMAC state is kept.
+        digestmod: hashlib name or constructor, sha256 by default
+        workers: threads for signMany's large batches
+    '''
+    def __init__(self, key, digestmod=DEFAULT_DIGESTMOD, workers=4):
+        self.__keyed = hmac.new(toBytes(key), digestmod=digestmod)
+        self.digestSize = self.__keyed.digest_size
+        self.__workers = workers
+        self.__lock = threading.Lock()
+        self.__pool = None
+
+    def new(self):
+        # A fresh HMAC object ready to be updated, ie hmac.new(key) minus the keying
+        return self.__keyed.copy()
+
+    def sign(self, item, outputPlainBytes=False):
+        mac = self.__keyed.copy()
+        mac.update(toBytes(item))
+        return mac.digest() if outputPlainBytes else mac.hexdigest()
+
+    def signStream(self, stream, outputPlainBytes=False):
+        mac = hashStream(self.__keyed.copy(), stream)
+        return mac.digest() if outputPlainBytes else mac.hexdigest()
+
+    def verify(self, item, signature):
+        expected = self.sign(item, outputPlainBytes=isinstance(signature, bytes))
+        return hmac.compare_digest(expected, signature)
+
+    def __getPool(self):
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = concurrent.futures.ThreadPoolExecutor(
+                                        max_workers=self.__workers)
+
+            return self.__pool
+
+    def signMany(self, items, outputPlainBytes=False, workers=None):
+        '''
+        Returns the signatures of items in order. Batches with items large
+        enough for hashlib to release the GIL are spread across threads.
+        '''
+        items = [toBytes(item) for item in items]
+        workers = self.__workers if workers is None else workers
+        if workers <= 1 or len(items) < 2 or \
+                max(len(item) for item in items) < PARALLEL_MIN_ITEM_SIZE:
+            return [self.sign(item, outputPlainBytes) for item in items]
+
+        return list(self.__getPool().map(
+                        lambda item: self.sign(item, outputPlainBytes), items))
+
+def requestMAC(signer, method, pathUrl, timestamp):
+    # The MAC covers the method, path with query, timestamp and then the body
+    mac = signer.new()
+    mac.update(('%s\n%s\n%s\n'%(method.upper(), pathUrl, timestamp)).encode('utf-8'))
+    return mac
+
+def feedBody(mac, body):
+    # Runs a prepared request's body through mac, streaming file-like bodies
+    if body is None:
+        return mac
+
+    if isinstance(body, (bytes, bytearray, memoryview, str)):
+        mac.update(toBytes(body) if isinstance(body, str) else body)
+        return mac
+
+    feed = getattr(body, 'feed', None) # eg MultipartStream
+    if feed is not None:
+        feed(mac)
+        return mac
+
+    if hasattr(body, 'read') and hasattr(body, 'seek'):
+        pos = body.tell()
+        hashStream(mac, body)
+        body.seek(pos)
+        return mac
+
+    raise ValueError('Cannot sign a one-shot body of type %s'%(type(body).__name__))
+
+class SigningAuth(requests.auth.AuthBase):
+    '''
+    Signs every request it is attached to, ie:
+        session.auth = SigningAuth(signer, publicKey)
+    Adds the hex MAC as X-Resty-Signature, the time it covers as
+    X-Resty-Timestamp and publicKey if any as X-Resty-Public-Key.
+    '''
+    def __init__(self, signer, publicKey=None):
+        self.signer = signer
+        self.publicKey = publicKey
+
+    def __call__(self, request):
+        timestamp = '%.3f'%(time.time())
+        mac = requestMAC(self.signer, request.method, request.path_url, timestamp)
+        request.headers[SIGNATURE_HEADER] = feedBody(mac, request.body).hexdigest()
+        request.headers[TIMESTAMP_HEADER] = timestamp
+        if self.publicKey:
+            request.headers[PUBLIC_KEY_HEADER] = self.publicKey
+
+        return request
+
+def verifyRequest(signer, method, pathUrl, headers, body):
+    signature = headers.get(SIGNATURE_HEADER, None)
+    timestamp = headers.get(TIMESTAMP_HEADER, None)
+    if not (signature and timestamp):
+        return False
+
+    mac = feedBody(requestMAC(signer, method, pathUrl, timestamp), body)
+    return hmac.compare_digest(mac.hexdigest(), signature)
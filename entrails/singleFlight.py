@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Coalesces concurrent identical calls: while one is in flight, callers
+# with the same key wait for it and share its result instead of repeating it.
+
+import threading
+
+class Call:
+    __slots__ = ('done', 'result', 'error', 'waiters',)
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    '''
+    Usage:
+        flight = SingleFlight()
+        parsed = flight.do(('get', url, normalizeQuery(params)), fetch, copy.deepcopy)
+
+    Only meant for idempotent calls: a caller arriving while a call for its
+    key is in flight gets that call's result, nothing is kept once it is done.
+    '''
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = dict()
+        self.calls = 0 # Calls made ie the leaders of each flight
+        self.coalesced = 0 # Callers that shared a leader's result instead
+
+    def do(self, key, func, share=None):
+        '''
+        Returns func() or the result of the in-flight call for key, passed
+        through share eg a copy function so that callers don't share mutable
+        results. Errors raised by the call are raised in every caller.
+        '''
+        with self.__lock:
+            call = self.__calls.get(key, None)
+            isLeader = call is None
+            if isLeader:
+                call = self.__calls[key] = Call()
+                self.calls += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not isLeader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+            return share(call.result) if share is not None else call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            # Even eg a KeyboardInterrupt, else waiters would get a None result
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                self.__calls.pop(key, None)
+            call.done.set()
+
+        return call.result
+
+    def stats(self):
+        with self.__lock:
+            return dict(calls=self.calls, coalesced=self.coalesced,
+                                            inFlight=len(self.__calls))
+
+    def reset(self):
+        with self.__lock:
+            self.calls = self.coalesced = 0
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# In-process stand-in for a restAssured server, for tests and benchmarks.
+# Implements the '/uploader' manifest+blob handler, its chunked upload
+# protocol and '/media/' downloads, keeping everything in memory.
+# Any other path is a generic JSON record table as registered liasons use,
+# with '<path>/bulk' as its batched endpoint.
+
+import sys
+import json
+import uuid
+import collections
+import hashlib
+import threading
+import urllib.parse
+import http.server
+from email.parser import BytesParser
+
+sys.path.append('./entrails')
+import httpStatusCodes as httpStatus
+
+try:
+    from signing import Signer, verifyRequest
+except:
+    from .signing import Signer, verifyRequest
+
+def parseMultipart(contentType, body):
+    # Returns (fields, files) where files maps a field name to its bytes
+    msg = BytesParser().parsebytes(
+        b'Content-Type: ' + contentType.encode('utf-8') + b'\r\n\r\n' + body)
+
+    fields, files = dict(), dict()
+    for part in msg.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True)
+        if part.get_param('filename', header='content-disposition') is None:
+            fields[name] = payload.decode('utf-8')
+        else:
+            files[name] = payload
+
+    return fields, files
+
+class BlobStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = dict()
+        self.contents = dict()
+        self.version = 0 # Bumped on every change, the manifest's ETag
+        self.manifestRequests = 0
+        self.__lastId = 0
+
+    def matches(self, record, query):
+        for key, value in query.items():
+            if key not in record or str(record[key]) != value:
+                return False
+
+        return True
+
+    def select(self, query):
+        # limit and offset page through the matches in id order
+        query = dict(query)
+        fields = [f for f in query.pop('select', '').split(',') if f]
+        limit, offset = query.pop('limit', None), int(query.pop('offset', 0) or 0)
+        with self.lock:
+            found = [r for r in self.records.values() if self.matches(r, query)]
+
+        found = found[offset:] if limit is None else found[offset:offset + int(limit)]
+
+        if fields:
+            return [dict((f, r.get(f)) for f in fields) for r in found]
+
+        return [dict(r) for r in found]
+
+    def create(self, fields, blob, fileName='blob'):
+        with self.lock:
+            self.__lastId += 1
+            content = 'documents/%s_%s'%(uuid.uuid4().hex[:8], fileName)
+            record = dict(fields, id=self.__lastId, content=content, size=len(blob))
+            self.records[record['id']] = record
+            self.contents[content] = blob
+            self.version += 1
+
+        return dict(record)
+
+    def update(self, query, fields, blob=None):
+        with self.lock:
+            found = [r for r in self.records.values() if self.matches(r, query)]
+            for record in found:
+                record.update(fields)
+                if blob is not None:
+                    self.contents[record['content']] = blob
+                    record['size'] = len(blob)
+            self.version += 1
+
+        return len(found)
+
+    def delete(self, query):
+        with self.lock:
+            found = [r for r in self.records.values() if self.matches(r, query)]
+            for record in found:
+                self.records.pop(record['id'], None)
+                self.contents.pop(record['content'], None)
+            self.version += 1
+
+        return len(found)
+
+def matchesQuery(record, query):
+    for key, value in query.items():
+        if key not in record or str(record[key]) != str(value):
+            return False
+
+    return True
+
+class RecordTable:
+    # A collection as served to DbConn ie its post, get, put and delete
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = collections.OrderedDict()
+        self.requests = 0
+        self.__lastId = 0
+
+    def post(self, item):
+        with self.lock:
+            self.__lastId += 1
+            record = dict(item, id=self.__lastId)
+            self.records[record['id']] = record
+
+        return httpStatus.OK, dict(data=dict(record))
+
+    def get(self, query):
+        with self.lock:
+            found = [dict(r) for r in self.records.values() if matchesQuery(r, query)]
+
+        return httpStatus.OK, dict(data=found)
+
+    def put(self, item):
+        queryParams = item.get('queryParams', None) or {}
+        updateParams = item.get('updateParams', None) or {}
+        with self.lock:
+            found = [r for r in self.records.values() if matchesQuery(r, queryParams)]
+            for record in found:
+                record.update(updateParams)
+
+        return httpStatus.OK, dict(data=len(found))
+
+    def delete(self, query):
+        with self.lock:
+            found = [r for r in self.records.values() if matchesQuery(r, query)]
+            for record in found:
+                self.records.pop(record['id'], None)
+
+        return httpStatus.OK, dict(data=len(found))
+
+    def bulk(self, method, items):
+        if method not in ('post', 'put', 'delete'):
+            return httpStatus.BAD_REQUEST, dict(reason='Unsupported method %s'%(method))
+
+        results = []
+        for item in items:
+            status, body = getattr(self, method)(item)
+            results.append(dict(status_code=status, value=body))
+
+        return httpStatus.OK, dict(data=results)
+
+class ChunkedUploads:
+    # Server side of FileOnCloudHandler's chunked upload protocol
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.uploads = dict()
+        self.partRequests = 0
+        self.failPartsOnce = set() # For tests: part indices to reject once
+
+    def begin(self, fields, query=None):
+        uploadId = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[uploadId] = dict(fields=fields, query=query, parts=dict())
+
+        return uploadId
+
+    def status(self, uploadId):
+        with self.lock:
+            upload = self.uploads.get(uploadId, None)
+            if upload is not None:
+                return sorted(upload['parts'])
+
+    def putPart(self, uploadId, partIndex, checkSum, data):
+        with self.lock:
+            self.partRequests += 1
+            upload = self.uploads.get(uploadId, None)
+            if upload is None:
+                return httpStatus.NOT_FOUND
+
+            if partIndex in self.failPartsOnce:
+                self.failPartsOnce.discard(partIndex)
+                return httpStatus.SERVICE_UNAVAILABLE
+
+            algoName = upload['fields'].get('checkSumAlgoName', 'sha1')
+            if getattr(hashlib, algoName)(data).hexdigest() != checkSum:
+                return httpStatus.BAD_REQUEST
+
+            upload['parts'][partIndex] = data
+            return httpStatus.OK
+
+    def finalize(self, uploadId):
+        with self.lock:
+            upload = self.uploads.get(uploadId, None)
+            if upload is None:
+                return httpStatus.NOT_FOUND, 'No such upload'
+
+            fields = dict(upload['fields'])
+            partCount = int(fields.pop('partCount'))
+            fields.pop('partSize', None)
+            fields.pop('size', None)
+            if len(upload['parts']) != partCount:
+                return httpStatus.CONFLICT, 'Missing parts'
+
+            blob = b''.join(upload['parts'][i] for i in range(partCount))
+            self.uploads.pop(uploadId)
+
+        algoName = fields.get('checkSumAlgoName', 'sha1')
+        if getattr(hashlib, algoName)(blob).hexdigest() != fields.get('checkSum'):
+            return httpStatus.BAD_REQUEST, 'CheckSum mismatch'
+
+        if upload['query'] is not None:
+            return httpStatus.OK, self.store.update(upload['query'], fields, blob)
+
+        return httpStatus.OK, self.store.create(fields, blob)
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive like a production server
+    disable_nagle_algorithm = True # Headers and body go out as separate writes
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def __splitPath(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+        return parsed.path, query
+
+    def __readBody(self):
+        # Read once per request, signature checks need it before the routes do
+        if self.__body is None:
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            self.__body = self.rfile.read(length) if length else b''
+
+        return self.__body
+
+    def __isAuthorized(self):
+        # Starts every request, rejecting bad signatures when the server has a signer
+        self.__body = None
+        signer = self.server.signer
+        if signer is None or verifyRequest(
+                signer, self.command, self.path, self.headers, self.__readBody()):
+            return True
+
+        self.server.rejectedRequests += 1
+        self.sendJSON(httpStatus.UNAUTHORIZED, dict(reason='Bad or missing signature'))
+        return False
+
+    def __readForm(self):
+        body = self.__readBody()
+        contentType = self.headers.get('Content-Type', '')
+        if contentType.startswith('multipart/form-data'):
+            return parseMultipart(contentType, body)
+
+        return dict(urllib.parse.parse_qsl(body.decode('utf-8'))), dict()
+
+    def sendBytes(self, status, body, contentType='application/octet-stream', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def sendMedia(self, blob):
+        if not self.server.supportsRanges:
+            return self.sendBytes(httpStatus.OK, blob)
+
+        rangeHeader = self.headers.get('Range', None)
+        if not rangeHeader:
+            return self.sendBytes(httpStatus.OK, blob, headers={'Accept-Ranges': 'bytes'})
+
+        # Only single 'bytes=start-end' ranges are understood
+        try:
+            start, end = rangeHeader.split('=', 1)[1].split('-', 1)
+            start, end = int(start), min(int(end or len(blob) - 1), len(blob) - 1)
+        except ValueError:
+            start, end = len(blob), 0
+
+        if start > end:
+            return self.sendBytes(httpStatus.REQUESTED_RANGE_NOT_SATISFIABLE, b'',
+                headers={'Content-Range': 'bytes */%d'%(len(blob))})
+
+        self.sendBytes(httpStatus.PARTIAL_CONTENT, blob[start:end + 1], headers={
+            'Accept-Ranges': 'bytes',
+            'Content-Range': 'bytes %d-%d/%d'%(start, end, len(blob))
+        })
+
+    def sendJSON(self, status, data):
+        self.sendBytes(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def __tableRoute(self, path, query):
+        path = path.rstrip('/')
+        isBulk = path.endswith('/bulk')
+        if isBulk:
+            path = path[:-len('/bulk')]
+
+        with self.server.tablesLock:
+            table = self.server.tables.setdefault(path, RecordTable())
+            table.requests += 1
+
+        try:
+            if self.command == 'POST':
+                body = json.loads(self.__readBody().decode('utf-8') or '{}')
+                if isBulk:
+                    return self.sendJSON(*table.bulk(body.get('method'), body.get('items', [])))
+                return self.sendJSON(*table.post(body))
+            if isBulk:
+                return self.sendJSON(httpStatus.METHOD_NOT_ALLOWED, dict(reason='Use POST'))
+            if self.command == 'PUT':
+                return self.sendJSON(*table.put(dict(
+                    (key, json.loads(query.get(key, '{}'))) for key in ('queryParams', 'updateParams')
+                )))
+            if self.command == 'DELETE':
+                return self.sendJSON(*table.delete(query))
+
+            return self.sendJSON(*table.get(query))
+        except ValueError as e:
+            return self.sendJSON(httpStatus.BAD_REQUEST, dict(reason='%s'%(e)))
+
+    def __chunkedRoute(self, path, query):
+        # Returns True if the request was for the chunked upload protocol
+        if not path.startswith('/uploader/chunked'):
+            return False
+
+        chunked = self.server.chunked
+        segments = [s for s in path[len('/uploader/chunked'):].split('/') if s]
+
+        if not segments and self.command in ('POST', 'PUT'):
+            fields, files = self.__readForm()
+            uploadId = chunked.begin(fields, query if self.command == 'PUT' else None)
+            self.sendJSON(httpStatus.OK, dict(data=dict(uploadId=uploadId)))
+
+        elif len(segments) == 1 and self.command == 'GET':
+            parts = chunked.status(segments[0])
+            if parts is None:
+                self.sendJSON(httpStatus.NOT_FOUND, dict(reason='No such upload'))
+            else:
+                self.sendJSON(httpStatus.OK, dict(data=dict(parts=parts)))
+
+        elif len(segments) == 2 and segments[1] == 'finalize' and self.command == 'POST':
+            status, data = chunked.finalize(segments[0])
+            if status == httpStatus.OK:
+                self.sendJSON(status, dict(data=data))
+            else:
+                self.sendJSON(status, dict(reason=data))
+
+        elif len(segments) == 2 and self.command == 'PUT':
+            status = chunked.putPart(segments[0], int(segments[1]),
+                                    query.get('checkSum', None), self.__readBody())
+            self.sendJSON(status, dict(data=status == httpStatus.OK))
+
+        else:
+            self.sendJSON(httpStatus.NOT_FOUND, dict(reason='Unknown path %s'%(path)))
+
+        return True
+
+    def do_GET(self):
+        if not self.__isAuthorized():
+            return
+
+        path, query = self.__splitPath()
+        if self.__chunkedRoute(path, query):
+            return
+
+        if path.rstrip('/') == '/uploader':
+            self.store.manifestRequests += 1
+            etag = '"%d"'%(self.store.version)
+            if self.headers.get('If-None-Match', None) == etag:
+                return self.sendBytes(httpStatus.NOT_MODIFIED, b'', headers={'ETag': etag})
+
+            body = json.dumps(dict(data=self.store.select(query))).encode('utf-8')
+            return self.sendBytes(httpStatus.OK, body, 'application/json', {'ETag': etag})
+
+        if path.startswith('/media/'):
+            blob = self.store.contents.get(urllib.parse.unquote(path[len('/media/'):]))
+            if blob is None:
+                return self.sendJSON(httpStatus.NOT_FOUND, dict(reason='No such blob'))
+
+            return self.sendMedia(blob)
+
+        self.__tableRoute(path, query)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        if not self.__isAuthorized():
+            return
+
+        path, query = self.__splitPath()
+        if self.__chunkedRoute(path, query):
+            return
+
+        if path.rstrip('/') != '/uploader':
+            return self.__tableRoute(path, query)
+
+        fields, files = self.__readForm()
+        if 'blob' not in files:
+            return self.sendJSON(httpStatus.BAD_REQUEST, dict(reason='Expecting a blob'))
+
+        record = self.store.create(fields, files['blob'])
+        self.sendJSON(httpStatus.OK, dict(data=record))
+
+    def do_PUT(self):
+        if not self.__isAuthorized():
+            return
+
+        path, query = self.__splitPath()
+        if self.__chunkedRoute(path, query):
+            return
+
+        if path.rstrip('/') != '/uploader':
+            return self.__tableRoute(path, query)
+
+        fields, files = self.__readForm()
+        updated = self.store.update(query, fields, files.get('blob', None))
+        self.sendJSON(httpStatus.OK, dict(data=updated))
+
+    def do_DELETE(self):
+        if not self.__isAuthorized():
+            return
+
+        path, query = self.__splitPath()
+        if path.rstrip('/') != '/uploader':
+            return self.__tableRoute(path, query)
+
+        self.sendJSON(httpStatus.OK, dict(data=self.store.delete(query)))
+
+class StandInHTTPServer(http.server.ThreadingHTTPServer):
+    # Bursts of concurrent clients mustn't overflow the listen backlog,
+    # their retried connects would then stall for a second.
+    request_queue_size = 128
+
+    def handle_error(self, request, clientAddress):
+        # Clients hanging up early, eg the losing half of a hedged GET, are
+        # expected and not worth a traceback.
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        http.server.ThreadingHTTPServer.handle_error(self, request, clientAddress)
+
+class StandInServer:
+    '''
+    Usage:
+        with StandInServer() as server:
+            rd = RestDriver('http://127.0.0.1', server.port)
+    '''
+    def __init__(self, host='127.0.0.1', port=0, handlerClass=StandInHandler,
+                                        supportsRanges=True, signingKey=None):
+        # signingKey: when set, requests not signed with it get a 401
+        self.__httpd = StandInHTTPServer((host, port), handlerClass)
+        self.__httpd.daemon_threads = True
+        self.__httpd.supportsRanges = supportsRanges
+        self.__httpd.signer = Signer(signingKey) if signingKey else None
+        self.__httpd.rejectedRequests = 0
+        self.__httpd.store = BlobStore()
+        self.__httpd.chunked = ChunkedUploads(self.__httpd.store)
+        self.__httpd.tables = dict()
+        self.__httpd.tablesLock = threading.Lock()
+        self.__thread = None
+
+    @property
+    def store(self):
+        return self.__httpd.store
+
+    @property
+    def chunked(self):
+        return self.__httpd.chunked
+
+    def table(self, path):
+        # The RecordTable served at path eg '/jobTable/jobHandler'
+        with self.__httpd.tablesLock:
+            return self.__httpd.tables.setdefault(path.rstrip('/'), RecordTable())
+
+    @property
+    def rejectedRequests(self):
+        return self.__httpd.rejectedRequests
+
+    @property
+    def port(self):
+        return self.__httpd.server_address[1]
+
+    @property
+    def baseUrl(self):
+        return 'http://%s:%d'%self.__httpd.server_address[:2]
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__httpd.serve_forever, kwargs=dict(poll_interval=0.05))
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *excInfo):
+        self.stop()
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    server = StandInServer(port=port)
+    print('Stand-in restAssured serving on %s'%(server.baseUrl))
+    try:
+        server.start()
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Local journal of a chunked upload's confirmed parts so that an
+# interrupted upload can pick up from where it left off.
+
+import os
+import json
+import hashlib
+import threading
+
+try:
+    from utils import atomicWrite, getCacheDir, toBytes
+except:
+    from .utils import atomicWrite, getCacheDir, toBytes
+
+class UploadJournal:
+    def __init__(self, fPath, baseUrl, journalDir=None):
+        key = hashlib.sha1(toBytes('%s\n%s'%(baseUrl, os.path.abspath(fPath))))
+        self.path = os.path.join(
+            journalDir or getCacheDir('uploads'), '%s.json'%(key.hexdigest()))
+
+        self.__lock = threading.Lock()
+        self.state = dict()
+
+    def load(self, **fingerPrint):
+        # Returns the saved state if it was saved for the same file contents
+        # ie matching size, mtime, partSize etc, else an empty dict.
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (EnvironmentError, ValueError):
+            return dict()
+
+        for key, value in fingerPrint.items():
+            if state.get(key, None) != value:
+                return dict()
+
+        self.state = state
+        return state
+
+    def save(self, **state):
+        with self.__lock:
+            self.state.update(state)
+            self.__flush()
+
+    def markConfirmed(self, partIndex):
+        with self.__lock:
+            confirmed = set(self.state.get('confirmed', []))
+            confirmed.add(partIndex)
+            self.state['confirmed'] = sorted(confirmed)
+            self.__flush()
+
+    def __flush(self):
+        atomicWrite(self.path, json.dumps(self.state))
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except EnvironmentError:
+            pass
+
+        self.state = dict()
@@ -1,10 +1,13 @@
 # Author: Emmanuel Odeke <odeke@ualberta.ca>
 
+import io
 import os
 import re
 import sys
 import hmac
+import mmap
 import hashlib
+import threading
 
 def pyVersionTuple():
     version = sys.version_info
@@ -37,6 +40,15 @@ isCallableAttr = lambda obj, attrStr: isCallable(getattr(obj, attrStr, None))
 
 getDefaultAuthor = lambda: os.environ.get('USER', 'Anonymous')
 getDefaultUserName = getDefaultAuthor
+
+def getCacheDir(*subDirs):
+    # Per-user directory for resty's local state eg upload journals
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'resty', *subDirs)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
+    return path
 docStartRegCompile = re.compile('^documents', re.UNICODE)
 
 nonStartSeqReg = re.compile('^[^_a-zA-Z]', re.UNICODE)
@@ -48,6 +60,75 @@ def getHMACSignature(key, msg, digestmod=hashlib.sha256):
 def getHMACHexDigest(*args, **kwargs):
     return getHMACSignature(*args, **kwargs).hexdigest()
 
+# Large enough to amortize the per-call overhead, small enough to keep memory flat
+CHECKSUM_CHUNK_SIZE = mmap.PAGESIZE * 256
+
+def hashStream(hashObj, stream, chunkSize=CHECKSUM_CHUNK_SIZE):
+    # Feeds a stream into hashObj chunk by chunk, never holding it all in memory
+    readInto = getattr(stream, 'readinto', None)
+    if isCallable(readInto) and not isinstance(getattr(stream, 'encoding', None), str):
+        buf = bytearray(chunkSize)
+        view = memoryview(buf)
+        while True:
+            n = readInto(buf)
+            if not n:
+                break
+            hashObj.update(view[:n])
+    else:
+        chunk = stream.read(chunkSize)
+        while chunk:
+            hashObj.update(toBytes(chunk))
+            chunk = stream.read(chunkSize)
+
+    return hashObj
+
+def readFully(stream, contentLength=None, chunkSize=CHECKSUM_CHUNK_SIZE):
+    # Reads a binary stream to its end into one bytearray, preallocated from
+    # contentLength when known so the bytes are copied in exactly once.
+    buf = bytearray(contentLength or 0)
+    view = memoryview(buf)
+    filled = 0
+    while filled < len(buf):
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    view.release()
+
+    if filled < len(buf):
+        del buf[filled:]
+        return buf
+
+    # Unknown or understated length, append in amortized O(1) chunks
+    chunk = stream.read(chunkSize)
+    while chunk:
+        buf += chunk
+        chunk = stream.read(chunkSize)
+
+    return buf
+
+class HashingWriter(io.RawIOBase):
+    '''
+    Write-only stream that tees every byte written into hashObj before
+    passing it on to sink. With no sink the bytes are only hashed and counted.
+    '''
+    def __init__(self, hashObj, sink=None):
+        self.hashObj = hashObj
+        self.sink = sink
+        self.bytesWritten = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.hashObj.update(data)
+        if self.sink is not None:
+            self.sink.write(data)
+
+        n = len(data) if isinstance(data, bytes) else memoryview(data).nbytes
+        self.bytesWritten += n
+        return n
+
 # Custom Exceptions
 
 class UnReadableStreamException(Exception):
@@ -55,7 +136,22 @@ class UnReadableStreamException(Exception):
 
 class UnWriteableStreamException(Exception):
     pass
+
+class ManifestPageException(Exception):
+    # A manifest page failed, response holds its parsed {'status_code', ...}
+    def __init__(self, response):
+        super(ManifestPageException, self).__init__(
+            'Manifest page failed with status %s'%(response.get('status_code', None)))
+        self.response = response
            
+def atomicWrite(path, data):
+    # Writes to a sibling temp file first so readers never see a partial file
+    tmpPath = '%s.%d.%d.tmp'%(path, os.getpid(), threading.get_ident())
+    with open(tmpPath, 'wb') as f:
+        f.write(toBytes(data))
+
+    os.replace(tmpPath, path)
+
 def toBytes(data): 
     if isinstance(data, bytes):
         return data
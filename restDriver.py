@@ -6,7 +6,7 @@
 import os
 import re
 import sys
-import hmac
+import concurrent.futures
 from optparse import OptionParser
 
 try:
@@ -15,9 +15,37 @@ except:
     from .entrails.dbLiason import HandlerLiason
 
 try:
-    from entrails.fileOnCloudHandler import FileOnCloudHandler
+    from entrails.fileOnCloudHandler import FileOnCloudHandler, DEFAULT_MANIFEST_PAGE_SIZE
 except:
-    from .entrails.fileOnCloudHandler import FileOnCloudHandler
+    from .entrails.fileOnCloudHandler import FileOnCloudHandler, DEFAULT_MANIFEST_PAGE_SIZE
+
+try:
+    from entrails.blobCache import BlobCache, DEFAULT_MAX_BYTES
+except:
+    from .entrails.blobCache import BlobCache, DEFAULT_MAX_BYTES
+
+try:
+    from entrails.manifestCache import ManifestCache, DEFAULT_TTL
+except:
+    from .entrails.manifestCache import ManifestCache, DEFAULT_TTL
+
+try:
+    from entrails.directorySync import DirectorySync, PUSH
+    from entrails.checkSumIndex import CheckSumIndex
+except:
+    from .entrails.directorySync import DirectorySync, PUSH
+    from .entrails.checkSumIndex import CheckSumIndex
+
+try:
+    from entrails.metrics import MetricsRegistry
+    from entrails.connectionPool import ConnectionPool
+    from entrails.signing import Signer, SigningAuth
+    from entrails.singleFlight import SingleFlight
+except:
+    from .entrails.metrics import MetricsRegistry
+    from .entrails.connectionPool import ConnectionPool
+    from .entrails.signing import Signer, SigningAuth
+    from .entrails.singleFlight import SingleFlight
 
 try:
     from entrails.utils import(
@@ -39,10 +67,29 @@ class RestDriver:
         'delete': ('delete', 's'), 'get': ('get', 's',),
         'refreshTokenStore': ('refresh', '')
     }
+    # ie newJobsBulk, updateJobsBulk, deleteJobsBulk
+    __restBulkMethods = {
+        'postBulk': ('new', 'sBulk',), 'putBulk': ('update', 'sBulk',),
+        'deleteBulk': ('delete', 'sBulk',)
+    }
     getDefaultAuthor = getDefaultAuthor
 
     def __init__(self, ip, port='8000',checkSumAlgoName='sha1',
-            secretKey=None, publicKey=None, tokenRetrievalURL=None):
+            secretKey=None, publicKey=None, tokenRetrievalURL=None,
+            connectionPool=None, requestPolicy=None, signRequests=False):
+        # connectionPool: a ConnectionPool for every liason and the file
+        # handler to share, possibly with other drivers, see ConnectionPool
+        # for its size, keep-alive and timeout knobs.
+        # requestPolicy: a RequestPolicy ie retries, circuit breaking and
+        # hedging for every request this driver sends.
+        # signRequests: sign every request with secretKey, see enableRequestSigning
+        self.__connectionPool = connectionPool or ConnectionPool()
+        if requestPolicy is not None:
+            self.__connectionPool.setRequestPolicy(requestPolicy)
+
+        # Per liason and blob operation latencies, bytes and statuses, see metrics()
+        self.__metrics = MetricsRegistry()
+        self.__singleFlight = None # See enableRequestCoalescing
 
         self.__checkSumAlgoName = checkSumAlgoName or 'sha1'
        
@@ -63,16 +110,80 @@ class RestDriver:
         self.__externNameToLiasonMap = dict()
 
         self.__fCloudHandler =  FileOnCloudHandler(
-            self.__baseUrl, self.__checkSumAlgoName
+            self.__baseUrl, self.__checkSumAlgoName, session=self.__connectionPool
         )
+        self.__fCloudHandler.setMetrics(self.__metrics)
 
-        self.__hmac = None
+        self.__signer = None
+        self.__signingAuth = None
         self.__publicKey = publicKey or ''
         self.updateSecretKey(secretKey)
+        if signRequests:
+            self.enableRequestSigning()
 
     def getCheckSumAlgoName(self):
         return self.__fCloudHandler.getCheckSumAlgoName()
 
+    def getConnectionPool(self):
+        return self.__connectionPool
+
+    def setRequestPolicy(self, requestPolicy):
+        self.__connectionPool.setRequestPolicy(requestPolicy)
+
+    def getRequestPolicy(self):
+        return self.__connectionPool.requestPolicy
+
+    def metrics(self):
+        '''
+        Returns a snapshot ie {scope: {method: stats}} where scope is a
+        registered liason's shortName eg 'Job' or 'blobs' for blob operations
+        and stats hold count, errors, inFlight, latency percentiles and
+        histogram buckets, bytesSent, bytesReceived and status counts.
+        '''
+        return self.__metrics.snapshot()
+
+    def getMetricsRegistry(self):
+        return self.__metrics
+
+    def addMetricsExporter(self, exporter):
+        # exporter(snapshot) is invoked on every exportMetrics
+        self.__metrics.addExporter(exporter)
+
+    def exportMetrics(self):
+        return self.__metrics.export()
+
+    def enableRequestCoalescing(self):
+        '''
+        Concurrent identical getXs calls of the registered liasons, and
+        getCloudFilesManifest calls, share one request and its parsed result
+        instead of each sending their own, see SingleFlight.
+        Returns the SingleFlight whose stats count calls and coalesced callers.
+        '''
+        if self.__singleFlight is None:
+            self.__singleFlight = SingleFlight()
+
+        self.__fCloudHandler.setSingleFlight(self.__singleFlight)
+        for liason in self.__externNameToLiasonMap.values():
+            liason.setSingleFlight(self.__singleFlight)
+
+        return self.__singleFlight
+
+    def disableRequestCoalescing(self):
+        self.__singleFlight = None
+        self.__fCloudHandler.setSingleFlight(None)
+        for liason in self.__externNameToLiasonMap.values():
+            liason.setSingleFlight(None)
+
+    def coalescingStats(self):
+        if self.__singleFlight is None:
+            return None
+
+        return self.__singleFlight.stats()
+
+    def connectionStats(self):
+        # Reused vs newly opened connections, see ConnectionPool.stats
+        return self.__connectionPool.stats()
+
     def _updatePublicKey(self, pubKey):
         self.__publicKey = pubKey
 
@@ -81,10 +192,35 @@ class RestDriver:
         # It gets loaded into the HMAC object asap and no ref to the key is made.
         if secretKey:
             self.__createHMAC(secretKey)
+            if self.__signingAuth is not None:
+                self.enableRequestSigning()
+
+    def getSigner(self):
+        return self.__signer
+
+    def enableRequestSigning(self):
+        '''
+        Signs every request sent through this driver's connection pool ie by
+        its liasons and file handler, with the same key as signItems.
+        Bodies, including streamed uploads, are run through the MAC ahead of
+        being sent, see entrails.signing.SigningAuth for the headers added.
+        A pool shared with other drivers signs their requests too.
+        '''
+        if self.__signer is None:
+            raise ValueError('Request signing needs a secretKey')
+
+        self.__signingAuth = SigningAuth(self.__signer, self.__publicKey or None)
+        self.__connectionPool.auth = self.__signingAuth
 
-    def registerLiason(self, shortName, url, tokenRetrievalURL=None):
+    def disableRequestSigning(self):
+        if self.__connectionPool.auth is self.__signingAuth:
+            self.__connectionPool.auth = None
+        self.__signingAuth = None
+
+    def registerLiason(self, shortName, url, tokenRetrievalURL=None, bulkUrl=None):
         '''
         Params: shortName eg 'Job', url '/jobTable/jobHandler'
+                bulkUrl: optional batched endpoint eg '/jobTable/jobHandler/bulk'
          Explanation:
             + Creates a name mangled dbLiason, and then creates the respective
               rest handlers as defined in static dict '__restConnectorMethods'
@@ -97,6 +233,10 @@ class RestDriver:
               capitalized on the first letter
                 ie shortName='apps', url='/apps' => self.updateApps
                 not self.updateapps
+
+            + Bulk variants ie self.newJobsBulk(records, concurrency=8),
+              self.updateJobsBulk(updates) and self.deleteJobsBulk(queries)
+              return per-item results in order, see DbConn.bulk
         '''
 
         if not (isinstance(shortName, str) and shortName):
@@ -109,10 +249,12 @@ class RestDriver:
         liasonName = '__%sLiason'%(shortName.lower())
 
         # Match camelCase naming convention
-        setattr(self, liasonName, self.__createLiason(url, tokenRetrievalURL))
+        setattr(self, liasonName,
+                    self.__createLiason(url, tokenRetrievalURL, bulkUrl, shortName))
         self.__externNameToLiasonMap[shortName] = getattr(self, liasonName)
 
-        for restMethod, symNameTuple in self.__restConnectorMethods.items():
+        restMethods = dict(self.__restConnectorMethods, **self.__restBulkMethods)
+        for restMethod, symNameTuple in restMethods.items():
             symName, nameSuffix = symNameTuple
             setattr(
                 self, '%s%s%s'%(symName, shortName.capitalize(), nameSuffix),
@@ -121,9 +263,12 @@ class RestDriver:
 
         return getattr(self, liasonName)
 
-    def __createLiason(self, url, tokenRetrievalURL=None):
+    def __createLiason(self, url, tokenRetrievalURL=None, bulkUrl=None, shortName=None):
         return HandlerLiason(
-                self.__baseUrl + url, tokenRetrievalURL=tokenRetrievalURL)
+                self.__baseUrl + url, tokenRetrievalURL=tokenRetrievalURL,
+                bulkUrl=self.__baseUrl + bulkUrl if bulkUrl else None,
+                session=self.__connectionPool, metrics=self.__metrics,
+                metricsScope=shortName, singleFlight=self.__singleFlight)
 
     def __createLiasableFunc(self, key, methodKey, **attrs):
         liason = self.__externNameToLiasonMap.get(key, None)
@@ -143,21 +288,43 @@ class RestDriver:
         # Concatenate public and private keys to get the signature
         catKey = bSecretKey + bPublicKey
 
-        self.__hmac = hmac.HMAC(key=catKey)
-
-    def __signItem(self, item, outputPlainBytes=False):
-        self.__hmac.update(toBytes(item))
-        if outputPlainBytes:
-            return self.__hmac.digest()
-        else:
-            return self.__hmac.hexdigest()
+        self.__signer = Signer(catKey)
 
     def signItems(self, *bArgs, **outputKWargs):
-        return list(self.__signItem(item, **outputKWargs) for item in bArgs)
+        '''
+        Returns the HMAC-SHA256 of each item, independent of the others.
+        outputKWargs: outputPlainBytes=False for hexdigests,
+            workers to spread large items across threads, see Signer.signMany
+        '''
+        return self.__signer.signMany(bArgs, **outputKWargs)
 
     def uploadBlob(self, srcPath, **attrs):
         return self.__fCloudHandler.uploadBlobByPath(srcPath, **attrs)
 
+    def uploadTree(self, root, workers=8, **attrs):
+        return self.__fCloudHandler.uploadTree(root, workers=workers, **attrs)
+
+    def syncDirectory(self, localDir, direction=PUSH, deleteOrphans=False,
+                        dryRun=False, prefix='', workers=8, **query):
+        '''
+        Params: localDir: the directory to sync
+                direction: 'push' uploads new files and updates changed ones,
+                    'pull' downloads missing and changed blobs
+                deleteOrphans: also delete what only exists on the destination.
+                    Pushing needs a prefix or query to scope the remote side.
+                dryRun: only report what would be done
+                prefix, query: scope the remote side, see DirectorySync
+         Explanation:
+            + Files are titled by their '/' separated path relative to
+              localDir and compared with the manifest by size then checkSum,
+              unchanged files are neither re-hashed past that nor sent.
+
+            + Returns the per-title results, the counts of each action and
+              'bytesTransferred' vs 'bytesSkipped', see DirectorySync.run
+        '''
+        sync = DirectorySync(self, localDir, prefix=prefix, workers=workers, **query)
+        return sync.run(direction, deleteOrphans, dryRun)
+
     def uploadStream(self, f, **attrs):
         attrs['isPut'] = False
         return self.__fCloudHandler.uploadBlobByStream(f, **attrs)
@@ -173,6 +340,35 @@ class RestDriver:
         return self.__fCloudHandler.downloadBlobToBuffer(
                             self.___keyToDocCloudName(key), **kwargs)
 
+    def openBlobStream(self, key, **kwargs):
+        return self.__fCloudHandler.openBlobStream(
+                            self.___keyToDocCloudName(key), **kwargs)
+
+    def enableBlobCache(self, cacheDir=None, maxBytes=DEFAULT_MAX_BYTES):
+        # Opt-in: downloads get served from a local content addressed cache
+        blobCache = BlobCache(cacheDir, maxBytes)
+        self.__fCloudHandler.setBlobCache(blobCache)
+        return blobCache
+
+    def disableBlobCache(self):
+        self.__fCloudHandler.setBlobCache(None)
+
+    def getBlobCache(self):
+        return self.__fCloudHandler.getBlobCache()
+
+    def enableManifestCache(self, ttl=DEFAULT_TTL, maxEntries=1024):
+        # Opt-in: getCloudFilesManifest answers repeated queries from memory
+        # for ttl seconds, then revalidates them with the server.
+        manifestCache = ManifestCache(ttl, maxEntries)
+        self.__fCloudHandler.setManifestCache(manifestCache)
+        return manifestCache
+
+    def disableManifestCache(self):
+        self.__fCloudHandler.setManifestCache(None)
+
+    def getManifestCache(self):
+        return self.__fCloudHandler.getManifestCache()
+
     def deleteBlob(self, **attrs):
         return self.__fCloudHandler.deleteBlobOnCloud(**attrs)
 
@@ -186,6 +382,37 @@ class RestDriver:
     def getCloudFilesManifest(self, **queryParams):
         return self.__fCloudHandler.getParsedManifest(**queryParams)
 
+    def iterCloudFilesManifest(self, pageSize=DEFAULT_MANIFEST_PAGE_SIZE, **queryParams):
+        '''
+        Generator over the manifest entries matching queryParams, fetched a
+        page at a time with the next page prefetched, see
+        FileOnCloudHandler.iterManifest. Memory stays at two pages however
+        large the store is.
+        '''
+        return self.__fCloudHandler.iterManifest(pageSize=pageSize, **queryParams)
+
+    def loadCloudFilesManifest(self, pageSize=DEFAULT_MANIFEST_PAGE_SIZE, **queryParams):
+        # Returns an indexed Manifest of the matching entries, see entrails.manifest
+        return self.__fCloudHandler.loadManifest(pageSize=pageSize, **queryParams)
+
+    def enableLocalManifest(self, pageSize=DEFAULT_MANIFEST_PAGE_SIZE):
+        '''
+        Loads the whole manifest into an indexed Manifest that this driver's
+        own uploads, updates and deletes are then applied to, and that
+        uploadTree dedups against without fetching the manifest again.
+        Changes made by other clients are not seen until it is re-enabled.
+        Returns the Manifest.
+        '''
+        manifest = self.loadCloudFilesManifest(pageSize=pageSize)
+        self.__fCloudHandler.setLocalManifest(manifest)
+        return manifest
+
+    def disableLocalManifest(self):
+        self.__fCloudHandler.setLocalManifest(None)
+
+    def getLocalManifest(self):
+        return self.__fCloudHandler.getLocalManifest()
+
     def setBaseUrl(self, newUrl):
         self.__baseUrl = newUrl
 
@@ -204,17 +431,58 @@ class RestDriver:
     def __repr__(self):
         return 'RestDriver::%s'%(self.__baseUrl)
 
+    def enableCheckSumIndex(self, indexPath=None):
+        '''
+        Opt-in: file checkSums, as used by getFileCheckSum(s), uploads,
+        uploadTree and syncDirectory, are kept in a persistent sqlite index
+        keyed by each file's stat and only recomputed once a file changed.
+        indexPath defaults to the per-user cache dir, the index can be
+        shared by several processes. Returns the CheckSumIndex.
+        '''
+        checkSumIndex = CheckSumIndex(indexPath)
+        self.__fCloudHandler.setCheckSumIndex(checkSumIndex)
+        return checkSumIndex
+
+    def disableCheckSumIndex(self):
+        self.__fCloudHandler.setCheckSumIndex(None)
+
+    def getCheckSumIndex(self):
+        return self.__fCloudHandler.getCheckSumIndex()
+
     def getFileCheckSum(self, path, algoName=None):
         checkSum = None
         if path and os.path.isfile(path):
-            with open(path, 'rb') as f:
-                status, result = self.__fCloudHandler.getCheckSum(
-                                                        f.read(), algoName)
-                if status == 200:
-                    checkSum = result.hexdigest()
+            checkSum = self.__fCloudHandler.getFileCheckSum(path, algoName)
 
         return checkSum
 
+    def __safeFileCheckSum(self, path, algoName=None):
+        try:
+            return self.getFileCheckSum(path, algoName)
+        except EnvironmentError as e:
+            sys.stderr.write('getFileCheckSums: %s\n'%(e))
+
+    def getFileCheckSums(self, paths, algoName=None, workers=None):
+        '''
+        Returns a dict mapping each path to its hexdigest, None for paths that
+        aren't regular files or couldn't be hashed. Files are hashed in fixed
+        size chunks across a thread pool; hashlib releases the GIL on large
+        updates so this scales with the number of cores.
+        '''
+        paths = list(paths)
+        checkSums = dict.fromkeys(paths)
+        if not paths:
+            return checkSums
+
+        workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                lambda path: self.__safeFileCheckSum(path, algoName), paths)
+            for path, checkSum in zip(paths, results):
+                checkSums[path] = checkSum
+
+        return checkSums
+
     def getCheckSum(self, binaryData, algoName=None):
         status, result = self.__fCloudHandler.getCheckSum(binaryData, algoName)
         if status == 200:
@@ -0,0 +1,94 @@
+import os
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import threading
+import unittest
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if aiohttp is not None:
+    import asyncRestDriver
+
+from entrails.standInServer import StandInServer
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class TestAsyncFileOnCloudHandler(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.tmpDir = tempfile.mkdtemp()
+        self.data = os.urandom(200000)
+        self.path = os.path.join(self.tmpDir, 'src')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def drive(self, coroutineFunc):
+        async def run():
+            async with asyncRestDriver.AsyncRestDriver('http://127.0.0.1', self.server.port) as rd:
+                return await coroutineFunc(rd)
+
+        return asyncio.run(run())
+
+    def testUploadAndDownload(self):
+        dstPath = os.path.join(self.tmpDir, 'dst')
+        async def run(rd):
+            response = await rd.uploadBlob(self.path, title='src')
+            manifest = await rd.getCloudFilesManifest(title='src')
+            entry = manifest['data'][0]
+            written = await rd.downloadBlob(entry['content'], altName=dstPath)
+            chunks = [c async for c in rd.downloadBlobToStream(entry['content'])]
+            return response, entry, written, b''.join(chunks)
+
+        response, entry, written, streamed = self.drive(run)
+        self.assertEqual(response['status_code'], 200)
+        self.assertEqual(entry['checkSum'], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual((written, streamed), (len(self.data), self.data))
+        with open(dstPath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def testUpdateSetsCheckSum(self):
+        newData = os.urandom(1000)
+        newPath = os.path.join(self.tmpDir, 'new')
+        with open(newPath, 'wb') as f:
+            f.write(newData)
+
+        async def run(rd):
+            await rd.uploadBlob(self.path, title='src')
+            other = self.server.store.create(dict(title='other'), b'unrelated')
+            unscoped = await rd.updateFile(newPath)
+            scoped = await rd.updateFile(newPath, query=dict(title='src'))
+            return unscoped, scoped, other, (await rd.getCloudFilesManifest(title='src'))['data'][0]
+
+        unscoped, scoped, other, entry = self.drive(run)
+        self.assertEqual((unscoped['status_code'], scoped['status_code']), (400, 200))
+        self.assertEqual(entry['checkSum'], hashlib.sha1(newData).hexdigest())
+        self.assertEqual(self.server.store.contents[entry['content']], newData)
+        self.assertEqual(self.server.store.contents[other['content']], b'unrelated')
+
+    def testHashedOffTheEventLoop(self):
+        from entrails.asyncFileOnCloudHandler import AsyncFileOnCloudHandler
+        threads = []
+        getCheckSumByStream = AsyncFileOnCloudHandler.getCheckSumByStream
+        def recording(handler, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return getCheckSumByStream(handler, *args, **kwargs)
+
+        AsyncFileOnCloudHandler.getCheckSumByStream = recording
+        try:
+            async def run(rd):
+                return await rd.uploadBlob(self.path, title='src')
+
+            self.assertEqual(self.drive(run)['status_code'], 200)
+        finally:
+            AsyncFileOnCloudHandler.getCheckSumByStream = getCheckSumByStream
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
@@ -0,0 +1,95 @@
+import json
+import asyncio
+import unittest
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+if web is not None:
+    import asyncRestDriver
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class TestAsyncRestDriver(unittest.TestCase):
+    def setUp(self):
+        self.rd = asyncRestDriver.AsyncRestDriver(None, None)
+        self.assertEqual(self.rd.getBaseUrl(), 'http://127.0.0.1:8000')
+
+    def testPlainRegistration(self):
+        self.rd.registerLiason('song', '/thebear/songHandler')
+        for name in ('newSong', 'getSongs', 'updateSongs', 'deleteSongs'):
+            self.assertEqual(
+                asyncio.iscoroutinefunction(getattr(self.rd, name, None)), True)
+
+    def testExtremeContentForRegistration(self):
+        self.assertEqual(self.rd.registerLiason(self, None), None)
+        self.assertEqual(self.rd.registerLiason('hey', 1000), None)
+
+    def testConcurrentCrud(self):
+        async def echo(request):
+            body = await request.text()
+            return web.json_response(dict(
+                method=request.method, query=dict(request.query),
+                body=body and json.loads(body) or None
+            ))
+
+        async def run():
+            app = web.Application()
+            app.router.add_route('*', '/thebear/songHandler', echo)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            async with asyncRestDriver.AsyncRestDriver('http://127.0.0.1', port) as rd:
+                rd.registerLiason('Song', '/thebear/songHandler')
+                results = await asyncio.gather(
+                    *(rd.newSong(title='t%d'%(i)) for i in range(20)),
+                    rd.getSongs(title='t0', limit=1)
+                )
+
+            await runner.cleanup()
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 21)
+        for i, result in enumerate(results[:20]):
+            self.assertEqual(result['status_code'], 200)
+            self.assertEqual(result['value']['method'], 'POST')
+            self.assertEqual(result['value']['body'], dict(title='t%d'%(i)))
+
+        self.assertEqual(results[20]['value']['query'], dict(title='t0', limit='1'))
+
+    def testConcurrentFirstRequestsWaitForToken(self):
+        fetches = []
+        async def token(request):
+            fetches.append(1)
+            await asyncio.sleep(0.05)
+            return web.Response(headers={'X-Token': 'secret'})
+
+        async def echo(request):
+            return web.json_response(dict(token=request.headers.get('X-Token', None)))
+
+        async def run():
+            app = web.Application()
+            app.router.add_get('/token', token)
+            app.router.add_get('/thebear/songHandler', echo)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            async with asyncRestDriver.AsyncRestDriver('http://127.0.0.1', port) as rd:
+                rd.registerLiason('Song', '/thebear/songHandler',
+                            tokenRetrievalURL='http://127.0.0.1:%d/token'%(port))
+                results = await asyncio.gather(*(rd.getSongs() for i in range(10)))
+
+            await runner.cleanup()
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual([r['value']['token'] for r in results], ['secret'] * 10)
+        self.assertEqual(len(fetches), 1)
@@ -0,0 +1,91 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import restDriver
+from entrails.blobCache import BlobCache
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+class TestBlobCache(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def put(self, cache, data):
+        checkSum = hashlib.sha1(data).hexdigest()
+        return checkSum, cache.put('sha1', checkSum, [data[:10], data[10:]])
+
+    def testPutAndGet(self):
+        cache = BlobCache(self.cacheDir, 1000)
+        checkSum, path = self.put(cache, b'x' * 100)
+        self.assertEqual(cache.get('sha1', checkSum), path)
+        self.assertEqual(cache.get('sha1', 'ab' * 20), None)
+        self.assertEqual(cache.get('sha1', '../../etc'), None)
+        self.assertEqual(cache.put('sha1', 'ab' * 20, [b'mismatch']), None)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 1))
+
+        # Entries outlive the process that wrote them
+        self.assertEqual(BlobCache(self.cacheDir, 1000).get('sha1', checkSum), path)
+
+    def testLRUEviction(self):
+        cache = BlobCache(self.cacheDir, 250)
+        sumA, pathA = self.put(cache, b'a' * 100)
+        sumB, pathB = self.put(cache, b'b' * 100)
+        cache.get('sha1', sumA) # b is now the least recently used
+        sumC, pathC = self.put(cache, b'c' * 100)
+
+        self.assertEqual(cache.get('sha1', sumB), None)
+        self.assertEqual(os.path.exists(pathB), False)
+        self.assertEqual(cache.get('sha1', sumA), pathA)
+        self.assertEqual(cache.get('sha1', sumC), pathC)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['bytes'], 200)
+
+class TestCachedDownloads(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpDir)
+
+    def testDownloadBlob(self):
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        cache = rd.enableBlobCache(os.path.join(self.tmpDir, 'cache'))
+
+        data = os.urandom(70000)
+        srcPath = os.path.join(self.tmpDir, 'src')
+        with open(srcPath, 'wb') as f:
+            f.write(data)
+        rd.uploadBlob(srcPath, title='src')
+        content = rd.getCloudFilesManifest(title='src')['data'][0]['content']
+
+        dstPath = os.path.join(self.tmpDir, 'dst')
+        self.assertEqual(rd.downloadBlob(content, altName=dstPath), len(data))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        # Served locally even once the server can no longer provide the bytes
+        self.server.store.contents[content] = b''
+        self.assertEqual(rd.downloadBlob(content, altName=dstPath), len(data))
+        self.assertEqual(b''.join(rd.downloadBlobToStream(content)), data)
+        with open(dstPath, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def testCloudPassagePull(self):
+        cc = CloudPassageHandler('http://127.0.0.1', self.server.port)
+        cache = cc.enableBlobCache(os.path.join(self.tmpDir, 'cache'))
+
+        data = list(range(1000))
+        cc.push(data, title='listing', asPickle=True)
+        self.assertEqual(cc.pull(metaData='pickle'), data)
+        self.assertEqual(cc.pull(metaData='pickle'), data)
+        self.assertEqual((cache.stats()['misses'], cache.stats()['hits']), (1, 1))
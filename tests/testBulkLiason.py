@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+
+import restDriver
+from entrails.standInServer import StandInServer
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if aiohttp is not None:
+    import asyncRestDriver
+
+class TestBulkLiason(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def checkCrud(self, rd, table, count):
+        records = [dict(name='job%d'%(i), status='queued') for i in range(count)]
+        created = rd.newJobsBulk(records, concurrency=8)
+        self.assertEqual([r['status_code'] for r in created], [200] * count)
+        self.assertEqual([r['value']['data']['name'] for r in created],
+                                                [r['name'] for r in records])
+
+        updated = rd.updateJobsBulk([
+            dict(queryParams=dict(name='job%d'%(i)), updateParams=dict(status='done'))
+            for i in range(0, count, 2)
+        ])
+        self.assertEqual([r['value']['data'] for r in updated], [1] * len(updated))
+        self.assertEqual(len(rd.getJobs(status='done')['value']['data']), len(updated))
+
+        deleted = rd.deleteJobsBulk([dict(name='job%d'%(i)) for i in range(count)] + [dict(name='none')])
+        self.assertEqual([r['value']['data'] for r in deleted], [1] * count + [0])
+        self.assertEqual(len(table.records), 0)
+
+    def testPerItemRequests(self):
+        self.rd.registerLiason('Job', '/jobTable/jobHandler')
+        table = self.server.table('/jobTable/jobHandler')
+        self.checkCrud(self.rd, table, 40)
+        self.assertGreaterEqual(table.requests, 40)
+
+    def testBatchedEndpoint(self):
+        self.rd.registerLiason('Job', '/jobTable/jobHandler', bulkUrl='/jobTable/jobHandler/bulk')
+        table = self.server.table('/jobTable/jobHandler')
+        self.checkCrud(self.rd, table, 1200)
+        # Batches of 500: 3 creates, 2 updates, 3 deletes plus the single getJobs
+        self.assertEqual(table.requests, 9)
+
+    def testFailedItemsKeepTheirPlace(self):
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        rd.registerLiason('Job', '/jobTable/jobHandler', bulkUrl='/nowhere/bulk')
+        self.server.stop()
+        results = rd.newJobsBulk([dict(name='a'), dict(name='b')])
+        self.assertEqual([r['status_code'] for r in results], [None, None])
+        self.server = StandInServer().start()
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def testAsyncBulk(self):
+        table = self.server.table('/jobTable/jobHandler')
+
+        async def run(bulkUrl):
+            async with asyncRestDriver.AsyncRestDriver('http://127.0.0.1', self.server.port) as rd:
+                rd.registerLiason('Job', '/jobTable/jobHandler', bulkUrl=bulkUrl)
+                created = await rd.newJobsBulk([dict(name='j%d'%(i)) for i in range(30)], concurrency=4)
+                deleted = await rd.deleteJobsBulk([dict(name='j%d'%(i)) for i in range(30)])
+                return created, deleted
+
+        for bulkUrl in (None, '/jobTable/jobHandler/bulk'):
+            created, deleted = asyncio.run(run(bulkUrl))
+            self.assertEqual([r['value']['data']['name'] for r in created], ['j%d'%(i) for i in range(30)])
+            self.assertEqual([r['value']['data'] for r in deleted], [1] * 30)
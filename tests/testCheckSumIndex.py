@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import unittest
+import subprocess
+
+import restDriver
+from entrails.checkSumIndex import CheckSumIndex
+from entrails.standInServer import StandInServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestCheckSumIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.index = CheckSumIndex(os.path.join(self.tmpDir, 'index.sqlite3'))
+        self.hashed = []
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpDir)
+
+    def write(self, name, data, age=60):
+        # Aged past the racy window so that it gets indexed
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        past = time.time() - age
+        os.utime(path, (past, past))
+        return path
+
+    def checkSum(self, path):
+        def compute():
+            self.hashed.append(path)
+            with open(path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+
+        return self.index.checkSum(path, 'sha1', compute)
+
+    def testHitsUntilChanged(self):
+        path = self.write('a', b'one')
+        for i in range(3):
+            self.assertEqual(self.checkSum(path), hashlib.sha1(b'one').hexdigest())
+        self.assertEqual(len(self.hashed), 1)
+        self.assertEqual(self.index.stats(), dict(hits=2, misses=1, entries=1))
+
+        self.write('a', b'two', age=30) # Same size, new mtime
+        self.assertEqual(self.checkSum(path), hashlib.sha1(b'two').hexdigest())
+        self.assertEqual(len(self.hashed), 2)
+
+        self.assertEqual(self.index.lookup(path, 'md5'), None)
+
+    def testRacyFilesNotIndexed(self):
+        path = self.write('fresh', b'x', age=0)
+        self.checkSum(path)
+        self.checkSum(path)
+        self.assertEqual(len(self.hashed), 2)
+        self.assertEqual(len(self.index), 0)
+
+    def testPersistsAndPrunes(self):
+        path = self.write('a', b'one')
+        self.checkSum(path)
+        other = CheckSumIndex(self.index.path)
+        self.assertEqual(other.lookup(path, 'sha1'), hashlib.sha1(b'one').hexdigest())
+
+        os.remove(path)
+        self.assertEqual(other.prune(), 1)
+        self.assertEqual(len(self.index), 0)
+        other.close()
+
+    def testConcurrentProcesses(self):
+        script = (
+            'import os, sys; sys.path.insert(0, %r)\n'
+            'from entrails.checkSumIndex import CheckSumIndex\n'
+            'index = CheckSumIndex(%r)\n'
+            'st = os.stat(%r)\n'
+            'for i in range(200):\n'
+            '    index.store("%%s-%%d" %% (sys.argv[1], i), "sha1", st, "c")\n'
+        )%(ROOT, self.index.path, self.write('stat', b's'))
+
+        procs = [subprocess.Popen([sys.executable, '-c', script, str(n)]) for n in range(4)]
+        self.assertEqual([p.wait() for p in procs], [0] * 4)
+        self.assertEqual(len(self.index), 800)
+
+class TestIndexedUploads(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        self.tmpDir = tempfile.mkdtemp()
+        self.index = self.rd.enableCheckSumIndex(os.path.join(self.tmpDir, 'index.sqlite3'))
+
+        self.tree = os.path.join(self.tmpDir, 'tree')
+        os.makedirs(self.tree)
+        past = time.time() - 60
+        for i in range(3):
+            path = os.path.join(self.tree, 'f%d'%(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000))
+            os.utime(path, (past, past))
+
+    def tearDown(self):
+        self.rd.disableCheckSumIndex()
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def testReused(self):
+        path = os.path.join(self.tree, 'f0')
+        with open(path, 'rb') as f:
+            expected = hashlib.sha1(f.read()).hexdigest()
+
+        self.assertEqual(self.rd.getFileCheckSum(path), expected)
+        self.assertEqual(self.rd.uploadBlob(path, title='f0').status_code, 200)
+        self.assertEqual(self.rd.getCloudFilesManifest(title='f0')['data'][0]['checkSum'], expected)
+        self.assertEqual((self.index.hits, self.index.misses), (1, 1))
+
+        summary = self.rd.uploadTree(self.tree)
+        self.assertEqual((summary['uploaded'], summary['skipped']), (2, 1))
+        self.assertEqual((self.index.hits, self.index.misses), (2, 3))
+
+        self.rd.syncDirectory(self.tree)
+        self.assertEqual((self.index.hits, self.index.misses), (5, 3))
@@ -0,0 +1,70 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import restDriver
+from entrails.standInServer import StandInServer
+
+class TestChunkedUpload(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+
+        self.tmpDir = tempfile.mkdtemp()
+        self.journalDir = os.path.join(self.tmpDir, 'journal')
+        os.makedirs(self.journalDir)
+
+        self.data = os.urandom(10 * 65536 + 123)
+        self.path = os.path.join(self.tmpDir, 'big.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def upload(self):
+        return self.rd.uploadBlob(self.path, chunked=True, partSize=65536,
+                            partWorkers=3, journalDir=self.journalDir, title='big')
+
+    def testUploadInParts(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.chunked.partRequests, 11)
+        self.assertEqual(os.listdir(self.journalDir), [])
+
+        entry = self.rd.getCloudFilesManifest(title='big')['data'][0]
+        self.assertEqual(entry['checkSum'], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(self.server.store.contents[entry['content']], self.data)
+
+    def testResumeAfterFailure(self):
+        self.server.chunked.failPartsOnce.update([3, 7])
+        response = self.upload()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(os.listdir(self.journalDir)), 1)
+        self.assertEqual(self.rd.getCloudFilesManifest(title='big')['data'], [])
+
+        # Only the two rejected parts get sent again
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.chunked.partRequests, 13)
+        self.assertEqual(os.listdir(self.journalDir), [])
+
+        entry = self.rd.getCloudFilesManifest(title='big')['data'][0]
+        self.assertEqual(self.server.store.contents[entry['content']], self.data)
+
+    def testChunkedUpdate(self):
+        self.assertEqual(self.rd.uploadBlob(self.path, title='big').status_code, 200)
+        self.data = self.data[::-1]
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+        response = self.rd.updateFile(self.path, chunked=True, partSize=65536,
+                    journalDir=self.journalDir, query=dict(title='big'), data={})
+        self.assertEqual(response.status_code, 200)
+
+        entry = self.rd.getCloudFilesManifest(title='big')['data'][0]
+        self.assertEqual(entry['checkSum'], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(self.server.store.contents[entry['content']], self.data)
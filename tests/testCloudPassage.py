@@ -0,0 +1,80 @@
+import io
+import os
+import pickle
+import hashlib
+import unittest
+
+from entrails.utils import readFully, HashingWriter
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+class TestCloudPassage(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.cc = CloudPassageHandler('http://127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testPickledRoundTrip(self):
+        data = dict((i, os.urandom(i * 100)) for i in range(200))
+        self.assertEqual(self.cc.push(data, title='pickled', asPickle=True).status_code, 200)
+        self.assertEqual(self.cc.pull(metaData='pickle', title='pickled'), data)
+
+        self.cc.removeTrace(data, asPickle=True)
+        self.assertEqual(self.cc.pull(metaData='pickle', title='pickled'), None)
+
+    def testJSONRoundTrip(self):
+        data = dict((str(i), [i * 10, 'v%d'%(i)]) for i in range(5000))
+        self.assertEqual(self.cc.push(data, title='json').status_code, 200)
+        self.assertEqual(self.cc.pull(metaData='json', title='json'), data)
+
+    def testSerializedOnce(self):
+        class Counted:
+            reductions = 0
+            def __reduce__(self):
+                Counted.reductions += 1
+                return (list, ([1, 2, 3],))
+
+        self.assertEqual(self.cc.push(Counted(), title='once', asPickle=True).status_code, 200)
+        self.assertEqual(Counted.reductions, 1)
+
+        # The bytes stored are exactly the bytes that were hashed
+        record = self.cc.manifestPull(title='once')[1]
+        blob = self.server.store.contents[record['content']]
+        self.assertEqual(hashlib.sha1(blob).hexdigest(), record['checkSum'])
+        self.assertEqual(self.cc.pull(title='once'), [1, 2, 3])
+
+    def testRepushLeavesOtherBlobs(self):
+        self.server.store.create(dict(title='other', checkSum='c0ffee'), b'unrelated')
+        for i in range(2):
+            self.assertEqual(self.cc.push({'a': 1}, title='a').status_code, 200)
+
+        other = self.cc.manifestPull(title='other')[1]
+        self.assertEqual(other['checkSum'], 'c0ffee')
+        self.assertEqual(self.server.store.contents[other['content']], b'unrelated')
+        self.assertEqual(self.cc.pull(title='a'), {'a': 1})
+
+    def testUnscopedUpdateRefused(self):
+        self.server.store.create(dict(title='other'), b'unrelated')
+        rd = self.cc.addDriver('http://127.0.0.1', self.server.port)
+        self.assertEqual(rd.updateStream(io.BytesIO(b'clobber')).status_code, 400)
+        self.assertEqual(list(self.server.store.contents.values()), [b'unrelated'])
+
+class TestHashingWriter(unittest.TestCase):
+    def testTee(self):
+        sink = io.BytesIO()
+        writer = HashingWriter(hashlib.sha1(), sink)
+        data = list(range(10000))
+        pickle.dump(data, writer)
+
+        self.assertEqual(writer.hashObj.hexdigest(), hashlib.sha1(sink.getvalue()).hexdigest())
+        self.assertEqual(writer.bytesWritten, len(sink.getvalue()))
+        self.assertEqual(pickle.loads(sink.getvalue()), data)
+
+class TestReadFully(unittest.TestCase):
+    def testContentLengths(self):
+        data = os.urandom(100000)
+        for contentLength in (None, 0, 10, len(data), len(data) + 50):
+            buf = readFully(io.BytesIO(data), contentLength, chunkSize=4096)
+            self.assertEqual(bytes(buf), data)
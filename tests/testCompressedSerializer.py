@@ -0,0 +1,63 @@
+import io
+import os
+import unittest
+
+import Serializer
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+class TestCompressedSerializer(unittest.TestCase):
+    def dump(self, selector, data):
+        sink = io.BytesIO()
+        tag = selector.dump(data, sink)
+        return tag, sink.getvalue()
+
+    def testRoundTrips(self):
+        data = dict((str(i), [i] * 20) for i in range(3000))
+        for codec in sorted(Serializer.CODECS):
+            for inner, innerTag in ((Serializer.JSONSerializer(), 'json'),
+                                    (Serializer.BinarySerializer(), 'pickle')):
+                selector = Serializer.CompressedSerializer(inner, innerTag, codec, 1)
+                tag, blob = self.dump(selector, data)
+                self.assertEqual(tag, '%s+%s'%(innerTag, codec))
+
+                raw = self.dump(inner, data)[1]
+                self.assertLess(len(blob) * 5, len(raw))
+                self.assertEqual(selector.load(io.BytesIO(blob)), data)
+
+    def testDeterministic(self):
+        selector = Serializer.CompressedSerializer(Serializer.JSONSerializer(), 'json', 'gzip')
+        data = ['row'] * 5000
+        self.assertEqual(self.dump(selector, data), self.dump(selector, data))
+
+    def testSkipped(self):
+        inner = Serializer.BinarySerializer()
+        selector = Serializer.CompressedSerializer(inner, 'pickle', 'zlib')
+        for data in ([1, 2, 3], os.urandom(100000)):
+            tag, blob = self.dump(selector, data)
+            self.assertEqual(tag, 'pickle')
+            self.assertEqual(blob, self.dump(inner, data)[1])
+
+    def testSplitTag(self):
+        self.assertEqual(Serializer.splitTag('pickle+lzma'), ('pickle', 'lzma'))
+        self.assertEqual(Serializer.splitTag('json'), ('json', None))
+
+class TestCompressedPassage(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.cc = CloudPassageHandler('http://127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testPushPull(self):
+        data = [dict(id=i, name='row', values=[0.5] * 10) for i in range(2000)]
+        self.cc.push(data, title='table', compression='lzma')
+
+        status, record = self.cc.manifestPull(title='table')
+        self.assertEqual(record['metaData'], 'json+lzma')
+        self.assertLess(record['size'] * 10, len(Serializer.JSONSerializer().serialize(data)))
+        self.assertEqual(self.cc.pull(title='table'), data)
+
+        self.cc.removeTrace(data, compression='lzma')
+        self.assertEqual(self.cc.pull(title='table'), None)
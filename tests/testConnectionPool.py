@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.connectionPool import ConnectionPool
+from entrails.standInServer import StandInServer
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpDir)
+
+    def testSharedAcrossLiasonsAndBlobs(self):
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        for name in ('Job', 'Worker', 'Song'):
+            rd.registerLiason(name, '/%sHandler'%(name.lower()))
+
+        rd.newJob(name='a')
+        rd.getWorkers()
+        rd.deleteSongs(title='x')
+        path = os.path.join(self.tmpDir, 'blob')
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        rd.uploadBlob(path, title='blob')
+        rd.getCloudFilesManifest()
+
+        stats = rd.connectionStats()
+        self.assertEqual(stats['hostPools'], 1)
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['newConnections'], 1)
+        self.assertEqual(stats['reusedConnections'], 4)
+
+    def testHeadersStayPerLiason(self):
+        pool = ConnectionPool()
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port, connectionPool=pool)
+        job = rd.registerLiason('Job', '/jobHandler')
+        rd.registerLiason('Worker', '/workerHandler')
+        job.handler._updateHeaders({'X-Token': 'secret'})
+
+        self.assertEqual(rd.getConnectionPool() is pool, True)
+        self.assertEqual('X-Token' in pool.headers, False)
+
+    def testTunables(self):
+        pool = ConnectionPool(poolSize=4, keepAlive=False, connectTimeout=2, readTimeout=5)
+        self.assertEqual(pool.timeout, (2, 5))
+        pool.setPoolSize(2)
+        self.assertEqual(pool.poolSize, 4)
+        pool.setPoolSize(16)
+        self.assertEqual(pool.poolSize, 16)
+
+        for i in range(3):
+            pool.get(self.server.baseUrl + '/uploader')
+        stats = pool.stats()
+        self.assertEqual((stats['newConnections'], stats['reusedConnections']), (3, 0))
+
+    def testGrowingClosesReplacedAdapter(self):
+        pool = ConnectionPool()
+        pool.get(self.server.baseUrl + '/uploader')
+        adapter = pool.get_adapter(self.server.baseUrl)
+        self.assertEqual(pool.concurrencyFor(32), 32)
+
+        self.assertIsNot(pool.get_adapter(self.server.baseUrl), adapter)
+        self.assertEqual(len(adapter.poolmanager.pools), 0)
+        self.assertEqual(pool.stats()['hostPools'], 1)
+
+    def testExplicitSizeCapsOperations(self):
+        pool = ConnectionPool(poolSize=2)
+        self.assertEqual((pool.concurrencyFor(8), pool.poolSize), (2, 2))
+        self.assertEqual(ConnectionPool(blockWhenFull=True).concurrencyFor(64),
+                                                        ConnectionPool().poolSize)
+
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port, connectionPool=pool)
+        rd.registerLiason('Job', '/jobHandler')
+        rd.newJobsBulk([dict(name='j%d'%(i)) for i in range(10)], concurrency=8)
+        for i in range(4):
+            with open(os.path.join(self.tmpDir, 'f%d'%(i)), 'wb') as f:
+                f.write(os.urandom(100))
+        self.assertEqual(rd.uploadTree(self.tmpDir, workers=8)['uploaded'], 4)
+        self.assertEqual(pool.poolSize, 2)
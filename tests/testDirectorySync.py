@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.standInServer import StandInServer
+
+class TestDirectorySync(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        self.src = tempfile.mkdtemp()
+        self.dst = tempfile.mkdtemp()
+        self.files = {'a.txt': b'a' * 100, 'sub/b.bin': os.urandom(5000), 'sub/deep/c': b'c'}
+        for name, data in self.files.items():
+            self.write(self.src, name, data)
+
+    def tearDown(self):
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+        self.server.stop()
+
+    def write(self, root, name, data):
+        path = os.path.join(root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, root, name):
+        with open(os.path.join(root, *name.split('/')), 'rb') as f:
+            return f.read()
+
+    def remoteTitles(self):
+        return sorted(e['title'] for e in self.rd.iterCloudFilesManifest())
+
+    def testPush(self):
+        dry = self.rd.syncDirectory(self.src, dryRun=True)
+        self.assertEqual((dry['upload'], dry['bytesTransferred']), (3, 5101))
+        self.assertEqual(self.remoteTitles(), [])
+
+        summary = self.rd.syncDirectory(self.src)
+        self.assertEqual((summary['upload'], summary['failed']), (3, 0))
+        self.assertEqual(self.remoteTitles(), sorted(self.files))
+
+        summary = self.rd.syncDirectory(self.src)
+        self.assertEqual((summary['skip'], summary['bytesTransferred'], summary['bytesSkipped']),
+                                                                            (3, 0, 5101))
+
+        self.write(self.src, 'a.txt', b'b' * 100) # Same size, different content
+        self.write(self.src, 'sub/deep/c', b'cc')
+        self.write(self.src, 'new', b'n')
+        summary = self.rd.syncDirectory(self.src)
+        self.assertEqual((summary['update'], summary['upload'], summary['skip']), (2, 1, 1))
+        self.assertEqual(summary['results']['a.txt']['action'], 'update')
+
+        entry = self.rd.getCloudFilesManifest(title='a.txt')['data'][0]
+        self.assertEqual(self.server.store.contents[entry['content']], b'b' * 100)
+        self.assertEqual(len(self.rd.getCloudFilesManifest()['data']), 4)
+
+    def testOrphans(self):
+        self.rd.syncDirectory(self.src, prefix='build/')
+        self.server.store.create(dict(title='other'), b'keep')
+        os.remove(os.path.join(self.src, 'a.txt'))
+
+        self.assertRaises(ValueError, self.rd.syncDirectory, self.src, deleteOrphans=True)
+
+        summary = self.rd.syncDirectory(self.src, prefix='build/', deleteOrphans=True)
+        self.assertEqual((summary['deleteRemote'], summary['skip']), (1, 2))
+        self.assertEqual(self.remoteTitles(), ['build/sub/b.bin', 'build/sub/deep/c', 'other'])
+
+    def testPull(self):
+        self.rd.syncDirectory(self.src)
+        summary = self.rd.syncDirectory(self.dst, direction='pull')
+        self.assertEqual((summary['download'], summary['bytesTransferred']), (3, 5101))
+        for name, data in self.files.items():
+            self.assertEqual(self.read(self.dst, name), data)
+
+        self.write(self.dst, 'sub/b.bin', b'local change')
+        self.write(self.dst, 'stray', b's')
+        summary = self.rd.syncDirectory(self.dst, direction='pull', deleteOrphans=True)
+        self.assertEqual((summary['download'], summary['skip'], summary['deleteLocal']), (1, 2, 1))
+        self.assertEqual(self.read(self.dst, 'sub/b.bin'), self.files['sub/b.bin'])
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'stray')))
+
+    def testPullRejectsEscapingTitles(self):
+        self.server.store.create(dict(title='../escape', size=1), b'x')
+        summary = self.rd.syncDirectory(self.dst, direction='pull')
+        self.assertEqual(summary['results']['../escape']['action'], 'skip')
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.dst), 'escape')))
+
+    def testFailedDownload(self):
+        self.rd.syncDirectory(self.src)
+        entry = self.rd.getCloudFilesManifest(title='a.txt')['data'][0]
+        del self.server.store.contents[entry['content']]
+
+        summary = self.rd.syncDirectory(self.dst, direction='pull')
+        self.assertEqual((summary['download'], summary['failed']), (2, 1))
+        self.assertIn('failed', summary['results']['a.txt']['reason'])
+        self.assertEqual(sorted(os.listdir(self.dst)), ['sub'])
@@ -0,0 +1,41 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import restDriver
+
+class TestFileCheckSums(unittest.TestCase):
+    def setUp(self):
+        self.rd = restDriver.RestDriver(None, None)
+        self.tmpDir = tempfile.mkdtemp()
+        self.contents = dict()
+        for i in range(12):
+            path = os.path.join(self.tmpDir, 'f%d'%(i))
+            data = os.urandom(i * 100003)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.contents[path] = data
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testBatchMatchesSerial(self):
+        paths = sorted(self.contents)
+        missing = os.path.join(self.tmpDir, 'missing')
+        checkSums = self.rd.getFileCheckSums(paths + [missing, self.tmpDir], workers=4)
+
+        self.assertEqual(checkSums[missing], None)
+        self.assertEqual(checkSums[self.tmpDir], None)
+        for path in paths:
+            self.assertEqual(checkSums[path], hashlib.sha1(self.contents[path]).hexdigest())
+            self.assertEqual(checkSums[path], self.rd.getFileCheckSum(path))
+
+    def testAlgoName(self):
+        checkSums = self.rd.getFileCheckSums(self.contents, algoName='md5')
+        for path, data in self.contents.items():
+            self.assertEqual(checkSums[path], hashlib.md5(data).hexdigest())
+
+    def testEmpty(self):
+        self.assertEqual(self.rd.getFileCheckSums([]), {})
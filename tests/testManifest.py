@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.manifest import Manifest, ManifestEntry
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.manifest = Manifest.fromResponse(dict(status_code=200, data=[
+            dict(id=i, title='t%d'%(i % 3), checkSum='c%d'%(i), size=i,
+                    content='documents/%d'%(i), author='me') for i in range(9)
+        ]))
+
+    def testLookups(self):
+        self.assertEqual(len(self.manifest), 9)
+        self.assertTrue(self.manifest.hasCheckSum('c4'))
+        self.assertFalse(self.manifest.hasCheckSum('c9'))
+        self.assertEqual([e.id for e in self.manifest.byTitle('t1')], [1, 4, 7])
+        self.assertEqual(self.manifest.byContent('documents/5').checkSum, 'c5')
+        self.assertEqual([e.id for e in self.manifest.find(title='t2', size='5')], [5])
+        self.assertEqual(self.manifest.first(id='3').asDict(), dict(id=3, title='t0',
+                checkSum='c3', size=3, content='documents/3', author='me'))
+        self.assertEqual(len(self.manifest.find(author='me')), 9)
+        self.assertIsNone(self.manifest.first(title='t1', checkSum='c0'))
+
+    def testIncremental(self):
+        self.manifest.add(dict(id=3, title='new', checkSum='n3', content='documents/3'))
+        self.assertEqual(len(self.manifest), 9)
+        self.assertFalse(self.manifest.hasCheckSum('c3'))
+        self.assertEqual(self.manifest.byTitle('new')[0].id, 3)
+
+        self.assertEqual(self.manifest.update(dict(title='t1'), dict(checkSum='same')), 3)
+        self.assertEqual(len(self.manifest.byCheckSum('same')), 3)
+        self.assertFalse(self.manifest.hasCheckSum('c4'))
+
+        self.assertEqual(self.manifest.remove(checkSum='same'), 3)
+        self.assertEqual(len(self.manifest), 6)
+        self.assertEqual(self.manifest.byTitle('t1'), [])
+
+        entry = self.manifest.add(ManifestEntry(checkSum='x'))
+        self.manifest.discard(entry)
+        self.assertFalse(self.manifest.hasCheckSum('x'))
+
+class TestLocalManifest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        self.tmpDir = tempfile.mkdtemp()
+        for i in range(5):
+            self.server.store.create(dict(title='old%d'%(i), checkSum='c%d'%(i)), b'x')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path
+
+    def testTracksOwnChanges(self):
+        manifest = self.rd.enableLocalManifest(pageSize=2)
+        self.assertEqual(len(manifest), 5)
+
+        self.rd.uploadBlob(self.write('a', b'aaa'), title='a')
+        entry = manifest.byTitle('a')[0]
+        self.assertEqual(self.server.store.contents[entry.content], b'aaa')
+
+        self.rd.uploadBlob(self.write('b', b'b' * 300000), title='b', chunked=True,
+                                            partSize=65536, journalDir=self.tmpDir)
+        self.assertEqual(manifest.byTitle('b')[0].size, 300000)
+
+        self.rd.updateFile(self.write('a2', b'aaaa'), query=dict(title='a'))
+        self.assertEqual(manifest.byTitle('a')[0].size, 4)
+
+        self.rd.deleteBlob(title='old1')
+        self.assertEqual(manifest.byTitle('old1'), [])
+        self.assertEqual(len(manifest), 6)
+
+        fresh = self.rd.loadCloudFilesManifest()
+        self.assertEqual(sorted(e.checkSum for e in fresh), sorted(e.checkSum for e in manifest))
+
+    def testUploadTreeDedupsLocally(self):
+        self.rd.enableLocalManifest()
+        for name in ('x', 'y', 'z'):
+            self.write(name, b'same')
+
+        self.server.store.manifestRequests = 0
+        summary = self.rd.uploadTree(self.tmpDir)
+        self.assertEqual((summary['uploaded'], summary['skipped']), (1, 2))
+        self.assertEqual(self.server.store.manifestRequests, 0)
+
+        summary = self.rd.uploadTree(self.tmpDir)
+        self.assertEqual((summary['uploaded'], summary['skipped']), (0, 3))
+
+    def testPassagePullsLocally(self):
+        cc = CloudPassageHandler('http://127.0.0.1', self.server.port)
+        cc.enableLocalManifest()
+        cc.push([1, 2, 3], title='list')
+
+        self.server.store.manifestRequests = 0
+        self.assertEqual(cc.pull(title='list'), [1, 2, 3])
+        self.assertEqual(cc.pull(title='missing'), None)
+        self.assertEqual(self.server.store.manifestRequests, 0)
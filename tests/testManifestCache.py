@@ -0,0 +1,80 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.manifestCache import ManifestCache, normalizeQuery
+from entrails.standInServer import StandInServer
+
+class TestManifestCacheUnit(unittest.TestCase):
+    def testNormalizeQuery(self):
+        self.assertEqual(normalizeQuery(dict(a=1, b='x')), normalizeQuery(dict(b='x', a='1')))
+        self.assertNotEqual(normalizeQuery(dict(a=1)), normalizeQuery(dict(a=2)))
+
+    def testStaleGenerationIsNotStored(self):
+        cache = ManifestCache(ttl=60)
+        generation = cache.generation()
+        cache.invalidate()
+        cache.store(('k',), dict(data=[]), generation=generation)
+        self.assertEqual(cache.lookup(('k',)), (None, False))
+
+class TestCachedManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpDir)
+
+    def upload(self, title):
+        path = os.path.join(self.tmpDir, title)
+        with open(path, 'wb') as f:
+            f.write(title.encode('utf-8'))
+        return self.rd.uploadBlob(path, title=title)
+
+    def testFreshHits(self):
+        cache = self.rd.enableManifestCache(ttl=60)
+        self.upload('a')
+
+        first = self.rd.getCloudFilesManifest(title='a')
+        first['data'][0]['title'] = 'mutated'
+        second = self.rd.getCloudFilesManifest(title='a')
+
+        self.assertEqual(second['data'][0]['title'], 'a')
+        self.assertEqual(self.server.store.manifestRequests, 1)
+        self.assertEqual((cache.stats()['misses'], cache.stats()['hits']), (1, 1))
+
+    def testRevalidation(self):
+        cache = self.rd.enableManifestCache(ttl=0)
+        self.upload('a')
+
+        self.rd.getCloudFilesManifest(title='a')
+        time.sleep(0.01)
+        manifest = self.rd.getCloudFilesManifest(title='a')
+
+        self.assertEqual(manifest['data'][0]['title'], 'a')
+        self.assertEqual(self.server.store.manifestRequests, 2)
+        self.assertEqual(cache.stats()['revalidations'], 1)
+
+    def testInvalidatedByOwnChanges(self):
+        self.rd.enableManifestCache(ttl=60)
+        self.upload('a')
+        self.assertEqual(len(self.rd.getCloudFilesManifest()['data']), 1)
+
+        self.upload('b')
+        self.assertEqual(len(self.rd.getCloudFilesManifest()['data']), 2)
+
+        self.rd.deleteBlob(title='a')
+        self.assertEqual(len(self.rd.getCloudFilesManifest()['data']), 1)
+        self.assertEqual(self.server.store.manifestRequests, 3)
+
+    def testDisabled(self):
+        self.upload('a')
+        self.rd.getCloudFilesManifest()
+        self.rd.getCloudFilesManifest()
+        self.assertEqual(self.rd.getManifestCache(), None)
+        self.assertEqual(self.server.store.manifestRequests, 2)
@@ -0,0 +1,52 @@
+import unittest
+
+import restDriver
+from entrails.utils import ManifestPageException
+from entrails.standInServer import StandInServer
+
+class TestManifestPages(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        for i in range(25):
+            self.server.store.create(dict(title='t%d'%(i), kind=str(i % 2)), b'x')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testPagesInOrder(self):
+        for pageSize, requests in ((10, 3), (5, 6), (25, 2), (100, 1)):
+            self.server.store.manifestRequests = 0
+            titles = [e['title'] for e in self.rd.iterCloudFilesManifest(pageSize=pageSize)]
+            self.assertEqual(titles, ['t%d'%(i) for i in range(25)])
+            self.assertEqual(self.server.store.manifestRequests, requests)
+
+    def testQuery(self):
+        titles = [e['title'] for e in self.rd.iterCloudFilesManifest(pageSize=4, kind='1')]
+        self.assertEqual(titles, ['t%d'%(i) for i in range(1, 25, 2)])
+
+        entries = list(self.rd.iterCloudFilesManifest(pageSize=4, title='missing'))
+        self.assertEqual(entries, [])
+
+    def testLazy(self):
+        entries = self.rd.iterCloudFilesManifest(pageSize=10)
+        self.assertEqual(self.server.store.manifestRequests, 0)
+
+        self.assertEqual(next(entries)['title'], 't0')
+        entries.close()
+        self.assertLessEqual(self.server.store.manifestRequests, 2)
+
+    def testServerIgnoringPaging(self):
+        select = self.server.store.select
+        def selectAll(query):
+            return select(dict((k, v) for k, v in query.items() if k not in ('limit', 'offset')))
+
+        self.server.store.select = selectAll
+        for pageSize in (25, 100):
+            titles = [e['title'] for e in self.rd.iterCloudFilesManifest(pageSize=pageSize)]
+            self.assertEqual(titles, ['t%d'%(i) for i in range(25)])
+
+    def testFailedPage(self):
+        self.server.stop()
+        self.assertRaises(ManifestPageException, list, self.rd.iterCloudFilesManifest())
+        self.server = StandInServer().start()
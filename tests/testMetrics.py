@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.metrics import MetricsRegistry, Sample
+from entrails.standInServer import StandInServer
+
+class TestMetricsRegistry(unittest.TestCase):
+    def testHistogram(self):
+        registry = MetricsRegistry(buckets=(0.1, 1))
+        op = registry.track('Job', 'get').op
+        for seconds in (0.05, 0.05, 0.5, 5):
+            registry.started(op)
+            sample = Sample()
+            sample.status = 200
+            registry.finished(op, seconds, sample)
+
+        stats = registry.snapshot()['Job']['get']
+        self.assertEqual(stats['buckets'], [(0.1, 2), (1, 1), ('+Inf', 1)])
+        self.assertEqual((stats['count'], stats['inFlight'], stats['statuses']), (4, 0, {200: 4}))
+        self.assertEqual((stats['p50'], stats['p95']), (0.1, 5))
+
+    def testErrorsAndExporters(self):
+        registry = MetricsRegistry()
+        exported = []
+        registry.addExporter(exported.append)
+        registry.addExporter(lambda snapshot: 1 / 0) # Mustn't break the others
+
+        with self.assertRaises(ValueError):
+            with registry.track('blobs', 'upload'):
+                raise ValueError('boom')
+
+        registry.export()
+        self.assertEqual(exported[0]['blobs']['upload']['errors'], 1)
+
+class TestDriverMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpDir)
+
+    def testLiasonsAndBlobs(self):
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        rd.registerLiason('Job', '/jobHandler')
+        rd.newJob(name='a')
+        rd.getJobs()
+        rd.getJobs(name='a')
+
+        data = os.urandom(5000)
+        path = os.path.join(self.tmpDir, 'src')
+        with open(path, 'wb') as f:
+            f.write(data)
+        rd.uploadBlob(path, title='src')
+        content = rd.getCloudFilesManifest(title='src')['data'][0]['content']
+        rd.downloadBlob(content, altName=os.path.join(self.tmpDir, 'dst'))
+
+        snapshot = rd.metrics()
+        self.assertEqual(snapshot['Job']['get']['count'], 2)
+        self.assertEqual(snapshot['Job']['post']['statuses'], {200: 1})
+        self.assertGreater(snapshot['Job']['post']['bytesSent'], 0)
+
+        blobs = snapshot['blobs']
+        self.assertGreater(blobs['upload']['bytesSent'], len(data))
+        self.assertEqual(blobs['download']['bytesReceived'], len(data))
+        self.assertEqual(blobs['manifest']['count'], 1)
+        self.assertEqual(blobs['manifest']['inFlight'], 0)
+
+    def testStreamedDownloads(self):
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        data = os.urandom(70000)
+        content = self.server.store.create(dict(title='src'), data)['content']
+
+        self.assertEqual(b''.join(rd.downloadBlobToStream(content)), data)
+        reader = rd.openBlobStream(content)
+        self.assertEqual(reader.read(), data)
+        self.assertEqual(rd.metrics()['blobs']['download']['inFlight'], 1)
+        reader.close()
+        self.assertEqual(rd.downloadBlobToStream('documents/missing'), None)
+
+        download = rd.metrics()['blobs']['download']
+        self.assertEqual((download['count'], download['errors'], download['inFlight']), (3, 1, 0))
+        self.assertEqual(download['bytesReceived'], 2 * len(data))
+        self.assertEqual(download['statuses'], {200: 2})
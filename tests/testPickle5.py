@@ -0,0 +1,78 @@
+import io
+import os
+import array
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import Serializer
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+@unittest.skipIf(not Serializer.HAS_PICKLE5, 'pickle protocol 5 requires Python 3.8+')
+class TestPickle5Serializer(unittest.TestCase):
+    def setUp(self):
+        self.selector = Serializer.Pickle5Serializer()
+        self.data = dict(
+            blob=os.urandom(200000), scratch=bytearray(os.urandom(100000)),
+            small=b'tiny', floats=pickle.PickleBuffer(array.array('d', range(50000))),
+        )
+
+    def checkLoaded(self, loaded):
+        self.assertEqual(loaded['blob'], self.data['blob'])
+        self.assertEqual(type(loaded['blob']), bytes)
+        self.assertEqual(loaded['scratch'], self.data['scratch'])
+        self.assertEqual(type(loaded['scratch']), bytearray)
+        self.assertEqual(loaded['small'], b'tiny')
+        self.assertEqual(bytes(loaded['floats']), bytes(self.data['floats'].raw()))
+
+    def testFraming(self):
+        blob = self.selector.serialize(self.data)
+        # The large buffers come after the pickle stream, untouched
+        tail = self.data['blob'] + self.data['scratch'] + bytes(self.data['floats'].raw())
+        self.assertTrue(blob.endswith(tail))
+        self.assertLess(len(blob), len(tail) + 1000)
+        self.checkLoaded(self.selector.deserialize(blob))
+
+    def testLargeBytesFound(self):
+        self.assertTrue(Serializer.hasLargeBytes(self.data, 65536))
+        self.assertTrue(Serializer.hasLargeBytes([1, (2, {'k': self.data['blob']})], 65536))
+        self.assertFalse(Serializer.hasLargeBytes([b'tiny', 'x' * 100000], 65536))
+        cyclic = []
+        cyclic.append(cyclic)
+        self.assertFalse(Serializer.hasLargeBytes(cyclic, 65536))
+
+        # Without large bytes the plain pickle stream is all there is
+        rows = [dict(id=i, name='row%d'%(i)) for i in range(1000)]
+        blob = self.selector.serialize(rows)
+        self.assertEqual(Serializer.pickle5Header.unpack(blob[:Serializer.pickle5Header.size])[1], 0)
+        self.assertEqual(self.selector.deserialize(blob), rows)
+
+    def testMappedLoad(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpDir, 'blob')
+            with open(path, 'wb') as f:
+                self.selector.dump(self.data, f)
+            with open(path, 'rb') as f:
+                loaded = self.selector.load(f)
+            self.checkLoaded(loaded)
+            # Out-of-band buffers map the file rather than being read into memory
+            self.assertEqual(type(loaded['floats']), memoryview)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testTruncated(self):
+        blob = self.selector.serialize(self.data)
+        self.assertRaises(pickle.UnpicklingError, self.selector.load, io.BytesIO(blob[:-10]))
+
+    def testPushPull(self):
+        server = StandInServer().start()
+        try:
+            cc = CloudPassageHandler('http://127.0.0.1', server.port)
+            cc.push(self.data, title='arrays', outOfBand=True)
+            self.assertEqual(cc.manifestPull(title='arrays')[1]['metaData'], 'pickle5')
+            self.checkLoaded(cc.pull(title='arrays'))
+        finally:
+            server.stop()
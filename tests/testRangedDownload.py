@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.standInServer import StandInServer, StandInHandler
+from entrails.fileOnCloudHandler import adaptiveChunkSize
+
+def flipFirstByte(blob):
+    return bytes([blob[0] ^ 0xff]) + blob[1:] if blob else blob
+
+class CorruptRangesHandler(StandInHandler):
+    # Serves bad bytes for Range requests only
+    def sendMedia(self, blob):
+        if self.headers.get('Range', None):
+            blob = flipFirstByte(blob)
+        return StandInHandler.sendMedia(self, blob)
+
+class CorruptMediaHandler(StandInHandler):
+    # Serves bad bytes for every download
+    def sendMedia(self, blob):
+        return StandInHandler.sendMedia(self, flipFirstByte(blob))
+
+class TestRangedDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.data = os.urandom(5 * 40000 + 17)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def download(self, supportsRanges=True, corrupt=False, handlerClass=StandInHandler, **kwargs):
+        with StandInServer(supportsRanges=supportsRanges, handlerClass=handlerClass) as server:
+            rd = restDriver.RestDriver('http://127.0.0.1', server.port)
+            srcPath = os.path.join(self.tmpDir, 'src.bin')
+            with open(srcPath, 'wb') as f:
+                f.write(self.data)
+            self.assertEqual(rd.uploadBlob(srcPath, title='src').status_code, 200)
+
+            entry = rd.getCloudFilesManifest(title='src')['data'][0]
+            if corrupt:
+                server.store.records[entry['id']]['checkSum'] = 'bogus'
+
+            dstPath = os.path.join(self.tmpDir, 'dst.bin')
+            kwargs.setdefault('workers', 4)
+            written = rd.downloadBlob(entry['content'], altName=dstPath,
+                                        rangeSize=40000, **kwargs)
+            if not os.path.exists(dstPath):
+                return written, None
+            with open(dstPath, 'rb') as f:
+                return written, f.read()
+
+    def testParallelRanges(self):
+        written, data = self.download()
+        self.assertEqual(written, len(self.data))
+        self.assertEqual(data, self.data)
+
+    def testFallbackWithoutRangeSupport(self):
+        written, data = self.download(supportsRanges=False)
+        self.assertEqual(written, len(self.data))
+        self.assertEqual(data, self.data)
+
+    def testFallbackOnCheckSumMismatch(self):
+        written, data = self.download(handlerClass=CorruptRangesHandler)
+        self.assertEqual(written, len(self.data))
+        self.assertEqual(data, self.data)
+
+    def testFallbackIsVerified(self):
+        written, data = self.download(handlerClass=CorruptMediaHandler)
+        self.assertEqual(written, 0)
+        self.assertIsNone(data)
+
+    def testFallbackAgainstBadManifestCheckSum(self):
+        written, data = self.download(corrupt=True)
+        self.assertEqual(written, 0)
+        self.assertIsNone(data)
+
+    def testSingleStreamWithFsync(self):
+        written, data = self.download(workers=1, fsync=True)
+        self.assertEqual(written, len(self.data))
+        self.assertEqual(data, self.data)
+
+    def testAdaptiveChunkSize(self):
+        self.assertEqual(adaptiveChunkSize(None), 1024 * 1024)
+        self.assertEqual(adaptiveChunkSize('10'), 64 * 1024)
+        self.assertEqual(adaptiveChunkSize(1 << 40), 1024 * 1024)
+        self.assertEqual(adaptiveChunkSize(8 << 20), 512 * 1024)
@@ -0,0 +1,124 @@
+import time
+import threading
+import unittest
+
+import requests
+
+import restDriver
+from entrails.requestPolicy import RequestPolicy, CircuitBreaker, CircuitOpenError
+from entrails.standInServer import StandInServer, StandInHandler
+
+class FlakyHandler(StandInHandler):
+    # Class level knobs: the next failures GETs answer 503, the next stalls sleep
+    lock = threading.Lock()
+    failures = 0
+    stalls = 0
+    stallSeconds = 1.0
+    gets = 0
+
+    def do_GET(self):
+        cls = FlakyHandler
+        with cls.lock:
+            cls.gets += 1
+            fail, stall = cls.failures > 0, cls.stalls > 0
+            cls.failures -= fail
+            cls.stalls -= stall
+
+        if fail:
+            return self.sendJSON(503, dict(reason='Unavailable'))
+        if stall:
+            time.sleep(cls.stallSeconds)
+
+        StandInHandler.do_GET(self)
+
+class TestRequestPolicy(unittest.TestCase):
+    def setUp(self):
+        FlakyHandler.failures = FlakyHandler.stalls = FlakyHandler.gets = 0
+        self.server = StandInServer(handlerClass=FlakyHandler).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def driver(self, **policyKwargs):
+        self.policy = RequestPolicy(backoffBase=0.001, **policyKwargs)
+        return restDriver.RestDriver('http://127.0.0.1', self.server.port, requestPolicy=self.policy)
+
+    def testRetriesSafeMethods(self):
+        rd = self.driver(maxRetries=3)
+        FlakyHandler.failures = 2
+        manifest = rd.getCloudFilesManifest()
+        self.assertEqual(manifest['status_code'], 200)
+        self.assertEqual((FlakyHandler.gets, self.policy.retries), (3, 2))
+
+        FlakyHandler.failures = 5
+        self.assertEqual(rd.getCloudFilesManifest()['status_code'], 503)
+
+    def testCircuitBreaker(self):
+        rd = self.driver(maxRetries=0, failureThreshold=2, resetTimeout=60)
+        FlakyHandler.failures = 2
+        rd.getCloudFilesManifest()
+        rd.getCloudFilesManifest()
+
+        gets = FlakyHandler.gets
+        self.assertRaises(CircuitOpenError, rd.getConnectionPool().get, self.server.baseUrl + '/uploader')
+        self.assertEqual(FlakyHandler.gets, gets)
+        self.assertEqual(self.policy.rejections, 1)
+
+    def testHalfOpen(self):
+        breaker = CircuitBreaker(failureThreshold=1, resetTimeout=0.05)
+        breaker.failure()
+        self.assertEqual((breaker.state, breaker.allow()), (CircuitBreaker.OPEN, False))
+        time.sleep(0.06)
+        self.assertEqual((breaker.allow(), breaker.allow()), (True, False))
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def testHedgedGet(self):
+        rd = self.driver(hedge=True, hedgeAfter=0.05)
+        FlakyHandler.stalls = 1
+        startTime = time.perf_counter()
+        self.assertEqual(rd.getCloudFilesManifest()['status_code'], 200)
+        self.assertLess(time.perf_counter() - startTime, FlakyHandler.stallSeconds)
+        self.assertEqual((self.policy.hedges, self.policy.hedgeWins), (1, 1))
+
+    def testNoHedgesWhenHealthy(self):
+        # More concurrent GETs than hedge workers, all answering within hedgeAfter
+        rd = self.driver(hedge=True, hedgeAfter=0.5, hedgeWorkers=2)
+        FlakyHandler.stalls, FlakyHandler.stallSeconds = 16, 0.2
+        try:
+            threads = [threading.Thread(target=rd.getCloudFilesManifest) for i in range(16)]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+        finally:
+            FlakyHandler.stallSeconds = 1.0
+
+        self.assertEqual(FlakyHandler.gets, 16)
+        self.assertEqual(self.policy.hedges, 0)
+
+    def testTrialReleasedOnUnexpectedError(self):
+        policy = RequestPolicy(failureThreshold=1, resetTimeout=0.05)
+        breaker = policy.breakerFor('host')
+        breaker.failure()
+        time.sleep(0.06)
+
+        def boom(**kwargs):
+            raise ValueError('unexpected')
+
+        self.assertRaises(ValueError, policy.execute, 'POST', 'http://host/', boom)
+        self.assertTrue(breaker.allow())
+
+    def testCircuitOpenKeepsLastError(self):
+        policy = RequestPolicy(maxRetries=2, backoffBase=0.001, failureThreshold=1, resetTimeout=60)
+
+        def refuse(**kwargs):
+            raise requests.exceptions.ConnectionError('refused')
+
+        with self.assertRaises(CircuitOpenError) as context:
+            policy.execute('GET', 'http://host/', refuse)
+        self.assertIsInstance(context.exception.__cause__, requests.exceptions.ConnectionError)
+
+    def testTimeout(self):
+        rd = self.driver(readTimeout=0.1, maxRetries=0)
+        FlakyHandler.stalls = 1
+        self.assertRaises(requests.exceptions.Timeout,
+                        rd.getConnectionPool().get, self.server.baseUrl + '/uploader')
@@ -0,0 +1,111 @@
+import io
+import unittest
+
+import Serializer
+from entrails.standInServer import StandInServer
+from entrails.cloudPassage import CloudPassageHandler
+
+class TestSerializerRegistry(unittest.TestCase):
+    def testBuiltins(self):
+        data = dict(name='row', values=[1, 2.5, None, True], nested=dict(k='v'))
+        for tag in ('json', 'json-compact', 'pickle', 'marshal'):
+            serializer = Serializer.getSerializer(tag)
+            sink = io.BytesIO()
+            serializer.dump(data, sink)
+            sink.seek(0)
+            self.assertEqual(serializer.load(sink), data)
+
+        compact = Serializer.getSerializer('json-compact').serialize(data)
+        self.assertNotIn(', ', compact)
+
+    def testCompressedTags(self):
+        self.assertIsInstance(Serializer.getSerializer('marshal+zlib'), Serializer.CompressedSerializer)
+        self.assertEqual(Serializer.getSerializer('marshal+nope'), None)
+        self.assertEqual(Serializer.getSerializer('nope'), None)
+
+    def testRegister(self):
+        self.assertRaises(ValueError, Serializer.registerSerializer, 'a+b', Serializer.JSONSerializer())
+        Serializer.registerSerializer('test-json', Serializer.JSONSerializer())
+        try:
+            self.assertIn('test-json', Serializer.availableSerializers())
+        finally:
+            Serializer.SERIALIZERS.pop('test-json')
+
+    def testPickFastest(self):
+        tag, timings = Serializer.pickFastestSerializer(dict(a=[1, 2, 3]), repeat=1)
+        self.assertIn(tag, timings)
+        self.assertEqual(timings[tag], min(timings.values()))
+
+        # json can't round trip tuples nor marshal arbitrary objects
+        tag, timings = Serializer.pickFastestSerializer((1, 2), tags=['json', 'marshal'])
+        self.assertEqual((tag, list(timings)), ('marshal', ['marshal']))
+        tag, timings = Serializer.pickFastestSerializer(object(), tags=['json', 'marshal'])
+        self.assertEqual((tag, timings), (None, {}))
+
+    def testAutoCachedPerShape(self):
+        calls = []
+        pickFastest = Serializer.pickFastestSerializer
+        def counted(data, tags=None, repeat=3):
+            calls.append((len(data), tags))
+            return pickFastest(data, tags, repeat)
+
+        Serializer.pickFastestSerializer = counted
+        Serializer.AUTO_CHOICES.clear()
+        try:
+            rows = [dict(id=i, name='row%d'%(i)) for i in range(1000)]
+            tag = Serializer.autoSerializer(rows)
+            self.assertEqual(Serializer.autoSerializer(rows[:500]), tag)
+            Serializer.autoSerializer((1, 2))
+        finally:
+            Serializer.pickFastestSerializer = pickFastest
+            Serializer.AUTO_CHOICES.clear()
+
+        self.assertEqual([size for size, tags in calls], [Serializer.AUTO_SAMPLE_SIZE, 2])
+        self.assertNotIn('marshal', calls[0][1])
+        self.assertNotEqual(tag, 'marshal')
+
+    def testAutoNeverLossy(self):
+        Serializer.AUTO_CHOICES.clear()
+        try:
+            for data in ([{'k': 'v'}] * 10, [{'k': (1, 2)}] * 10,
+                    dict(('k%d'%(i), i) for i in range(100)),
+                    dict([('k%d'%(i), i) for i in range(100)] + [(1, 'int key')])):
+                tag = Serializer.autoSerializer(data)
+                self.assertTrue(Serializer.roundTrips(Serializer.getSerializer(tag), data), tag)
+
+            # Past the sample, a tuple would otherwise come back as a list
+            rows = [dict(k='v') for i in range(100)] + [dict(k=(1, 2))]
+            tag = Serializer.autoSerializer(rows)
+            self.assertTrue(Serializer.roundTrips(Serializer.getSerializer(tag), rows), tag)
+        finally:
+            Serializer.AUTO_CHOICES.clear()
+
+        self.assertNotEqual(Serializer.shapeOf([{'k': 'v'}]), Serializer.shapeOf([{'k': (1, 2)}]))
+        self.assertNotEqual(Serializer.shapeOf({'a': 1}), Serializer.shapeOf({1: 1}))
+
+    @unittest.skipIf(Serializer.orjson is None, 'orjson is not installed')
+    def testOrjson(self):
+        self.assertIn('orjson', Serializer.availableSerializers())
+        serializer = Serializer.getSerializer('orjson')
+        self.assertEqual(serializer.deserialize(serializer.serialize([1, 'a'])), [1, 'a'])
+
+class TestRegistryPassage(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.cc = CloudPassageHandler('http://127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testPushPull(self):
+        data = dict(rows=[[i, str(i)] for i in range(100)])
+        for tag in ('json-compact', 'marshal'):
+            self.cc.push(data, title=tag, serializer=tag)
+            self.assertEqual(self.cc.manifestPull(title=tag)[1]['metaData'], tag)
+            self.assertEqual(self.cc.pull(title=tag), data)
+
+        self.cc.push(data, title='auto', serializer='auto')
+        self.assertIn(self.cc.manifestPull(title='auto')[1]['metaData'], Serializer.availableSerializers())
+        self.assertEqual(self.cc.pull(title='auto'), data)
+
+        self.assertRaises(ValueError, self.cc.push, data, serializer='nope')
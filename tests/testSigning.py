@@ -0,0 +1,93 @@
+import io
+import os
+import hmac
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import restDriver
+from entrails.signing import Signer, SigningAuth
+from entrails.standInServer import StandInServer
+
+class TestSigner(unittest.TestCase):
+    def setUp(self):
+        self.key = b'secret'
+        self.signer = Signer(self.key)
+
+    def reference(self, item):
+        return hmac.new(self.key, item, hashlib.sha256).hexdigest()
+
+    def testIndependentOfHistory(self):
+        for item in (b'a', b'b', b'a'):
+            self.assertEqual(self.signer.sign(item), self.reference(item))
+
+        self.assertEqual(self.signer.sign(b'a', outputPlainBytes=True),
+                            hmac.new(self.key, b'a', hashlib.sha256).digest())
+        self.assertTrue(self.signer.verify(b'a', self.reference(b'a')))
+        self.assertFalse(self.signer.verify(b'b', self.reference(b'a')))
+
+    def testSignMany(self):
+        items = [os.urandom(size) for size in (10, 4096, 100000) * 10]
+        expected = [self.reference(item) for item in items]
+        self.assertEqual(self.signer.signMany(items, workers=4), expected)
+        self.assertEqual(self.signer.signMany(items, workers=1), expected)
+
+    def testSignStream(self):
+        data = os.urandom(300000)
+        self.assertEqual(self.signer.signStream(io.BytesIO(data)), self.reference(data))
+
+    def testRestDriverSignItems(self):
+        rd = restDriver.RestDriver('', secretKey='secret', publicKey='public')
+        self.assertEqual(rd.signItems(b'x', 12), [
+            hmac.new(b'secretpublic', b'x', hashlib.sha256).hexdigest(),
+            hmac.new(b'secretpublic', b'12', hashlib.sha256).hexdigest()
+        ])
+        self.assertEqual(rd.signItems(b'x'), rd.signItems(b'x'))
+
+class TestSignedRequests(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(signingKey='secretpublic').start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port,
+                    secretKey='secret', publicKey='public', signRequests=True)
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def testUnsignedRejected(self):
+        rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        self.assertEqual(rd.getCloudFilesManifest()['status_code'], 401)
+        self.assertEqual(self.server.rejectedRequests, 1)
+
+        self.assertRaises(ValueError, rd.enableRequestSigning)
+
+    def testLiasonAndBlobs(self):
+        self.rd.registerLiason('Job', '/jobTable/jobHandler')
+        self.assertEqual(self.rd.newJob(name='a')['status_code'], 200)
+        self.assertEqual(len(self.rd.getJobs(name='a')['value']['data']), 1)
+
+        data = os.urandom(200000)
+        path = os.path.join(self.tmpDir, 'blob.bin')
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        self.assertEqual(self.rd.uploadBlob(path, title='plain').status_code, 200)
+        self.assertEqual(self.rd.uploadBlob(path, title='parts', chunked=True,
+            partSize=65536, journalDir=self.tmpDir).status_code, 200)
+
+        for title in ('plain', 'parts'):
+            entry = self.rd.getCloudFilesManifest(title=title)['data'][0]
+            self.assertEqual(self.server.store.contents[entry['content']], data)
+
+        self.assertEqual(self.server.rejectedRequests, 0)
+
+    def testTampered(self):
+        self.rd.getConnectionPool().auth = SigningAuth(Signer('other'))
+        self.assertEqual(self.rd.getCloudFilesManifest()['status_code'], 401)
+
+        self.rd.disableRequestSigning()
+        self.rd.enableRequestSigning()
+        manifest = self.rd.getCloudFilesManifest()
+        self.assertEqual(manifest['status_code'], 200)
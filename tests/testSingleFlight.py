@@ -0,0 +1,145 @@
+import time
+import queue
+import threading
+import unittest
+
+import restDriver
+from entrails.dbLiason import DbConn
+from entrails.singleFlight import SingleFlight
+from entrails.standInServer import StandInServer, StandInHandler
+
+class SlowHandler(StandInHandler):
+    # GETs take long enough for concurrent callers to overlap
+    def do_GET(self):
+        time.sleep(0.2)
+        StandInHandler.do_GET(self)
+
+def runConcurrently(func, count):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        results[i] = func()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results
+
+class TestSingleFlight(unittest.TestCase):
+    def testErrorsShared(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        errors = []
+        def call():
+            try:
+                flight.do('k', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        call()
+        leader.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(flight.stats(), dict(calls=1, coalesced=1, inFlight=0))
+
+    def testBaseExceptionsShared(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def interrupt():
+            started.set()
+            time.sleep(0.1)
+            raise KeyboardInterrupt()
+
+        errors = []
+        def call():
+            try:
+                flight.do('k', interrupt)
+            except KeyboardInterrupt as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        call()
+        leader.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(flight.stats()['inFlight'], 0)
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(handlerClass=SlowHandler).start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        self.rd.registerLiason('Job', '/jobTable/jobHandler')
+        self.rd.newJob(name='a')
+        self.server.store.create(dict(title='t', checkSum='c'), b'x')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testManifest(self):
+        flight = self.rd.enableRequestCoalescing()
+        self.server.store.manifestRequests = 0
+
+        results = runConcurrently(lambda: self.rd.getCloudFilesManifest(checkSum='c'), 8)
+        self.assertEqual(self.server.store.manifestRequests, 1)
+        self.assertEqual([len(r['data']) for r in results], [1] * 8)
+        self.assertEqual(flight.stats()['calls'] + flight.stats()['coalesced'], 8)
+        self.assertEqual(flight.stats()['coalesced'], 7)
+
+        # Callers get their own copies
+        results[0]['data'][0]['title'] = 'changed'
+        self.assertEqual(results[1]['data'][0]['title'], 't')
+
+    def testLiasonGets(self):
+        self.rd.enableRequestCoalescing()
+        table = self.server.table('/jobTable/jobHandler')
+        table.requests = 0
+
+        results = runConcurrently(lambda: self.rd.getJobs(name='a'), 8)
+        self.assertEqual(table.requests, 1)
+        self.assertEqual(len(set(id(r) for r in results)), 8)
+        self.assertEqual(results[0], results[7])
+
+        # Different params are different flights
+        runConcurrently(lambda: self.rd.getJobs(name=threading.get_ident()), 3)
+        self.assertEqual(table.requests, 4)
+        self.assertEqual(self.rd.coalescingStats()['coalesced'], 7)
+
+    def testHeadersKeepFlightsApart(self):
+        flight = SingleFlight()
+        url = self.server.baseUrl + '/jobTable/jobHandler'
+        conns = [DbConn(url, singleFlight=flight) for i in range(2)]
+        conns[1]._updateHeaders({'Authorization': 'Bearer other'})
+        table = self.server.table('/jobTable/jobHandler')
+        table.requests = 0
+
+        # Identical gets, two on each connection
+        callers = queue.Queue()
+        for conn in conns * 2:
+            callers.put(conn)
+
+        runConcurrently(lambda: callers.get().get(name='a'), 4)
+        self.assertEqual(table.requests, 2)
+        self.assertEqual(flight.stats(), dict(calls=2, coalesced=2, inFlight=0))
+
+    def testDisabled(self):
+        self.server.store.manifestRequests = 0
+        runConcurrently(lambda: self.rd.getCloudFilesManifest(checkSum='c'), 4)
+        self.assertEqual(self.server.store.manifestRequests, 4)
+        self.assertIsNone(self.rd.coalescingStats())
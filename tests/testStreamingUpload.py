@@ -0,0 +1,102 @@
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from email.parser import BytesParser
+
+import restDriver
+from entrails.multipartStream import MultipartStream
+from entrails.fileOnCloudHandler import FileOnCloudHandler
+from entrails.standInServer import StandInServer, StandInHandler
+
+class FailFollowUpHandler(StandInHandler):
+    # Fails the updates that set the real checkSum of a hashed while uploading blob
+    failFollowUps = False
+
+    def do_PUT(self):
+        if FailFollowUpHandler.failFollowUps and 'checkSum=pending-' in self.path:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            return self.sendJSON(500, dict(reason='Unavailable'))
+
+        StandInHandler.do_PUT(self)
+
+class TestMultipartStream(unittest.TestCase):
+    def setUp(self):
+        self.blob = os.urandom(300000)
+
+    def parse(self, body, contentType):
+        msg = BytesParser().parsebytes(
+            b'Content-Type: ' + contentType.encode('utf-8') + b'\r\n\r\n' + body)
+        return dict(
+            (part.get_param('name', header='content-disposition'),
+             part.get_payload(decode=True)) for part in msg.get_payload()
+        )
+
+    def testBodyRoundTrip(self):
+        body = MultipartStream(dict(title='t', tags=['a', 'b'], size=10), io.BytesIO(self.blob))
+        raw = b''.join(iter(lambda: body.read(7919), b''))
+        self.assertEqual(len(raw), body.len)
+
+        parts = self.parse(raw, body.contentType)
+        self.assertEqual(parts['title'], b't')
+        self.assertEqual(parts['size'], b'10')
+        self.assertEqual(parts['blob'], self.blob)
+
+    def testHashWhileStreaming(self):
+        hasher = hashlib.sha1()
+        stream = io.BytesIO(self.blob)
+        stream.seek(1000)
+        body = MultipartStream({}, stream, hasher=hasher)
+        self.assertEqual(len(body.read()), body.len)
+        self.assertEqual(hasher.hexdigest(), hashlib.sha1(self.blob[1000:]).hexdigest())
+
+    def testUnknownLengthForTextStreams(self):
+        self.assertEqual(MultipartStream({}, io.StringIO('abc')).len, None)
+
+class TestChunkedCheckSum(unittest.TestCase):
+    def testMatchesWholeBufferCheckSum(self):
+        fH = FileOnCloudHandler('http://127.0.0.1:8000', 'sha1')
+        data = os.urandom(1 << 20) + b'tail'
+        for stream in (io.BytesIO(data), io.StringIO('hello')):
+            status, byStream = fH.getCheckSumByStream(stream, chunkSize=4096)
+            self.assertEqual(status, 200)
+            stream.seek(0)
+            expected = restDriver.toBytes(stream.read())
+            self.assertEqual(byStream.hexdigest(), hashlib.sha1(expected).hexdigest())
+
+        status, byStream = fH.getCheckSumByStream(io.BytesIO(data), algoName='md5')
+        self.assertEqual(byStream.hexdigest(), hashlib.md5(data).hexdigest())
+
+class TestHashWhileUploading(unittest.TestCase):
+    def setUp(self):
+        FailFollowUpHandler.failFollowUps = False
+        self.server = StandInServer(handlerClass=FailFollowUpHandler).start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+        self.tmpDir = tempfile.mkdtemp()
+        self.data = os.urandom(300000)
+        self.path = os.path.join(self.tmpDir, 'blob')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def testFollowUpSetsCheckSum(self):
+        response = self.rd.uploadBlob(self.path, title='hashed', hashWhileUploading=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['data']['checkSum'].startswith('pending-'))
+
+        entry = self.rd.getCloudFilesManifest(title='hashed')['data'][0]
+        self.assertEqual(entry['checkSum'], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(self.server.store.contents[entry['content']], self.data)
+
+    def testFailedFollowUp(self):
+        FailFollowUpHandler.failFollowUps = True
+        response = self.rd.uploadBlob(self.path, title='hashed', hashWhileUploading=True)
+        self.assertEqual(response.status_code, 500)
+
+        entry = self.rd.getCloudFilesManifest(title='hashed')['data'][0]
+        self.assertTrue(entry['checkSum'].startswith('pending-'))
@@ -0,0 +1,89 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import restDriver
+from entrails.standInServer import StandInServer, StandInHandler
+
+class FlakyUploadHandler(StandInHandler):
+    # Class level knobs: the next uploadFailures uploads fail after a delay,
+    # so that their duplicates are waiting on them, manifest fetches fail
+    # while failManifest is set.
+    uploadFailures = 0
+    failManifest = False
+
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') == '/uploader' and FlakyUploadHandler.failManifest:
+            return self.sendJSON(503, dict(reason='Unavailable'))
+
+        StandInHandler.do_GET(self)
+
+    def do_POST(self):
+        if self.path.rstrip('/') == '/uploader' and FlakyUploadHandler.uploadFailures:
+            FlakyUploadHandler.uploadFailures -= 1
+            time.sleep(0.2)
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            return self.sendJSON(500, dict(reason='Disk full'))
+
+        StandInHandler.do_POST(self)
+
+class TestUploadTree(unittest.TestCase):
+    def setUp(self):
+        FlakyUploadHandler.uploadFailures, FlakyUploadHandler.failManifest = 0, False
+        self.server = StandInServer(handlerClass=FlakyUploadHandler).start()
+        self.rd = restDriver.RestDriver('http://127.0.0.1', self.server.port)
+
+        self.tmpDir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpDir, 'sub', 'deeper'))
+        self.files = {
+            'a.bin': os.urandom(5000), 'sub/b.bin': os.urandom(70000),
+            'sub/deeper/c.bin': os.urandom(10), 'sub/dup.bin': b'',
+        }
+        self.files['sub/dup.bin'] = self.files['a.bin']
+        for relPath, data in self.files.items():
+            with open(os.path.join(self.tmpDir, relPath), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        self.server.stop()
+
+    def testUploadAndDedup(self):
+        summary = self.rd.uploadTree(self.tmpDir, workers=3, author='tester')
+        self.assertEqual(summary['uploaded'], 3)
+        self.assertEqual(summary['skipped'], 1) # Duplicate content within the tree
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual(len(summary['results']), 4)
+
+        manifest = self.rd.getCloudFilesManifest(author='tester')
+        self.assertEqual(manifest['status_code'], 200)
+        self.assertEqual(len(manifest['data']), 3)
+        for entry in manifest['data']:
+            self.assertEqual(self.server.store.contents[entry['content']], self.files[entry['title']])
+
+        # Everything is already on the cloud the second time round
+        summary = self.rd.uploadTree(self.tmpDir, workers=3, author='tester')
+        self.assertEqual(summary['uploaded'], 0)
+        self.assertEqual(summary['skipped'], 4)
+        self.assertEqual(summary['bytesSkipped'], sum(map(len, self.files.values())))
+        self.assertEqual(summary['dedup'], True)
+
+    def testDuplicateOfFailedUpload(self):
+        copies = os.path.join(self.tmpDir, 'copies')
+        os.makedirs(copies)
+        for i in range(3):
+            with open(os.path.join(copies, 'copy%d'%(i)), 'wb') as f:
+                f.write(b'same')
+
+        FlakyUploadHandler.uploadFailures = 1
+        summary = self.rd.uploadTree(copies, workers=3)
+        self.assertEqual((summary['uploaded'], summary['skipped'], summary['failed']), (1, 1, 1))
+        self.assertEqual(list(self.server.store.contents.values()), [b'same'])
+
+    def testManifestFetchFailure(self):
+        FlakyUploadHandler.failManifest = True
+        summary = self.rd.uploadTree(self.tmpDir, workers=3)
+        self.assertEqual((summary['dedup'], summary['uploaded'], summary['skipped']), (False, 3, 1))
+        self.assertIn('503', summary['dedupError'])